@@ -0,0 +1,363 @@
+# Copyright (c) 2017 Fabian Friedl
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# asyncio version of GBReader. The serial port is used without blocking: reads return immediately and the
+# coroutines wait for the port to become readable (or poll on platforms without add_reader support), so a
+# single event loop can drive many readers and stays responsive while dumping.
+#
+#   reader = await AsyncGBReader.connect(port)
+#   cartridge = await reader.readCartridgeHeader()
+#   async for bank, data in reader.readBanks(cartridge):
+#       ...
+
+import asyncio, hashlib, io, time
+import serial
+
+from GBReader import *
+
+
+class AsyncGBReader(GBProtocol):
+    ASYNC_POLL_INTERVAL = 0.005  # polling interval where the event loop can not watch the serial port
+
+    def __init__(self, port, framed=False, maxRetries=5):
+        """
+        Use AsyncGBReader.connect to open a reader.
+        :param port: Serial port of the reader
+        :param framed: Transfer banks as CRC checked frames (protocol 4)
+        :param maxRetries: Retransmissions of a bad frame before giving up
+        """
+        super().__init__(framed)
+        self.port = port
+        self.maxRetries = maxRetries
+
+        self.blockErrors = {}  # bad frames per bank of the last dump
+        self.retries = 0  # retransmissions of the last dump
+
+        self.ser = None
+        self.throughput = None
+        self.connectLatency = None
+
+        self._lock = asyncio.Lock()  # one command at a time, held by readBanks for the whole transfer
+        self._watchable = False  # event loop can wait for the port to become readable
+        self._interrupted = False  # a command was cancelled, its answer may still arrive
+
+    @classmethod
+    async def connect(cls, port, framed=False, maxRetries=5, connectTimeout=GBProtocol.CONNECT_TIMEOUT):
+        """
+        Open the port and poll the handshake until the reader answers.
+        :raises NoGBReaderException: Port can not be opened or no reader answered within connectTimeout seconds
+        """
+        reader = cls(port, framed, maxRetries)
+        loop = asyncio.get_running_loop()
+
+        start = time.perf_counter()
+        try:
+            # opening may block for a while on some platforms
+            reader.ser = await loop.run_in_executor(None, lambda: serial.Serial(port, 76800, timeout=0))
+        except serial.serialutil.SerialException:
+            raise NoGBReaderException()
+        reader.throughput = reader._linkThroughput(reader.ser.baudrate)
+        reader._watchable = reader._canWatch(loop)
+
+        try:
+            if not await reader._connect(start + connectTimeout):
+                raise NoGBReaderException()
+            reader.connectLatency = time.perf_counter() - start
+            reader.protocolVersion = min(await reader._readProtocolVersion(), reader.PROTOCOL_VERSION)
+            if reader.protocolVersion >= 7:  # a previous session may have left a delay for another cartridge
+                await reader._command([0x11, reader.DEFAULT_BUS_DELAY], 1, 'bus_delay')
+            if reader.protocolVersion >= 9:  # the firmware switches the banks for this class
+                await reader._command([0x14, 0], 1, 'bank_switching')
+        except BaseException:
+            reader.close()
+            raise
+
+        return reader
+
+    def close(self):
+        if self.ser is not None:
+            self.ser.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, excType, excValue, traceback):
+        self.close()
+
+    async def readCartridgeHeader(self):
+        async with self._lock:
+            if self.protocolVersion >= 2:
+                return self._parseCartridgeHeader(await self._readHeaderBlock())
+
+            cartridgeType = self._parseCartridgeType((await self._command([0x02], 1, 'cartridge_type'))[0])
+
+            romSize = (await self._command([0x03], 1, 'rom_size'))[0]
+            romSizeKB = self._parseROMSizeKB(romSize)
+            romBankCount = self._parseROMBankCount(romSize)
+
+            cgbFlag = self._parseCGBFlag((await self._command([0x04], 1, 'cgb_flag'))[0])
+            gameTitle = self._parseGameTitle(await self._command([0x05], 0x0143 - 0x0134 + 1, 'game_title'), cgbFlag)
+            nintendoLogo = await self._command([0x06], 0x0133 - 0x0104 + 1, 'nintendo_logo')
+            globalChecksum = self._parseGlobalChecksum(await self._command([0x08], 2, 'global_checksum'))
+
+            return GBCartridge(cartridgeType, romSizeKB, romBankCount, cgbFlag, gameTitle, nintendoLogo,
+                               globalChecksum)
+
+    async def readBanks(self, cartridge, banks=None):
+        """
+        Asynchronous iterator of (bank number, bank data) of the cartridge ROM. The reader is locked until the
+        iteration ends. Leaving the iteration early or cancelling the consuming task is safe, the rest of the
+        transfer is discarded before the next command.
+        :param banks: Bank numbers to read (needs protocol 3), default: the whole ROM in one transfer
+        """
+        async with self._lock:
+            await self._checkCartridge(cartridge)
+            self.blockErrors = {}
+            self.retries = 0
+
+            if banks is not None or self._useFramedTransfer():
+                if self.protocolVersion < 3:
+                    raise GBTransferException('read_bank_unsupported')
+                for bank in (range(0, cartridge.romBankCount) if banks is None else banks):
+                    yield bank, await self._readBank(bank)
+                return
+
+            size = cartridge.romBankCount * self.BANK_SIZE
+            await self._write([0x07])
+            self._interrupted = True  # until the last byte of the dump is received
+            dumpDeadline = self._deadline(size)
+
+            for bank in range(0, cartridge.romBankCount):
+                data = bytearray(self.BANK_SIZE)
+                await self._readInto(memoryview(data), 'dump', min(self._deadline(len(data)), dumpDeadline),
+                                     bank * self.BANK_SIZE, size)
+                if bank == cartridge.romBankCount - 1:
+                    self._interrupted = False
+                yield bank, bytes(data)
+
+    async def readGameData(self, cartridge, progressFunction=None, filename=None):
+        """
+        Read the whole ROM of the cartridge, see GBReader.readGameData. Streamed dumps keep a journal, so
+        GBReader.resumeGameData can complete them.
+        :return: ROM as bytes or filename in streaming mode
+        """
+        size = cartridge.romBankCount * self.BANK_SIZE
+        checksum = 0
+        romHash = ROMHash()
+
+        if filename is None:
+            data = bytearray(size)
+            async for bank, bankData in self.readBanks(cartridge):
+                data[bank * self.BANK_SIZE:(bank + 1) * self.BANK_SIZE] = bankData
+                romHash.update(bankData)
+                if progressFunction is not None:
+                    progressFunction((bank + 1) * self.BANK_SIZE, size)
+
+            cartridge.gameData = bytes(data)
+            cartridge.romFile = None
+            cartridge.romChecksum = None
+            cartridge.romHashes = romHash.hexdigests()
+            return cartridge.gameData
+
+        journal = DumpJournal.create(filename, cartridge)
+        with open(filename, 'wb') as file:
+            async for bank, bankData in self.readBanks(cartridge):
+                file.write(bankData)
+                file.flush()
+                checksum = self._calculateGlobalChecksum(bankData, bank * self.BANK_SIZE, checksum)
+                romHash.update(bankData)
+                journal.addBank(bank, hashlib.sha1(bankData).hexdigest())
+                if progressFunction is not None:
+                    progressFunction((bank + 1) * self.BANK_SIZE, size)
+        journal.remove()
+
+        cartridge.romChecksum = checksum
+        cartridge.romHashes = romHash.hexdigests()
+        cartridge.gameData = None
+        cartridge.romFile = filename
+        return filename
+
+    def checkGlobalChecksum(self, cartridge):
+        if cartridge.gameData is not None:
+            checksum = self._calculateGlobalChecksum(cartridge.gameData)
+        else:
+            checksum = cartridge.romChecksum
+        return checksum == cartridge.globalChecksum
+
+    async def _checkCartridge(self, cartridge):
+        if self.protocolVersion >= 2:
+            header = await self._readHeaderBlock()
+            globalChecksum = self._parseGlobalChecksum(header[0x4E:0x50])
+            romSize = header[0x48]
+        else:
+            globalChecksum = self._parseGlobalChecksum(await self._command([0x08], 2, 'global_checksum'))
+            romSize = None
+
+        if globalChecksum != cartridge.globalChecksum:
+            raise GBCartridgeChangedException('checksum_changed')
+
+        if romSize is None:
+            romSize = (await self._command([0x03], 1, 'rom_size'))[0]
+        self._updateROMSize(cartridge, romSize)
+
+    ######################################################################################
+    # Serial I/O
+    #####
+    def _canWatch(self, loop):
+        try:
+            loop.add_reader(self.ser.fileno(), lambda: None)
+            loop.remove_reader(self.ser.fileno())
+            return True
+        except (AttributeError, NotImplementedError, io.UnsupportedOperation):
+            return False  # e.g. Windows or the proactor event loop
+
+    async def _waitReadable(self, timeout):
+        """
+        Wait at most timeout seconds for received bytes.
+        """
+        if not self._watchable:
+            await asyncio.sleep(min(timeout, self.ASYNC_POLL_INTERVAL))
+            return
+
+        loop = asyncio.get_running_loop()
+        readable = loop.create_future()
+        loop.add_reader(self.ser.fileno(), lambda: readable.done() or readable.set_result(None))
+        try:
+            await asyncio.wait_for(readable, timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            loop.remove_reader(self.ser.fileno())
+
+    async def _readInto(self, view, operation, deadline=None, offset=0, total=None,
+                        stallTimeout=GBProtocol.STALL_TIMEOUT):
+        """
+        Fill view with received bytes, see GBReader._readInto.
+        """
+        start = lastReceived = time.perf_counter()
+        if deadline is None:
+            deadline = self._deadline(len(view), start)
+
+        position = 0
+        while position < len(view):
+            count = self.ser.readinto(view[position:]) or 0  # does not block
+            if count > 0:
+                position += count
+                lastReceived = time.perf_counter()
+                continue
+
+            now = time.perf_counter()
+            timeout = min(deadline, lastReceived + stallTimeout) - now
+            if timeout <= 0:
+                raise GBTimeoutException(operation, offset + position, total if total is not None else len(view))
+            await self._waitReadable(timeout)
+
+        self._measureThroughput(len(view), time.perf_counter() - start)
+
+    async def _read(self, size, operation, timeout=None):
+        data = bytearray(size)
+        if timeout is None:
+            await self._readInto(memoryview(data), operation)
+        else:
+            await self._readInto(memoryview(data), operation, time.perf_counter() + timeout, stallTimeout=timeout)
+        return bytes(data)
+
+    async def _write(self, data):
+        if self._interrupted:
+            await self._drain(self.STALL_TIMEOUT)  # rest of a cancelled transfer
+            self._interrupted = False
+        self.ser.write(bytes(data))
+
+    async def _command(self, command, size, operation, timeout=None):
+        """
+        Send a command and receive its answer of size bytes.
+        """
+        await self._write(command)
+        self._interrupted = True
+        data = await self._read(size, operation, timeout)
+        self._interrupted = False
+        return data
+
+    async def _drain(self, quietTime):
+        lastReceived = time.perf_counter()
+        while True:
+            if self.ser.read(max(1, self.ser.in_waiting)):
+                lastReceived = time.perf_counter()
+                continue
+
+            timeout = lastReceived + quietTime - time.perf_counter()
+            if timeout <= 0:
+                return
+            await self._waitReadable(timeout)
+
+    async def _connect(self, deadline):
+        attempt = 0
+        while time.perf_counter() < deadline:
+            timeout = self.CONNECT_POLL_INTERVALS[min(attempt, len(self.CONNECT_POLL_INTERVALS) - 1)]
+            attempt += 1
+
+            if await self._performHandshake(min(timeout, max(deadline - time.perf_counter(), 0.001))):
+                if attempt > 1:
+                    await self._drain(timeout)  # late answers to previous handshakes
+                return True
+
+        return False
+
+    async def _performHandshake(self, timeout=GBProtocol.HANDSHAKE_TIMEOUT):
+        try:
+            c = await self._command([0x01], 1, 'handshake', timeout)
+        except GBTimeoutException:
+            self._interrupted = False  # late answers are drained by _connect
+            return False
+        return c[0] == 0xA0
+
+    async def _readProtocolVersion(self):
+        try:
+            c = await self._command([0x09], 1, 'protocol_version', self.VERSION_TIMEOUT)
+        except GBTimeoutException:
+            self._interrupted = False
+            return 1  # firmware does not know the version command
+        return c[0]
+
+    async def _readHeaderBlock(self):
+        return self._parseHeaderBlock(await self._command([0x0A], self.HEADER_SIZE + 1, 'header'))
+
+    async def _readBank(self, bank):
+        if not self._useFramedTransfer():
+            return await self._command([0x0B, bank >> 8, bank & 0xFF], self.BANK_SIZE, 'bank')
+
+        for attempt in range(0, self.maxRetries + 1):
+            if attempt > 0:
+                self.retries += 1
+                self.ser.reset_input_buffer()  # drop the rest of the bad frame
+
+            try:
+                frame = await self._command([0x0C, bank >> 8, bank & 0xFF], self.FRAME_SIZE, 'bank')
+            except GBTimeoutException:
+                frame = b''  # lost bytes, retransmit
+            self._interrupted = False
+
+            data = self._parseFrame(frame, bank)
+            if data is not None:
+                return data
+
+            self.blockErrors[bank] = self.blockErrors.get(bank, 0) + 1
+
+        raise GBTransferException('bank_failed')
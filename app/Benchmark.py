@@ -0,0 +1,203 @@
+# Copyright (c) 2017 Fabian Friedl
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# End-to-end benchmarks of the GBReader hot paths against the virtual reader.
+#
+#   python Benchmark.py --output results.json
+#   python Benchmark.py --baseline results.json     (exit code 1 on regressions)
+
+import json, os, platform, statistics, subprocess, sys, tempfile, time
+
+from GBReader import GBReader, GBProtocol
+from VirtualGBReader import VirtualGBReader, buildROM
+
+
+def sizeLabel(size):
+    if size >= 1024 * 1024:
+        return str(size // (1024 * 1024)) + "MiB"
+    return str(size // 1024) + "KiB"
+
+
+class Benchmark:
+
+    def __init__(self, romSizes=range(0, 8 + 1), repeat=3, roms=(), latency=0.0, baudrate=None):
+        """
+        Benchmark of the GBReader hot paths.
+        :param romSizes: ROM size codes (0x0148) of the synthetic ROMs to dump
+        :param repeat: Number of runs per measurement, the median is reported
+        :param roms: Recorded ROM images (bytes) to dump in addition to the synthetic ones
+        :param latency: Per-byte latency of the virtual reader in seconds
+        :param baudrate: Emulated baud rate of the virtual reader or None
+        """
+        self.romSizes = list(romSizes)
+        self.repeat = repeat
+        self.roms = list(roms)
+        self.latency = latency
+        self.baudrate = baudrate
+
+        self.results = {}
+
+    def run(self):
+        roms = [buildROM(romSize) for romSize in self.romSizes] + self.roms
+
+        for index, rom in enumerate(roms):
+            with VirtualGBReader(rom, latency=self.latency, baudrate=self.baudrate) as device:
+                if index == 0:
+                    self._benchmarkConnect(device.port)
+
+                reader = GBReader(device.port)
+                try:
+                    self._benchmarkROM(reader, index == 0)
+                finally:
+                    reader.close()
+
+        self._benchmarkNintendoLogo()
+        self._benchmarkHeaderValidation()
+        self._benchmarkCLIStartup()
+
+        return {"environment": {"python": platform.python_version(), "platform": platform.platform(),
+                                "latency": self.latency, "baudrate": self.baudrate},
+                "results": self.results}
+
+    def _benchmarkConnect(self, port):
+        def connect():
+            GBReader(port).close()
+
+        self._measure("connect", connect)
+
+    def _benchmarkROM(self, reader, header):
+        cartridge = reader.readCartridgeHeader()
+        if header:
+            self._measure("readCartridgeHeader", reader.readCartridgeHeader)
+
+        size = int(cartridge.romSizeKB * 1024)
+        label = sizeLabel(size)
+
+        self._measure("readGameData[" + label + "]", lambda: reader.readGameData(cartridge, lambda current, max: None),
+                      size)
+        self._measure("checkGlobalChecksum[" + label + "]", lambda: reader.checkGlobalChecksum(cartridge), size)
+
+        with tempfile.TemporaryDirectory() as directory:
+            def save():
+                with open(os.path.join(directory, "rom.gb"), 'wb') as file:
+                    reader.saveROMFile(cartridge, file)
+
+            self._measure("saveROMFile[" + label + "]", save, size)
+
+            self._measure("streamGameData[" + label + "]",
+                          lambda: reader.readGameData(cartridge, lambda current, max: None,
+                                                      os.path.join(directory, "stream.gb")), size)
+
+    def _benchmarkNintendoLogo(self):
+        try:
+            from NintendoLogo import NintendoLogo
+        except ImportError:
+            return  # PIL is not installed
+
+        logo = buildROM(0)[0x0104:0x0134]
+        self._measure("NintendoLogo", lambda: NintendoLogo(logo))
+        self._measure("NintendoLogo[uncached]", lambda: NintendoLogo._render.__wrapped__(logo))
+
+    def _benchmarkHeaderValidation(self):
+        header = buildROM(0)[GBProtocol.HEADER_START:GBProtocol.HEADER_START + GBProtocol.HEADER_SIZE]
+        self._measure("headerValid", lambda: GBProtocol()._parseCartridgeHeader(header).headerValid())
+
+    def _benchmarkCLIStartup(self):
+        """
+        Cold start of the command line interface in a new interpreter, from process start to parsed arguments.
+        """
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ReaderCLI.py")
+        self._measure("cliStartup", lambda: subprocess.run([sys.executable, script, "--help"],
+                                                           stdout=subprocess.DEVNULL, check=True))
+
+    def _measure(self, name, function, size=None):
+        runs = []
+        for i in range(0, self.repeat):
+            start = time.perf_counter()
+            function()
+            runs.append(time.perf_counter() - start)
+
+        result = {"seconds": statistics.median(runs), "runs": runs}
+        if size is not None:
+            result["bytes"] = size
+            result["bytesPerSecond"] = size / result["seconds"] if result["seconds"] > 0 else None
+
+        self.results[name] = result
+        return result
+
+
+def compare(results, baseline, tolerance=0.25, noise=0.001):
+    """
+    Compare benchmark results against a stored baseline.
+    :param results: Results as returned by Benchmark.run
+    :param baseline: Baseline results as returned by Benchmark.run
+    :param tolerance: Allowed slowdown relative to the baseline (0.25 = 25%)
+    :param noise: Slowdowns below this many seconds are ignored as measurement noise
+    :return: List of (name, baseline seconds, current seconds) of all regressions
+    """
+    regressions = []
+    for name, result in results["results"].items():
+        if name not in baseline["results"]:
+            continue
+
+        baselineSeconds = baseline["results"][name]["seconds"]
+        if result["seconds"] > baselineSeconds * (1 + tolerance) and result["seconds"] - baselineSeconds > noise:
+            regressions.append((name, baselineSeconds, result["seconds"]))
+
+    return regressions
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark the GB reader hot paths against a virtual reader")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(range(0, 8 + 1)),
+                        help="ROM size codes to dump (0: 32 KiB ... 8: 8 MiB)")
+    parser.add_argument("--rom", nargs="*", default=[], help="recorded .gb/.gbc images to dump as well")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per measurement")
+    parser.add_argument("--latency", type=float, default=0.0, help="per-byte latency of the virtual reader")
+    parser.add_argument("--baudrate", type=int, default=None, help="emulated baud rate of the virtual reader")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--baseline", help="compare against results stored in this JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown against the baseline")
+    args = parser.parse_args()
+
+    recorded = []
+    for filename in args.rom:
+        with open(filename, 'rb') as file:
+            recorded.append(file.read())
+
+    results = Benchmark(args.sizes, args.repeat, recorded, args.latency, args.baudrate).run()
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+
+        for name, baselineSeconds, seconds in regressions:
+            sys.stderr.write("Regression in %s: %.6f s -> %.6f s\n" % (name, baselineSeconds, seconds))
+
+        sys.exit(1 if regressions else 0)
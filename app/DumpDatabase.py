@@ -0,0 +1,178 @@
+# Copyright (c) 2017 Fabian Friedl
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import json, os, re
+from enum import Enum
+from threading import Lock
+
+
+class DumpStatus(Enum):
+    VERIFIED = 0  # hashes match a known good dump
+    UNKNOWN = 1  # neither the hashes nor the header are known
+    BAD = 2  # the header belongs to a known dump but the hashes differ
+
+
+class DumpDatabase:
+    DEFAULT_FILE = os.path.join(os.path.expanduser("~"), ".gbreader", "dumps.json")
+
+    def __init__(self, filename=DEFAULT_FILE):
+        """
+        Database of known good dumps, imported from DAT files (Logiqx XML or ClrMamePro) and stored as JSON.
+        Entries are indexed in memory by SHA-1, MD5, CRC32 and size, and by the header of verified cartridges.
+        :param filename: JSON file of the database
+        """
+        self.filename = filename
+
+        self._lock = Lock()
+        self._entries = []  # {"name", "size", "crc32", "md5", "sha1", "header"} with lower case hex hashes
+        self._bySHA1 = {}
+        self._byMD5 = {}
+        self._byCRC32 = {}  # (crc32, size) -> entry
+        self._byHeader = {}  # header key -> entry, learned from verified dumps
+
+        self._load()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def importDAT(self, filename):
+        """
+        Import all ROMs of a DAT file and save the database.
+        :return: Number of imported ROMs
+        """
+        with open(filename, encoding="utf-8", errors="replace") as file:
+            xml = file.read(1024).lstrip().startswith('<')
+            if not xml:
+                file.seek(0)
+                text = file.read()
+
+        roms = self._parseXMLDAT(filename) if xml else self._parseClrMameProDAT(text)
+        with self._lock:
+            count = 0
+            for rom in roms:
+                if rom["sha1"] is None or rom["sha1"] not in self._bySHA1:
+                    self._add(rom)
+                    count += 1
+            self._save()
+        return count
+
+    def lookup(self, sha1=None, md5=None, crc32=None, size=None):
+        """
+        :return: Entry matching one of the hashes (CRC32 only together with the size) or None
+        """
+        entry = None
+        if sha1 is not None:
+            entry = self._bySHA1.get(sha1.lower())
+        if entry is None and md5 is not None:
+            entry = self._byMD5.get(md5.lower())
+        if entry is None and crc32 is not None and size is not None:
+            entry = self._byCRC32.get((crc32.lower(), size))
+        return entry
+
+    def lookupHeader(self, cartridge):
+        """
+        :return: Entry of a verified dump with the same header as the cartridge or None
+        """
+        return self._byHeader.get(self._headerKey(cartridge))
+
+    def classify(self, cartridge):
+        """
+        Classify a dump by its hashes (GBCartridge.romHashes). A verified cartridge header is remembered, so later
+        dumps of the same cartridge with different hashes are recognized as bad.
+        :return: (DumpStatus, matching entry or None)
+        """
+        hashes = cartridge.romHashes
+        entry = self.lookup(hashes["sha1"], hashes["md5"], hashes["crc32"], cartridge.romBankCount * 0x4000)
+        if entry is not None:
+            key = self._headerKey(cartridge)
+            if entry.get("header") != key:
+                with self._lock:
+                    entry["header"] = key
+                    self._byHeader[key] = entry
+                    self._save()
+            return DumpStatus.VERIFIED, entry
+
+        entry = self.lookupHeader(cartridge)
+        if entry is not None:
+            return DumpStatus.BAD, entry
+        return DumpStatus.UNKNOWN, None
+
+    def _add(self, rom):
+        entry = {"name": rom.get("name"), "size": rom.get("size"), "crc32": rom.get("crc32"), "md5": rom.get("md5"),
+                 "sha1": rom.get("sha1"), "header": rom.get("header")}
+        self._entries.append(entry)
+        self._index(entry)
+
+    def _index(self, entry):
+        if entry["sha1"]:
+            self._bySHA1[entry["sha1"]] = entry
+        if entry["md5"]:
+            self._byMD5[entry["md5"]] = entry
+        if entry["crc32"] and entry["size"] is not None:
+            self._byCRC32[(entry["crc32"], entry["size"])] = entry
+        if entry["header"]:
+            self._byHeader[entry["header"]] = entry
+
+    @staticmethod
+    def _headerKey(cartridge):
+        return "%s|%s|%d|%04X" % (cartridge.gameTitle.rstrip('\x00'), cartridge.cartridgeType,
+                                  cartridge.romBankCount, cartridge.globalChecksum)
+
+    @staticmethod
+    def _rom(name, size, crc32, md5, sha1):
+        return {"name": name, "size": int(size) if size else None, "crc32": crc32.lower() if crc32 else None,
+                "md5": md5.lower() if md5 else None, "sha1": sha1.lower() if sha1 else None}
+
+    def _parseXMLDAT(self, filename):
+        import xml.etree.ElementTree as ElementTree
+
+        roms = []
+        for event, element in ElementTree.iterparse(filename):
+            if element.tag == "game" or element.tag == "machine":
+                for rom in element.iter("rom"):
+                    roms.append(self._rom(rom.get("name") or element.get("name"), rom.get("size"), rom.get("crc"),
+                                          rom.get("md5"), rom.get("sha1")))
+                element.clear()  # keep the memory usage flat for large DAT files
+        return roms
+
+    def _parseClrMameProDAT(self, text):
+        roms = []
+        for block in re.finditer(r'\brom\s*\(((?:"[^"]*"|[^")])*)\)', text):
+            fields = {key: value.strip('"') for key, value in re.findall(r'(\w+)\s+("[^"]*"|\S+)', block.group(1))}
+            roms.append(self._rom(fields.get("name"), fields.get("size"), fields.get("crc"), fields.get("md5"),
+                                  fields.get("sha1")))
+        return roms
+
+    def _load(self):
+        try:
+            with open(self.filename) as file:
+                entries = json.load(file)["entries"]
+        except (OSError, ValueError, KeyError):
+            return  # no or damaged database, start empty
+
+        for entry in entries:
+            self._entries.append(entry)
+            self._index(entry)
+
+    def _save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.filename)), exist_ok=True)
+        with open(self.filename + '.tmp', 'w') as file:
+            json.dump({"entries": self._entries}, file)
+        os.replace(self.filename + '.tmp', self.filename)
@@ -0,0 +1,209 @@
+# Copyright (c) 2017 Fabian Friedl
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Dumps the cartridges of several GB readers at the same time, one worker thread per reader.
+# The serial I/O releases the GIL, so threads scale with the number of readers.
+
+import os, queue, re, time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+from GBReader import *
+
+
+def romFilename(cartridge, copy=1):
+    """
+    File name for a dumped cartridge: title and global checksum, .gbc for CGB cartridges.
+    :param copy: Number of the copy if several readers hold the same cartridge, appended from the second copy on
+    """
+    title = re.sub('[^A-Za-z0-9]+', '_', cartridge.gameTitle).strip('_') or "UNKNOWN"
+    extension = '.gb' if cartridge.cgbFlag == CGBFlag.UNDEFINED else '.gbc'
+    suffix = '' if copy == 1 else '_%d' % copy
+    return "%s_%04X%s%s" % (title, cartridge.globalChecksum, suffix, extension)
+
+
+class DumpResult:
+
+    def __init__(self, port, cartridge=None, filename=None, checksumValid=False, seconds=0.0, retries=0, error=None):
+        self.port = port
+        self.cartridge = cartridge
+        self.filename = filename
+        self.checksumValid = checksumValid
+        self.seconds = seconds
+        self.retries = retries  # resumed transfers, repeated dumps and restarts after a cartridge change
+        self.error = error  # exception of a failed dump or None
+
+
+class DumpFarm:
+
+    def __init__(self, ports, directory, retries=3, progressFunction=None, **readerOptions):
+        """
+        Dump farm for several GB readers.
+        :param ports: Serial ports of the readers
+        :param directory: Directory the ROMs are written to
+        :param retries: Resumes/restarts per reader before the dump is given up
+        :param progressFunction: Called with (port, current, max) for every progress update of every reader
+        :param readerOptions: Keyword arguments for GBReader (e.g. framed=True)
+        """
+        self.ports = list(ports)
+        self.directory = directory
+        self.retries = retries
+        self.progressFunction = progressFunction
+        self.readerOptions = readerOptions
+
+        self.readers = {}  # port -> GBReader, opened by the workers and kept for the next round
+        self.progress = {port: (0, 0) for port in self.ports}  # port -> (current, max) of the running dump
+        self.results = queue.Queue()  # DumpResult of every finished dump
+
+        self._lock = Lock()
+        self._filenames = set()  # ROM files of the running dumps
+
+    def dumpAll(self):
+        """
+        Dump the cartridges of all readers concurrently. Every result is put into the results queue as soon as it
+        is finished.
+        :return: List of DumpResult in the order of ports
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        with ThreadPoolExecutor(max_workers=max(1, len(self.ports))) as executor:
+            return list(executor.map(self._dump, self.ports))
+
+    def close(self):
+        for reader in self.readers.values():
+            reader.close()
+        self.readers = {}
+
+    def _reader(self, port):
+        with self._lock:
+            reader = self.readers.get(port)
+        if reader is None:
+            reader = GBReader(port, **self.readerOptions)
+            with self._lock:
+                self.readers[port] = reader
+        return reader
+
+    def _dump(self, port):
+        start = time.perf_counter()
+        result = DumpResult(port)
+
+        def progress(current, max):
+            self.progress[port] = (current, max)
+            if self.progressFunction is not None:
+                self.progressFunction(port, current, max)
+
+        filename = None
+        try:
+            reader = self._reader(port)
+            cartridge = reader.readCartridgeHeader()
+            reader.checkHeader(cartridge)
+            filename = self._reserveFilename(cartridge)
+
+            resume = False
+            while True:
+                try:
+                    if resume:
+                        reader.resumeGameData(cartridge, progress, filename)
+                    else:
+                        reader.readGameData(cartridge, progress, filename)
+
+                    result.checksumValid = reader.checkGlobalChecksum(cartridge)
+                    if result.checksumValid or result.retries >= self.retries:
+                        break
+
+                    # bad checksum: the cartridge was swapped during the dump or bytes were lost on the link
+                    if reader.readCartridgeHeader().globalChecksum != cartridge.globalChecksum:
+                        raise GBCartridgeChangedException('checksum_changed')
+                    resume = False
+                except GBTransferException:
+                    if result.retries >= self.retries:
+                        raise
+                    resume = True  # fetch only the missing banks
+                except GBCartridgeChangedException:
+                    if result.retries >= self.retries:
+                        raise
+                    DumpJournal(filename).remove()
+                    if os.path.exists(filename):
+                        os.remove(filename)
+                    self._releaseFilename(filename)
+                    filename = None
+                    cartridge = reader.readCartridgeHeader()  # start over with the new cartridge
+                    reader.checkHeader(cartridge)
+                    filename = self._reserveFilename(cartridge)
+                    resume = False
+                result.retries += 1
+
+            result.cartridge = cartridge
+            result.filename = filename
+        except (NoGBReaderException, UnknownGBDataException, GBCartridgeChangedException, GBTransferException,
+                serial.serialutil.SerialException, OSError) as e:  # unplugged readers fail with the last two
+            result.error = e
+            self._closeReader(port)  # reconnect in the next round
+        finally:
+            if filename is not None:
+                self._releaseFilename(filename)
+
+        result.seconds = time.perf_counter() - start
+        self.results.put(result)
+        return result
+
+    def _reserveFilename(self, cartridge):
+        """
+        Path for the ROM of cartridge that no other running dump writes to. Readers holding the same cartridge would
+        otherwise share the ROM file and its journal.
+        """
+        with self._lock:
+            copy = 1
+            while os.path.join(self.directory, romFilename(cartridge, copy)) in self._filenames:
+                copy += 1
+            filename = os.path.join(self.directory, romFilename(cartridge, copy))
+            self._filenames.add(filename)
+        return filename
+
+    def _releaseFilename(self, filename):
+        with self._lock:
+            self._filenames.discard(filename)
+
+    def _closeReader(self, port):
+        with self._lock:
+            reader = self.readers.pop(port, None)
+        if reader is not None:
+            reader.close()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Dump the cartridges of several GB readers at the same time")
+    parser.add_argument("ports", nargs="+", help="serial ports of the readers")
+    parser.add_argument("--output", default=".", help="directory for the ROM files")
+    parser.add_argument("--framed", action="store_true", help="use CRC checked framed transfers")
+    parser.add_argument("--compressed", action="store_true", help="use run-length compressed transfers")
+    args = parser.parse_args()
+
+    farm = DumpFarm(args.ports, args.output, framed=args.framed, compressed=args.compressed)
+    try:
+        for result in farm.dumpAll():
+            if result.error is not None:
+                print(result.port + ": failed (" + repr(result.error) + ")")
+            else:
+                print(result.port + ": " + result.filename + (" checksum correct" if result.checksumValid else
+                                                              " checksum incorrect") + " in %.1f s" % result.seconds)
+    finally:
+        farm.close()
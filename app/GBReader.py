@@ -18,72 +18,74 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
-import serial, time
+import serial, time, shutil, os, json, hashlib, binascii, random, zlib, math
 from enum import Enum
 
+from MBCDriver import *
 
-class GBReader:
-    cartridgeTypes = {0x00: "ROM ONLY", 0x01: "MBC1", 0x02: "MBC1+RAM", 0x03: "MBC1+RAM+BATTERY", 0x05: "MBC2",
-                      0x06: "MBC2+BATTERY", 0x08: "ROM+RAM", 0x09: "ROM+RAM+BATTERY", 0x0B: "MMM01", 0x0C: "MMM01+RAM",
-                      0x0D: "MMM01+RAM+BATTERY", 0x0F: "MBC3+TIMER+BATTERY", 0x10: "MBC3+TIMER+RAM+BATTERY",
-                      0x11: "MBC3", 0x12: "MBC3+RAM", 0x13: "MBC3+RAM+BATTERY", 0x15: "MBC4", 0x16: "MBC4+RAM",
-                      0x17: "MBC4+RAM+BATTERY", 0x19: "MBC5", 0x1A: "MBC5+RAM", 0x1B: "MBC5+RAM+BATTERY",
-                      0x1C: "MBC5+RUMBLE", 0x1D: "MBC5+RUMBLE+RAM", 0x1E: "MBC5+RUMBLE+RAM+BATTERY",
-                      0xFC: "POCKET CAMERA", 0xFD: "BANDAI TAMA5", 0xFE: "HUC3", 0xFF: "HUC1+RAM+BATTERY"}
 
-    def __init__(self, port):
-        try:
-            self.port = port
-            self.ser = serial.Serial(port, 76800, timeout=2) # 76800
+class GBProtocol:
+    """
+    Protocol constants and parsing shared by GBReader and AsyncGBReader.
+    """
+    BANK_SIZE = 0x4000  # size of one ROM bank in bytes
+    HEADER_START = 0x0100  # first address of the header block (command 0x0A)
+    HEADER_SIZE = 0x0050  # 0x0100-0x014F
 
-            time.sleep(2)  # connection needs 2 seconds to be established
-        except serial.serialutil.SerialException:
-            raise NoGBReaderException()
+    FRAME_START = 0xA5  # first byte of a framed bank (command 0x0C)
+    FRAME_SIZE = 1 + 2 + BANK_SIZE + 2  # start byte, bank number, bank data, CRC-16/XMODEM
+    RLE_ESCAPE = 0xD3  # starts a run of a compressed bank (command 0x12): escape, count (high, low), value
+    RAM_START = 0xA000  # cartridge RAM window, banks are mapped by the MBCDriver
+    RAM_BANK_SIZE = 0x2000
+    RAM_BLOCK_SIZE = 0x0100  # unit of the RAM commands 0x15-0x17, blocks start at xx00
 
-        if not self._performHandshake():
-            raise NoGBReaderException()
+    PROTOCOL_VERSION = 10  # newest protocol version supported by this class
+    VERSION_TIMEOUT = 0.2  # firmware without version command (protocol 1) does not answer 0x09
+    HANDSHAKE_TIMEOUT = 2
+    BANK_CRC_TIMEOUT = 3  # the reader reads the whole bank from the cartridge before answering command 0x0D
+    CONNECT_TIMEOUT = 3  # upper bound for reset and bootloader of the reader after opening the port
+    CONNECT_POLL_INTERVALS = (0.02, 0.04, 0.08, 0.16, 0.25)  # handshake timeouts while polling, the last one repeats
 
-    def close(self):
-        self.ser.close()
+    POLL_INTERVAL = 0.05  # serial read timeout, deadlines are checked in between
+    MINIMUM_TIMEOUT = 0.5  # allowance for USB and firmware latency per operation
+    STALL_TIMEOUT = 0.5  # a sending reader never pauses this long between two bytes
+    TIMEOUT_FACTOR = 4  # operations may take this many times their expected transfer time
+    FRAME_BITS = 11  # start bit, 8 data bits and 2 stop bits per byte
 
-    def readCartridgeHeader(self):
-        cartridgeType = self._parseCartridgeType(self._readCartridgeType())
+    DEFAULT_BAUDRATE = 76800  # BAUD 38400 of the firmware doubled by U2X0
+    BAUDRATES = (250000, 500000, 1000000, 2000000)  # rates tried by the negotiation (protocol 6), all exact at 16 MHz
+    READER_CLOCK = 16000000  # F_CPU of the reader, the firmware divides it by 8 * (UBRR + 1)
+    BAUDRATE_TOLERANCE = 0.02  # maximum deviation of the rate the reader can generate
+    BAUDRATE_REVERT_TIMEOUT = 0.5  # the reader returns to the previous rate if the new one is not confirmed in time
+    TEST_PATTERN = bytes(range(0, 256))  # sent by the reader at the new rate (command 0x0F)
 
-        romSize = self._readROMSize()
-        romSizeKB = self._parseROMSizeKB(romSize)
-        romBankCount = self._parseROMBankCount(romSize)
+    DEFAULT_BUS_DELAY = 50  # us the reader waits between setting an address and the data bus (command 0x11)
+    BUS_OVERHEAD = 3e-6  # seconds the firmware needs per cartridge byte besides the bus delay
+    BUS_DELAY_MARGIN = 1.5  # the calibrated delay is the shortest working one times this factor ...
+    BUS_DELAY_OFFSET = 2  # ... plus this many us
+    CALIBRATION_READS = 3  # reads of the Nintendo logo which have to match at every calibrated delay
 
-        cgbFlag = self._parseCGBFlag(self._readCGBFlag())
-        gameTitle = self._readGameTitle(cgbFlag)
-        nintendoLogo = self._readNintendoLogo()
-        globalChecksum = self._parseGlobalChecksum(self._readGlobalChecksum())
-
-        return GBCartridge(cartridgeType, romSizeKB, romBankCount, cgbFlag, gameTitle, nintendoLogo, globalChecksum)
-
-    def readGameData(self, cartridge, progressFunction):
-        globalChecksum = self._parseGlobalChecksum(self._readGlobalChecksum())
-
-        if globalChecksum != cartridge.globalChecksum:
-            raise GBCartridgeChangedException('checksum_changed')
-
-        romSize = self._readROMSize()
-        cartridge.romSizeKB = self._parseROMSizeKB(romSize)
-        cartridge.romBankCount = self._parseROMBankCount(romSize)
+    CACHE_SAMPLE_BANKS = 3  # banks read from the cartridge to confirm a cached ROM
 
-        cartridge.gameData = self._readGameData(cartridge.romSizeKB, progressFunction)
-        return cartridge.gameData
+    NINTENDO_LOGO = bytes([0xCE, 0xED, 0x66, 0x66, 0xCC, 0x0D, 0x00, 0x0B, 0x03, 0x73, 0x00, 0x83,
+                           0x00, 0x0C, 0x00, 0x0D, 0x00, 0x08, 0x11, 0x1F, 0x88, 0x89, 0x00, 0x0E,
+                           0xDC, 0xCC, 0x6E, 0xE6, 0xDD, 0xDD, 0xD9, 0x99, 0xBB, 0xBB, 0x67, 0x63,
+                           0x6E, 0x0E, 0xEC, 0xCC, 0xDD, 0xDC, 0x99, 0x9F, 0xBB, 0xB9, 0x33, 0x3E])  # 0x0104-0x0133
 
-    def saveROMFile(self, cartridge, file):
-        for byte in cartridge.gameData:
-            file.write(byte)
-
-    def checkGlobalChecksum(self, cartridge):
-        checksum = 0
-        for address in range(0x0000, len(cartridge.gameData)):
-            if not (address == 0x014E or address == 0x014F):
-                checksum += ord(cartridge.gameData[address])
+    cartridgeTypes = {0x00: "ROM ONLY", 0x01: "MBC1", 0x02: "MBC1+RAM", 0x03: "MBC1+RAM+BATTERY", 0x05: "MBC2",
+                      0x06: "MBC2+BATTERY", 0x08: "ROM+RAM", 0x09: "ROM+RAM+BATTERY", 0x0B: "MMM01", 0x0C: "MMM01+RAM",
+                      0x0D: "MMM01+RAM+BATTERY", 0x0F: "MBC3+TIMER+BATTERY", 0x10: "MBC3+TIMER+RAM+BATTERY",
+                      0x11: "MBC3", 0x12: "MBC3+RAM", 0x13: "MBC3+RAM+BATTERY", 0x15: "MBC4", 0x16: "MBC4+RAM",
+                      0x17: "MBC4+RAM+BATTERY", 0x19: "MBC5", 0x1A: "MBC5+RAM", 0x1B: "MBC5+RAM+BATTERY",
+                      0x1C: "MBC5+RUMBLE", 0x1D: "MBC5+RUMBLE+RAM", 0x1E: "MBC5+RUMBLE+RAM+BATTERY",
+                      0xFC: "POCKET CAMERA", 0xFD: "BANDAI TAMA5", 0xFE: "HUC3", 0xFF: "HUC1+RAM+BATTERY"}
 
-        return (checksum & 0xFFFF) == cartridge.globalChecksum
+    def __init__(self, framed=False):
+        """
+        :param framed: Transfer banks as CRC checked frames (protocol 4)
+        """
+        self.framed = framed
+        self.protocolVersion = 1  # until the reader answered the version command
 
     #######################################################################################
     # Parsing methods
@@ -95,19 +97,19 @@ class GBReader:
             raise UnknownGBDataException('unknown_type')
 
     def _parseROMSizeKB(self, romSize):
-        if romSize <= 7:
+        if romSize <= 8:
             return 2 ** romSize * 32
         elif romSize == 0x52:
-            return 1126.4
+            return 1152  # 72 banks
         elif romSize == 0x53:
-            return 1228.8
+            return 1280  # 80 banks
         elif romSize == 0x54:
             return 1536
         else:
             raise UnknownGBDataException('unknown_rom_size')
 
     def _parseROMBankCount(self, romSize):
-        if romSize <= 7:
+        if romSize <= 8:
             return 2 ** (romSize + 1)
         elif romSize == 0x52:
             return 72
@@ -118,6 +120,36 @@ class GBReader:
         else:
             raise UnknownGBDataException('unknown_bank_count')
 
+    def _parseHeaderBlock(self, data):
+        """
+        :param data: Header block (command 0x0A) followed by its 8 bit checksum
+        """
+        if sum(data) & 0xFF != 0:
+            raise UnknownGBDataException('invalid_header_block')
+        return data[:self.HEADER_SIZE]
+
+    def _parseCartridgeHeader(self, header):
+        cartridgeType = self._parseCartridgeType(header[0x47])
+
+        romSizeKB = self._parseROMSizeKB(header[0x48])
+        romBankCount = self._parseROMBankCount(header[0x48])
+
+        cgbFlag = self._parseCGBFlag(header[0x43])
+        gameTitle = self._parseGameTitle(header[0x34:0x44], cgbFlag)
+        nintendoLogo = bytes(header[0x04:0x34])
+        globalChecksum = self._parseGlobalChecksum(header[0x4E:0x50])
+
+        cartridge = GBCartridge(cartridgeType, romSizeKB, romBankCount, cgbFlag, gameTitle, nintendoLogo,
+                                globalChecksum, header[0x4D], self._parseRAMSize(header[0x49]))
+        cartridge.headerChecksumValid = self._calculateHeaderChecksum(header) == header[0x4D]
+        return cartridge
+
+    def _parseRAMSize(self, ramSize):
+        """
+        :return: Size of the cartridge RAM in bytes, 0 for unknown codes
+        """
+        return {0x01: 0x800, 0x02: 0x2000, 0x03: 0x8000, 0x04: 0x20000, 0x05: 0x10000}.get(ramSize, 0)
+
     def _parseCGBFlag(self, cgbFlag):
         if cgbFlag == 0x80:
             return CGBFlag.CGB_SUPPORT
@@ -126,78 +158,1297 @@ class GBReader:
         else:
             return CGBFlag.UNDEFINED
 
+    def _parseGameTitle(self, title, cgbFlag):
+        title = bytes(byte for byte in title if byte < 0x80).decode("ascii")  # skip non ascii characters
+
+        if cgbFlag == CGBFlag.CGB_ONLY or cgbFlag == CGBFlag.CGB_SUPPORT:
+            return title[:11]
+        else:
+            return title[:16]
+
     def _parseGlobalChecksum(self, globalChecksum):
-        return (ord(globalChecksum[0]) << 8) + ord(globalChecksum[1])
+        return (globalChecksum[0] << 8) + globalChecksum[1]
+
+    def _calculateHeaderChecksum(self, header):
+        """
+        :param header: Header block (0x0100-0x014F)
+        :return: Checksum of 0x0134-0x014C as calculated by the boot ROM (x = x - byte - 1), stored at 0x014D
+        """
+        return -(sum(header[0x34:0x4D]) + 0x4D - 0x34) & 0xFF
+
+    def _calculateGlobalChecksum(self, data, offset=0, checksum=0):
+        checksum += sum(data)
+        for address in (0x014E, 0x014F):  # checksum bytes are not part of the checksum
+            if offset <= address < offset + len(data):
+                checksum -= data[address - offset]
+
+        return checksum & 0xFFFF
+
+    def _updateROMSize(self, cartridge, romSize):
+        cartridge.romSizeKB = self._parseROMSizeKB(romSize)
+        cartridge.romBankCount = self._parseROMBankCount(romSize)
+
+    def _parseFrame(self, frame, bank):
+        """
+        :return: Bank data of a valid frame (command 0x0C) of the given bank or None
+        """
+        if len(frame) == self.FRAME_SIZE and frame[0] == self.FRAME_START and (frame[1] << 8) + frame[2] == bank and \
+                binascii.crc_hqx(frame[3:-2], 0) == (frame[-2] << 8) + frame[-1]:
+            return frame[3:-2]
+        return None
+
+    def _decodeRLE(self, data, out, position):
+        """
+        Decode the complete tokens of a compressed bank (command 0x12) into out. Literal spans are copied as slices
+        up to the next escape byte and runs are filled at once, so the work per token is done at C speed.
+        :param data: Received part of the compressed bank
+        :param out: bytearray of the bank
+        :param position: Bytes of out decoded so far
+        :return: (consumed bytes of data, decoded bytes of out), data after the end of out is not consumed
+        """
+        offset = 0
+        while position < len(out):
+            escape = data.find(self.RLE_ESCAPE, offset)
+            if escape < 0:
+                escape = len(data)
+
+            count = min(escape - offset, len(out) - position)
+            out[position:position + count] = data[offset:offset + count]
+            position += count
+            offset += count
+            if offset < escape or offset + 4 > len(data) or position == len(out):
+                break  # out is full or the next run is not complete yet
+
+            length = (data[offset + 1] << 8) + data[offset + 2]
+            if length == 0 or length > len(out) - position:
+                raise UnknownGBDataException('invalid_run')
+            out[position:position + length] = data[offset + 3:offset + 4] * length
+            position += length
+            offset += 4
+
+        return offset, position
+
+    ######################################################################################
+    # Link timing
+    #####
+    def _deadline(self, size, start=None):
+        """
+        Deadline (time.perf_counter) for receiving size bytes, derived from the measured link throughput.
+        """
+        if start is None:
+            start = time.perf_counter()
+        return start + self.MINIMUM_TIMEOUT + size / self.throughput * self.TIMEOUT_FACTOR
+
+    def _linkThroughput(self, baudrate, busDelay=DEFAULT_BUS_DELAY):
+        """
+        Expected bytes per second, limited by the baud rate or by the cartridge bus of the reader.
+        """
+        return min(baudrate / self.FRAME_BITS, 1 / (busDelay * 1e-6 + self.BUS_OVERHEAD))
+
+    def _measureThroughput(self, size, seconds):
+        if size >= 1024 and seconds > 0:  # small transfers only measure the latency
+            self.throughput = 0.7 * self.throughput + 0.3 * size / seconds
+
+    def _useFramedTransfer(self):
+        return self.framed and self.protocolVersion >= 4
+
+
+class GBReader(GBProtocol):
+
+    def __init__(self, port, blockSize=GBProtocol.BANK_SIZE, framed=False, maxRetries=5,
+                 connectTimeout=GBProtocol.CONNECT_TIMEOUT, cache=None, database=None,
+                 baudrates=GBProtocol.BAUDRATES, linkSettings=None, compressed=False, mbcDrivers=True,
+                 probeMirrors=False, hooks=()):
+        super().__init__(framed)
+        self.blockSize = blockSize  # number of bytes requested per serial read while dumping
+        self.compressed = compressed  # transfer banks run-length encoded and CRC checked (protocol 8)
+        self.mbcDrivers = mbcDrivers  # switch banks from the host with the MBCDriver of the cartridge (protocol 9)
+        self.probeMirrors = probeMirrors  # transfer mirrored banks only once, see probeROMSize
+        self.maxRetries = maxRetries  # retransmissions of a bad frame before giving up
+        self.cache = cache  # ROMCache of known cartridges or None
+        self.cacheHit = False  # the last dump was served from the cache
+        self.database = database  # DumpDatabase of known good dumps or None
+        self.linkSettings = linkSettings  # LinkSettings remembering the negotiated rate and bus delays or None
+        self.busDelay = self.DEFAULT_BUS_DELAY  # us, fixed below protocol 7
+        self.hostBankSwitching = False  # banks are mapped by self._driver instead of the firmware
+        self._driver = None  # MBCDriver of the inserted cartridge if the host switches banks
+
+        self.blockErrors = {}  # bad frames per bank of the last dump
+        self.retries = 0  # retransmissions of the last dump
+        self.compressedBytes = 0  # bytes received for compressed banks of the last dump
+        self.decompressedBytes = 0  # bank bytes decoded from them
+        self.ramBlocksTransferred = 0  # RAM blocks read or written by the last save RAM backup or restore
+        self.bytesReceived = 0  # bytes received from the reader since the port was opened
+
+        self.hooks = list(hooks)  # functions called with every event, see ReaderMetrics
+        self._command = None  # last command sent, only tracked with hooks
+        self._commandStart = None  # time it was sent until its first response arrived
+
+        try:
+            self.port = port
+            start = time.perf_counter()
+            self.ser = serial.Serial(port, self.DEFAULT_BAUDRATE, timeout=self.POLL_INTERVAL)
+            self.throughput = self._linkThroughput(self.ser.baudrate)  # bytes per second, updated by every transfer
+        except serial.serialutil.SerialException:
+            raise NoGBReaderException()
+
+        if not self._connect(start + connectTimeout) and not self._connectRemembered():
+            self.ser.close()
+            raise NoGBReaderException()
+        self.connectLatency = time.perf_counter() - start  # seconds from opening the port to the handshake
+
+        try:
+            self.protocolVersion = min(self._readProtocolVersion(), self.PROTOCOL_VERSION)
+            if self.protocolVersion >= 7:
+                self.setBusDelay(self.DEFAULT_BUS_DELAY)  # a previous session may have left another delay
+            if self.protocolVersion >= 9:
+                self._setHostBankSwitching(False, force=True)  # a previous session may have left it on
+
+            if baudrates:
+                self.negotiateBaudrate(baudrates)
+        except BaseException:
+            self.ser.close()  # nobody else can close the port of a half constructed reader
+            raise
+
+    def close(self):
+        if self.ser.is_open and self.ser.baudrate != self.DEFAULT_BAUDRATE:
+            try:
+                self._switchBaudrate(self.DEFAULT_BAUDRATE)  # leave the reader at the rate every host starts with
+            except (serial.serialutil.SerialException, OSError):  # the reader may be gone already
+                pass
+        self.ser.close()
+
+    def addHook(self, hook):
+        """
+        Call hook with every event of this reader, e.g. ReaderMetrics.MetricsCollector or JSONLinesHook. Without
+        hooks the instrumentation only checks the empty list.
+        """
+        self.hooks.append(hook)
+
+    def removeHook(self, hook):
+        self.hooks.remove(hook)
+
+    def negotiateBaudrate(self, baudrates=GBProtocol.BAUDRATES):
+        """
+        Switch to the fastest rate which transfers the test pattern without errors (protocol 6). A rate remembered
+        in linkSettings is tried first, otherwise the rates are stepped through from the slowest one.
+        :return: Baud rate in use
+        """
+        if self.protocolVersion < 6:
+            return self.ser.baudrate
+
+        remembered = self.linkSettings.baudrate(self.port) if self.linkSettings is not None else None
+        if remembered is not None and remembered != self.ser.baudrate and self._switchBaudrate(remembered):
+            return self.ser.baudrate
+
+        for baudrate in sorted(baudrates):
+            if baudrate > self.ser.baudrate and not self._switchBaudrate(baudrate):
+                break  # faster rates fail as well
+
+        if self.linkSettings is not None:
+            self.linkSettings.setBaudrate(self.port, self.ser.baudrate)
+        return self.ser.baudrate
+
+    def setBusDelay(self, delay):
+        """
+        Set the time the reader waits for the cartridge after setting an address (protocol 7).
+        :param delay: Delay in us (0-255)
+        """
+        self._write([0x11, delay])
+        if self._read(1, 'bus_delay')[0] != delay:
+            raise GBTransferException('bus_delay')
+        self.busDelay = delay
+        self.throughput = self._linkThroughput(self.ser.baudrate, delay)
+
+    def calibrateBusDelay(self, cartridge):
+        """
+        Lower the bus delay from the default by 1 us until the Nintendo logo no longer reads back unchanged
+        (protocol 7). The shortest working delay plus a safety margin is confirmed by the CRC of bank 1, which also
+        covers the bank switch, and remembered per port and cartridge type in linkSettings.
+        :return: Bus delay in use in us
+        """
+        if self.protocolVersion < 7:
+            return self.busDelay
+
+        self.setBusDelay(self.DEFAULT_BUS_DELAY)
+        if self._readNintendoLogo() != self.NINTENDO_LOGO:
+            return self.busDelay  # no known region to compare with, e.g. no cartridge inserted
+        reference = self._readBankCRC(1) if cartridge.romBankCount > 1 else None
+
+        shortest = self.DEFAULT_BUS_DELAY
+        for delay in range(self.DEFAULT_BUS_DELAY - 1, -1, -1):
+            self.setBusDelay(delay)
+            if any(self._readNintendoLogo() != self.NINTENDO_LOGO for _ in range(self.CALIBRATION_READS)):
+                break
+            shortest = delay
+
+        delay = min(math.ceil(shortest * self.BUS_DELAY_MARGIN) + self.BUS_DELAY_OFFSET, self.DEFAULT_BUS_DELAY)
+        self.setBusDelay(delay)
+        if reference is not None and self._readBankCRC(1) != reference:
+            self.setBusDelay(self.DEFAULT_BUS_DELAY)
+
+        if self.linkSettings is not None:
+            self.linkSettings.setBusDelay(self.port, cartridge.cartridgeType, self.busDelay)
+        return self.busDelay
+
+    def readCartridgeHeader(self):
+        """
+        Read the header at the default bus delay, then switch to the delay remembered for the cartridge type.
+        """
+        if self.busDelay != self.DEFAULT_BUS_DELAY:
+            self.setBusDelay(self.DEFAULT_BUS_DELAY)  # the new cartridge may be slower than the last one
+        self._resetDriver()
+
+        if self.protocolVersion >= 2:
+            cartridge = self._parseCartridgeHeader(self._readHeaderBlock())
+            if self.protocolVersion >= 7 and self.linkSettings is not None:
+                delay = self.linkSettings.busDelay(self.port, cartridge.cartridgeType)
+                if delay is not None:
+                    self.setBusDelay(delay)
+            self._selectDriver(cartridge)
+            if self.hooks:
+                self._emit("checksum", kind="header", valid=cartridge.headerValid())
+            return cartridge
+
+        cartridgeType = self._parseCartridgeType(self._readCartridgeType())
+
+        romSize = self._readROMSize()
+        romSizeKB = self._parseROMSizeKB(romSize)
+        romBankCount = self._parseROMBankCount(romSize)
+
+        cgbFlag = self._parseCGBFlag(self._readCGBFlag())
+        gameTitle = self._readGameTitle(cgbFlag)
+        nintendoLogo = self._readNintendoLogo()
+        globalChecksum = self._parseGlobalChecksum(self._readGlobalChecksum())
+
+        cartridge = GBCartridge(cartridgeType, romSizeKB, romBankCount, cgbFlag, gameTitle, nintendoLogo,
+                                globalChecksum)
+        if self.hooks:
+            self._emit("checksum", kind="header", valid=cartridge.headerValid())
+        return cartridge
+
+    def readGameData(self, cartridge, progressFunction, filename=None):
+        """
+        Read the whole ROM of the cartridge.
+        Without filename the ROM is kept in cartridge.gameData. With filename every block is written to that file
+        as it arrives (cartridge.romFile) and memory usage does not depend on the ROM size. Completed banks are
+        recorded in a journal next to the file until the dump is complete, see resumeGameData.
+        With a cache, a known cartridge is confirmed by a few sampled banks and its cached ROM is returned instead.
+        With probeMirrors, mirrored banks of a ROM smaller than its header claims are copied instead of transferred.
+        CRC32, MD5 and SHA-1 of the ROM are calculated while it arrives (cartridge.romHashes). With a database the
+        dump is classified as soon as the last bank arrived (cartridge.dumpStatus).
+        :return: ROM as bytes or filename in streaming mode
+        """
+        start, received = time.perf_counter(), self.bytesReceived
+        self.checkCartridge(cartridge)
+        self._resetTransferStatistics()
+
+        if self._readCachedGameData(cartridge, progressFunction, filename):
+            self._dumpFinished(cartridge, start, received)
+            return cartridge.gameData if filename is None else filename
+
+        cartridge.realBankCount = self.probeROMSize(cartridge) if self.probeMirrors else None
+
+        romHash = ROMHash()
+        if filename is None:
+            cartridge.gameData = self._readGameData(cartridge.romSizeKB, progressFunction, romHash,
+                                                    cartridge.realBankCount)
+            cartridge.romFile = None
+            cartridge.romChecksum = None
+        else:
+            journal = DumpJournal.create(filename, cartridge)
+            with open(filename, 'w+b') as file:
+                cartridge.romChecksum = self._streamGameData(cartridge.romSizeKB, progressFunction, file, journal,
+                                                             romHash, cartridge.realBankCount)
+            journal.remove()  # the journal is kept if the dump fails
+
+            cartridge.gameData = None
+            cartridge.romFile = filename
+        cartridge.romHashes = romHash.hexdigests()
+
+        self._classifyGameData(cartridge)
+        self._cacheGameData(cartridge)
+        self._dumpFinished(cartridge, start, received)
+        return cartridge.gameData if filename is None else filename
+
+    def resumeGameData(self, cartridge, progressFunction, filename):
+        """
+        Complete an interrupted streaming dump. Only banks missing in the journal or not matching their journal hash
+        are read again. Banks of an unchecked stream (command 0x07) are compared with the cartridge first, a lost byte
+        shifts all later banks. Firmware without the read bank command (protocol < 3) dumps the whole ROM again.
+        :return: filename
+        """
+        journal = DumpJournal(filename)
+        if not journal.exists() or not os.path.exists(filename) or self.protocolVersion < 3:
+            return self.readGameData(cartridge, progressFunction, filename)
+
+        start, received = time.perf_counter(), self.bytesReceived
+        # the rest of the interrupted transfer or the boot of a reader that was reset
+        self._resynchronize(self._deadline(cartridge.romBankCount * self.BANK_SIZE) + self.CONNECT_TIMEOUT)
+        self.checkCartridge(cartridge)
+        if not journal.matches(cartridge):
+            raise GBCartridgeChangedException('journal_mismatch')
+        self._resetTransferStatistics()
+
+        banks = journal.load()
+        size = cartridge.romBankCount * self.BANK_SIZE
+
+        with open(filename, 'r+b') as file:
+            file.truncate(size)
+
+            missing = []
+            for bank in range(0, cartridge.romBankCount):
+                file.seek(bank * self.BANK_SIZE)
+                if hashlib.sha1(file.read(self.BANK_SIZE)).hexdigest() != banks.get(bank):
+                    missing.append(bank)
+            missing += self._shiftedBanks(file, sorted(journal.uncheckedBanks().difference(missing)))
+            missing.sort()
+
+            for index, bank in enumerate(missing):
+                data = self._readBank(bank)
+                file.seek(bank * self.BANK_SIZE)
+                file.write(data)
+                file.flush()
+                journal.addBank(bank, hashlib.sha1(data).hexdigest())
+
+                progressFunction((index + 1) * self.BANK_SIZE, len(missing) * self.BANK_SIZE)
+
+            file.seek(0)
+            checksum = 0
+            romHash = ROMHash()
+            for offset in range(0, size, self.BANK_SIZE):
+                data = file.read(self.BANK_SIZE)
+                checksum = self._calculateGlobalChecksum(data, offset, checksum)
+                romHash.update(data)
+
+        journal.remove()
+
+        cartridge.romChecksum = checksum
+        cartridge.romHashes = romHash.hexdigests()
+        cartridge.gameData = None
+        cartridge.romFile = filename
+
+        self._classifyGameData(cartridge)
+        self._cacheGameData(cartridge)
+        self._dumpFinished(cartridge, start, received)
+        return filename
+
+    def saveROMFile(self, cartridge, file):
+        if cartridge.gameData is not None:
+            file.write(cartridge.gameData)
+        else:
+            with open(cartridge.romFile, 'rb') as romFile:
+                shutil.copyfileobj(romFile, file)
+
+    def moveROMFile(self, cartridge, filename):
+        """
+        Move a streamed ROM to its final location. This is a rename if both are on the same file system.
+        """
+        cartridge.romFile = shutil.move(cartridge.romFile, filename)
+
+    def verify(self, filename, cartridge=None, progressFunction=None):
+        """
+        Compare the inserted cartridge with a ROM file bank by bank. The reader calculates the CRC of every bank
+        (protocol 5), so only two bytes per bank are transferred. Older firmware sends the banks instead.
+        :param filename: ROM file
+        :param cartridge: Header of the inserted cartridge, read if None
+        :param progressFunction: Called with (verified banks, bank count)
+        :return: List of the bank numbers which differ, empty if the file matches the cartridge
+        """
+        if cartridge is None:
+            cartridge = self.readCartridgeHeader()
+        self.checkCartridge(cartridge)
+
+        differing = []
+        with open(filename, 'rb') as file:
+            file.seek(0, os.SEEK_END)
+            fileBanks = -(-file.tell() // self.BANK_SIZE)
+            file.seek(0)
+
+            if self.protocolVersion < 3:
+                data = self._readGameData(cartridge.romSizeKB, lambda current, max: None, ROMHash())
+
+            for bank in range(0, cartridge.romBankCount):
+                expected = file.read(self.BANK_SIZE)
+                if self.protocolVersion >= 5:
+                    same = self._readBankCRC(bank) == binascii.crc_hqx(expected, 0)
+                elif self.protocolVersion >= 3:
+                    same = self._readBank(bank) == expected
+                else:
+                    same = data[bank * self.BANK_SIZE:(bank + 1) * self.BANK_SIZE] == expected
+                if not same:
+                    differing.append(bank)
+
+                if progressFunction is not None:
+                    progressFunction(bank + 1, cartridge.romBankCount)
+
+        differing.extend(range(cartridge.romBankCount, fileBanks))  # file is longer than the ROM
+        return differing
+
+    def writeByte(self, address, data):
+        """
+        Write a byte to the cartridge, e.g. to a register of its memory bank controller (protocol 9).
+        """
+        self._write([0x13, address >> 8, address & 0xFF, data])
+
+    def probeROMSize(self, cartridge):
+        """
+        Find the real ROM size by fingerprinting banks with their CRC calculated by the reader (protocol 5). A ROM
+        smaller than its header claims is mirrored: bank n + size reads like bank n. The ROM is halved as long as
+        the sampled banks of the upper half match the lower half. The controller limits the size as well.
+        :return: Number of real banks
+        """
+        banks = cartridge.romBankCount
+        if self._driver is not None:
+            banks = min(banks, self._driver.maxBanks)
+        if self.protocolVersion < 5 or banks & (banks - 1) != 0:
+            return banks  # no bank CRC or a bank count which is not a power of two
+
+        fingerprints = {}
+
+        def fingerprint(bank):
+            if bank not in fingerprints:
+                fingerprints[bank] = self._readBankCRC(bank)
+            return fingerprints[bank]
+
+        while banks > 2:
+            half = banks // 2
+            samples = [bank for bank in (1, 2, half // 2 + 1, half - 1) if 0 < bank < half]
+            if any(fingerprint(bank) != fingerprint(bank + half) for bank in samples):
+                break
+            banks = half
+        return banks
+
+    def transferMode(self):
+        """
+        :return: Transfer used for dumps of the current cartridge: "compressed" (protocol 8), "framed" (protocol 4),
+                 "bank" (command 0x0B, banks mapped by the host) or "stream" (command 0x07)
+        """
+        if self._useCompressedTransfer():
+            return "compressed"
+        if self._useFramedTransfer():
+            return "framed"
+        return "bank" if self._useBankTransfer() else "stream"
+
+    def compressionRatio(self):
+        """
+        :return: Bank bytes per received byte of the compressed banks of the last dump or None
+        """
+        return self.decompressedBytes / self.compressedBytes if self.compressedBytes else None
+
+    def readBank(self, bank):
+        """
+        Read a single ROM bank (protocol 3), CRC checked with framed or compressed transfers. See ROMView for random
+        access to the ROM.
+        :return: Bank data as bytes
+        """
+        if self.protocolVersion < 3:
+            raise GBTransferException('read_bank_unsupported')
+        return self._readBank(bank)
+
+    def checkHeader(self, cartridge):
+        """
+        Make sure the header was read correctly before dumping: a dirty or loose cartridge reads back a damaged
+        Nintendo logo or header checksum, the dump would be garbage as well.
+        """
+        if not cartridge.headerValid():
+            raise UnknownGBDataException('bad_contact')
+
+    def saveRAMSize(self, cartridge):
+        """
+        :return: Bytes of cartridge RAM, 0 if the cartridge has none or its controller is not supported
+        """
+        if self._driver is None:
+            return 0
+        return self._driver.builtInRAM or cartridge.ramSize or 0
+
+    def readSaveRAM(self, cartridge, previous=None, progressFunction=None):
+        """
+        Read the cartridge RAM (protocol 10). The reader calculates the CRC of every block, only the blocks which
+        differ from previous are transferred.
+        :param previous: Earlier backup of the cartridge RAM, e.g. SaveStore.latest
+        :return: RAM data as bytes
+        """
+        size = self._checkSaveRAM(cartridge)
+        data = bytearray(previous) if previous is not None and len(previous) == size else bytearray(size)
+        delta = previous is not None and len(previous) == size and self._driver.ramMask == 0xFF  # see _maskRAM
+
+        self.ramBlocksTransferred = 0
+        self._driver.enableRAM(True)
+        try:
+            for bank, addressH, index, count in self._ramBlocks(size):
+                self._driver.selectRAMBank(bank)
+                if delta:
+                    crcs = self._readRAMBlockCRCs(addressH, count)
+                    blocks = [block for block in range(count) if crcs[block] != self._ramBlockCRC(data, index + block)]
+                else:
+                    blocks = range(count)
+
+                for block in blocks:
+                    offset = (index + block) * self.RAM_BLOCK_SIZE
+                    data[offset:offset + self.RAM_BLOCK_SIZE] = self._retryRAMBlock(
+                        lambda: self._receiveRAMBlock(addressH + block))
+                    self.ramBlocksTransferred += 1
+                if progressFunction is not None:
+                    progressFunction(index + count, size // self.RAM_BLOCK_SIZE)
+        finally:
+            self._driver.enableRAM(False)
+
+        return self._maskRAM(data)
+
+    def backupSaveRAM(self, cartridge, store, progressFunction=None):
+        """
+        Back up the cartridge RAM to a SaveStore, transferring only the blocks changed since the latest backup.
+        :return: File of the backup
+        """
+        return store.store(cartridge, self.readSaveRAM(cartridge, store.latest(cartridge), progressFunction))
+
+    def restoreSaveRAM(self, cartridge, data, progressFunction=None):
+        """
+        Write a backup to the cartridge RAM (protocol 10). Only the blocks whose CRC differs from the one the reader
+        calculates are written, every written block is verified.
+        :return: Indices of the written blocks
+        """
+        size = self._checkSaveRAM(cartridge)
+        if len(data) != size:
+            raise GBTransferException('save_size_mismatch', len(data), size)
+        data = self._maskRAM(data)
+
+        written = []
+        self.ramBlocksTransferred = 0
+        self._driver.enableRAM(True)
+        try:
+            for bank, addressH, index, count in self._ramBlocks(size):
+                self._driver.selectRAMBank(bank)
+                if self._driver.ramMask == 0xFF:
+                    crcs = self._readRAMBlockCRCs(addressH, count)
+                    blocks = [block for block in range(count) if crcs[block] != self._ramBlockCRC(data, index + block)]
+                else:
+                    blocks = range(count)  # the unused bits read back undefined, their CRCs can not be compared
+
+                for block in blocks:
+                    offset = (index + block) * self.RAM_BLOCK_SIZE
+                    self._retryRAMBlock(lambda: self._writeRAMBlock(addressH + block,
+                                                                    data[offset:offset + self.RAM_BLOCK_SIZE]))
+                    written.append(index + block)
+                    self.ramBlocksTransferred += 1
+                if progressFunction is not None:
+                    progressFunction(index + count, size // self.RAM_BLOCK_SIZE)
+        finally:
+            self._driver.enableRAM(False)
+
+        return written
+
+    def checkGlobalChecksum(self, cartridge):
+        if cartridge.gameData is not None:
+            checksum = self._calculateGlobalChecksum(cartridge.gameData)
+        else:
+            checksum = cartridge.romChecksum  # calculated while streaming
+
+        if self.hooks:
+            self._emit("checksum", kind="global", valid=checksum == cartridge.globalChecksum)
+        return checksum == cartridge.globalChecksum
+
+    def checkCartridge(self, cartridge):
+        """
+        Make sure the inserted cartridge is still the one the header was read from and update its ROM size.
+        Raises GBCartridgeChangedException if another cartridge is inserted.
+        """
+        self._resetDriver()
+        if self.protocolVersion >= 2:
+            header = self._readHeaderBlock()
+            globalChecksum = self._parseGlobalChecksum(header[0x4E:0x50])
+            romSize = header[0x48]
+        else:
+            globalChecksum = self._parseGlobalChecksum(self._readGlobalChecksum())
+            romSize = None
+
+        if globalChecksum != cartridge.globalChecksum:
+            raise GBCartridgeChangedException('checksum_changed')
+
+        if romSize is None:
+            romSize = self._readROMSize()
+        self._updateROMSize(cartridge, romSize)
+        self._selectDriver(cartridge)
+
+    def _selectDriver(self, cartridge):
+        """
+        Let the host switch the banks if a driver for the controller of the cartridge is known (protocol 9),
+        otherwise the firmware writes the bank number to 0x2000 (and 0x3000) like for MBC5.
+        """
+        driver = None
+        if self.mbcDrivers and self.protocolVersion >= 9:
+            codes = [code for code, name in self.cartridgeTypes.items() if name == cartridge.cartridgeType]
+            driver = MBCDriver.forType(codes[0]) if codes else None
+
+        self._driver = driver(self.writeByte) if driver is not None else None
+        self._setHostBankSwitching(self._driver is not None)
+
+    def _resetDriver(self):
+        """
+        Banks read from 0x0000-0x3FFF (MBC1 mode 1) and RAM banks may have left another bank than bank 0 in the
+        header area.
+        """
+        if self._driver is not None:
+            self._driver.reset()
+
+    def _setHostBankSwitching(self, enabled, force=False):
+        if self.protocolVersion < 9 or (enabled == self.hostBankSwitching and not force):
+            return
+        self._write([0x14, 1 if enabled else 0])
+        if self._read(1, 'bank_switching')[0] != (1 if enabled else 0):
+            raise GBTransferException('bank_switching')
+        self.hostBankSwitching = enabled
+
+    def _mapBank(self, bank):
+        """
+        :return: Bank number to request from the reader
+        """
+        return self._driver.selectBank(bank) if self._driver is not None else bank
+
+    def _connectRemembered(self):
+        """
+        A previous session may have left the reader at its negotiated rate.
+        """
+        remembered = self.linkSettings.baudrate(self.port) if self.linkSettings is not None else None
+        if remembered is None or remembered == self.ser.baudrate:
+            return False
+
+        self.ser.baudrate = remembered
+        self.throughput = self._linkThroughput(remembered)
+        if self._connect(time.perf_counter() + self.CONNECT_POLL_INTERVALS[-1]):
+            return True
+
+        self.ser.baudrate = self.DEFAULT_BAUDRATE
+        self.throughput = self._linkThroughput(self.DEFAULT_BAUDRATE)
+        return False
+
+    def _switchBaudrate(self, baudrate):
+        """
+        Switch the reader and the port to baudrate. The reader answers 0xA1 at the old rate, sends the test pattern
+        at the new rate and keeps it only after the host confirmed the pattern (0xA2), otherwise both return to the
+        old rate.
+        :return: True if the new rate is in use
+        """
+        ubrr = round(self.READER_CLOCK / (8 * baudrate)) - 1
+        if ubrr < 0 or ubrr > 0x0FFF or \
+                abs(self.READER_CLOCK / (8 * (ubrr + 1)) - baudrate) / baudrate > self.BAUDRATE_TOLERANCE:
+            return False  # the reader can not generate this rate
+
+        previous = self.ser.baudrate
+        self._write([0x0E, ubrr >> 8, ubrr & 0xFF])
+        try:
+            if self._read(1, 'baudrate', self.VERSION_TIMEOUT)[0] != 0xA1:
+                return False
+        except GBTimeoutException:
+            return False
+
+        self.ser.baudrate = baudrate
+        self.ser.reset_input_buffer()
+        self._write([0x0F])
+        try:
+            pattern = self._read(len(self.TEST_PATTERN), 'baudrate_test', self.BAUDRATE_REVERT_TIMEOUT)
+        except GBTimeoutException:
+            pattern = b''
+
+        if pattern == self.TEST_PATTERN:
+            self._write([0x10])
+            try:
+                confirmed = self._read(1, 'baudrate_confirm', self.VERSION_TIMEOUT)[0] == 0xA2
+            except GBTimeoutException:
+                confirmed = self._performHandshake(self.VERSION_TIMEOUT)  # only the confirmation got lost
+            if confirmed:
+                self.throughput = self._linkThroughput(baudrate, self.busDelay)
+                return True
+
+        # the reader returns to the previous rate on its own
+        self.ser.baudrate = previous
+        time.sleep(self.BAUDRATE_REVERT_TIMEOUT)
+        self.ser.reset_input_buffer()
+        self._performHandshake(self.VERSION_TIMEOUT)
+        return False
+
+    def _fallBack(self):
+        """
+        Step down to the next slower rate after transfer errors and remember it.
+        :return: True if the rate was lowered
+        """
+        slower = [baudrate for baudrate in self.BAUDRATES + (self.DEFAULT_BAUDRATE,) if baudrate < self.ser.baudrate]
+        for baudrate in sorted(slower, reverse=True):
+            if self._switchBaudrate(baudrate):
+                if self.linkSettings is not None:
+                    self.linkSettings.setBaudrate(self.port, baudrate)
+                return True
+        return False
+
+    def _resetTransferStatistics(self):
+        self.blockErrors = {}
+        self.retries = 0
+        self.compressedBytes = 0
+        self.decompressedBytes = 0
+        self.cacheHit = False
+
+    def _useCompressedTransfer(self):
+        return self.compressed and self.protocolVersion >= 8
+
+    def _useBankTransfer(self):
+        """
+        Dumps are read bank by bank (CRC checked or mapped by the host) instead of in one stream (command 0x07).
+        """
+        return self._useCompressedTransfer() or self._useFramedTransfer() or self._driver is not None
+
+    def _readCachedGameData(self, cartridge, progressFunction, filename):
+        """
+        Serve the dump from the cache if the cartridge is known and some randomly sampled banks match the cached
+        ROM. Sampling needs the read bank command (protocol 3), with protocol 5 only the bank CRCs are compared.
+        :return: True if the cached ROM was used
+        """
+        if self.cache is None or self.protocolVersion < 3:
+            return False
+
+        entry = self.cache.lookup(cartridge)
+        if entry is None or len(entry["banks"]) != cartridge.romBankCount or entry.get("hashes") is None:
+            return False
+
+        with open(entry["file"], 'rb') as file:
+            for bank in random.sample(range(0, cartridge.romBankCount),
+                                      min(self.CACHE_SAMPLE_BANKS, cartridge.romBankCount)):
+                if self.protocolVersion >= 5:
+                    file.seek(bank * self.BANK_SIZE)
+                    same = self._readBankCRC(bank) == binascii.crc_hqx(file.read(self.BANK_SIZE), 0)
+                else:
+                    same = hashlib.sha1(self._readBank(bank)).hexdigest() == entry["banks"][bank]
+                if not same:
+                    self.cache.remove(cartridge)  # same header, different contents
+                    return False
+
+        if filename is None:
+            with open(entry["file"], 'rb') as file:
+                cartridge.gameData = file.read()
+            cartridge.romFile = None
+            cartridge.romChecksum = None
+        else:
+            self.cache.copy(entry, filename)
+            cartridge.gameData = None
+            cartridge.romFile = filename
+            cartridge.romChecksum = entry["checksum"]
+        cartridge.romHashes = entry["hashes"]
+
+        self.cacheHit = True
+        self._classifyGameData(cartridge)
+        size = cartridge.romBankCount * self.BANK_SIZE
+        progressFunction(size, size)
+        return True
+
+    def _cacheGameData(self, cartridge):
+        """
+        Add a complete dump with a valid global checksum to the cache.
+        """
+        if self.cache is None or not self.checkGlobalChecksum(cartridge):
+            return
+
+        if cartridge.gameData is not None:
+            self.cache.store(cartridge, data=cartridge.gameData, checksum=cartridge.globalChecksum,
+                             hashes=cartridge.romHashes)
+        else:
+            self.cache.store(cartridge, romFile=cartridge.romFile, checksum=cartridge.romChecksum,
+                             hashes=cartridge.romHashes)
+
+    def _classifyGameData(self, cartridge):
+        if self.database is not None:
+            cartridge.dumpStatus, cartridge.knownDump = self.database.classify(cartridge)
 
     ######################################################################################
     # Reading methods
     #####
-    def _performHandshake(self):
-        self.ser.write([0x01])
-        c = self.ser.read(1)
+    def _readInto(self, view, operation, deadline=None, offset=0, total=None, stallTimeout=GBProtocol.STALL_TIMEOUT):
+        """
+        Fill view with received bytes or raise GBTimeoutException as soon as the deadline has passed or nothing
+        was received for stallTimeout seconds. The default deadline is derived from the measured throughput.
+        :param offset: Bytes of the surrounding transfer received before view, reported by the exception
+        :param total: Size of the surrounding transfer, reported by the exception
+        """
+        start = lastReceived = time.perf_counter()
+        if deadline is None:
+            deadline = self._deadline(len(view), start)
+
+        position = 0
+        while position < len(view):
+            now = time.perf_counter()
+            if now > deadline or now - lastReceived > stallTimeout:
+                self.bytesReceived += position
+                self._timedOut(operation, offset + position, total if total is not None else len(view))
+
+            count = self.ser.readinto(view[position:])  # returns after POLL_INTERVAL at the latest
+            if count > 0:
+                position += count
+                lastReceived = time.perf_counter()
+
+        self.bytesReceived += len(view)
+        self._measureThroughput(len(view), time.perf_counter() - start)
+        if self.hooks:
+            self._responded(operation, len(view), time.perf_counter() - start)
+
+    def _read(self, size, operation, timeout=None):
+        """
+        :param timeout: Fixed timeout in seconds instead of the throughput based deadline
+        """
+        data = bytearray(size)
+        if timeout is None:
+            self._readInto(memoryview(data), operation)
+        else:
+            self._readInto(memoryview(data), operation, time.perf_counter() + timeout, stallTimeout=timeout)
+        return bytes(data)
+
+    def _connect(self, deadline):
+        """
+        Poll the handshake with growing timeouts until the reader answers. The reader may still be in reset or in
+        its bootloader right after opening the port, a running reader answers the first handshake.
+        """
+        attempt = 0
+        while time.perf_counter() < deadline:
+            timeout = self.CONNECT_POLL_INTERVALS[min(attempt, len(self.CONNECT_POLL_INTERVALS) - 1)]
+            attempt += 1
+
+            if self._performHandshake(min(timeout, max(deadline - time.perf_counter(), 0.001))):
+                if attempt > 1:
+                    self._drain(timeout)  # late answers to previous handshakes
+                return True
+
+        return False
+
+    def _drain(self, quietTime):
+        """
+        Discard received bytes until nothing was received for quietTime seconds.
+        :return: True if bytes were discarded
+        """
+        discarded = False
+        lastReceived = time.perf_counter()
+        while time.perf_counter() - lastReceived < quietTime:
+            if self.ser.read(max(1, self.ser.in_waiting)):
+                discarded = True
+                lastReceived = time.perf_counter()
+        return discarded
+
+    def _resynchronize(self, deadline):
+        """
+        Wait until an interrupted transfer ended and the reader answers a handshake again. A stalled reader sends the
+        rest of the transfer once it continues, so the handshake only counts if nothing follows its answer.
+        """
+        while time.perf_counter() < deadline:
+            self._drain(self.STALL_TIMEOUT)
+            if self._performHandshake(self.STALL_TIMEOUT) and not self._drain(self.STALL_TIMEOUT):
+                return
+        raise GBTransferException('no_handshake')
+
+    def _performHandshake(self, timeout=GBProtocol.HANDSHAKE_TIMEOUT):
+        self._write([0x01])
         try:
-            return ord(c) == 0xA0  # reader sbould return 0xA0 after receiving 0x01
-        except TypeError:
+            c = self._read(1, 'handshake', timeout)
+        except GBTimeoutException:
             return False
+        return c[0] == 0xA0  # reader sbould return 0xA0 after receiving 0x01
+
+    def _readProtocolVersion(self):
+        self._write([0x09])
+        try:
+            c = self._read(1, 'protocol_version', self.VERSION_TIMEOUT)
+        except GBTimeoutException:
+            return 1  # firmware does not know the version command
+        return c[0]
 
     def _readCartridgeType(self):
-        self.ser.write([0x02])
-        c = self.ser.read(1)
-        return ord(c)
+        self._write([0x02])
+        return self._read(1, 'cartridge_type')[0]
 
     def _readROMSize(self):
-        self.ser.write([0x03])
-        c = self.ser.read(1)
-        return ord(c)
+        self._write([0x03])
+        return self._read(1, 'rom_size')[0]
 
     def _readCGBFlag(self):
-        self.ser.write([0x04])
-        c = self.ser.read(1)
-        return ord(c)
+        self._write([0x04])
+        return self._read(1, 'cgb_flag')[0]
 
     def _readGameTitle(self, cgbFlag):
-        self.ser.write([0x05])
-        title = ""
-        for i in range(0x0134, 0x0143+1):
-            byte = self.ser.read(1)
-            try:
-                title += byte.decode("ascii")
-            except UnicodeDecodeError:
-                continue
-
-        if cgbFlag == CGBFlag.CGB_ONLY or cgbFlag == CGBFlag.CGB_SUPPORT:
-            return title[:11]
-        else:
-            return title[:16]
-
+        self._write([0x05])
+        return self._parseGameTitle(self._read(0x0143 - 0x0134 + 1, 'game_title'), cgbFlag)
 
     def _readNintendoLogo(self):
-        self.ser.write([0x06])
-        data = []
-        for i in range(0x0104, 0x0133 + 1):
-            byte = self.ser.read(1)
-            data.append(byte)
-        return data
+        self._write([0x06])
+        return self._read(0x0133 - 0x0104 + 1, 'nintendo_logo')
 
     def _readGlobalChecksum(self):
-        self.ser.write([0x08])
-        data = []
-        for i in range(0x014E, 0x014F + 1):
-            byte = self.ser.read(1)
-            data.append(byte)
-        return data
+        self._write([0x08])
+        return self._read(0x014F - 0x014E + 1, 'global_checksum')
+
+    def _readHeaderBlock(self):
+        self._write([0x0A])
+        return self._parseHeaderBlock(self._read(self.HEADER_SIZE + 1, 'header'))
+
+    def _readGameData(self, romSizeKB, progressFunction, romHash, realBankCount=None):
+        """
+        :param realBankCount: Banks actually stored on the cartridge, the others are mirrors and not transferred
+        """
+        size = int(romSizeKB * 1024)
+        data = bytearray(size)
+        view = memoryview(data)
+
+        if realBankCount is None:
+            realBankCount = size // self.BANK_SIZE
+        if self._useBankTransfer() or realBankCount < size // self.BANK_SIZE:
+            for bank in range(0, size // self.BANK_SIZE):
+                if bank < realBankCount:
+                    bankData = self._readBank(bank)
+                else:
+                    mirrored = bank % realBankCount * self.BANK_SIZE
+                    bankData = view[mirrored:mirrored + self.BANK_SIZE]
+                view[bank * self.BANK_SIZE:(bank + 1) * self.BANK_SIZE] = bankData
+                romHash.update(bankData)
+                progressFunction((bank + 1) * self.BANK_SIZE, size)
+            return bytes(data)
+
+        self._write([0x07])
+        dumpDeadline = self._deadline(size)
+
+        position = 0
+        while position < size:
+            block = view[position:position + self.blockSize]
+            self._readInto(block, 'dump', min(self._deadline(len(block)), dumpDeadline), position, size)
+            romHash.update(block)
+            position += len(block)
+
+            progressFunction(position, size)
+
+        return bytes(data)
+
+    def _streamGameData(self, romSizeKB, progressFunction, file, journal, romHash, realBankCount=None):
+        """
+        :param file: ROM file opened for writing and reading, mirrored banks are copied from the file
+        :param realBankCount: Banks actually stored on the cartridge, the others are mirrors and not transferred
+        """
+        size = int(romSizeKB * 1024)
+
+        if realBankCount is None:
+            realBankCount = size // self.BANK_SIZE
+        if self._useBankTransfer() or realBankCount < size // self.BANK_SIZE:
+            checksum = 0
+            for bank in range(0, size // self.BANK_SIZE):
+                if bank < realBankCount:
+                    data = self._readBank(bank)
+                else:
+                    file.seek(bank % realBankCount * self.BANK_SIZE)
+                    data = file.read(self.BANK_SIZE)
+                    file.seek(0, os.SEEK_END)
+                file.write(data)
+                file.flush()
+                checksum = self._calculateGlobalChecksum(data, bank * self.BANK_SIZE, checksum)
+                romHash.update(data)
+                journal.addBank(bank, hashlib.sha1(data).hexdigest())
 
-    def _readGameData(self, romSizeKB, progressFunction):
-        self.ser.write([0x07])
-        data = []
-        for i in range(0x0000, romSizeKB * 1024):
-            byte = self.ser.read(1)
-            data.append(byte)
+                progressFunction((bank + 1) * self.BANK_SIZE, size)
+            return checksum
 
-            progressFunction(i+1, romSizeKB * 1024)
+        self._write([0x07])
+        dumpDeadline = self._deadline(size)
+        view = memoryview(bytearray(self.blockSize))
 
+        position = 0
+        checksum = 0
+        bankHash = hashlib.sha1()
+        while position < size:
+            block = view[:min(self.blockSize, size - position)]
+            self._readInto(block, 'dump', min(self._deadline(len(block)), dumpDeadline), position, size)
+
+            file.write(block)
+            checksum = self._calculateGlobalChecksum(block, position, checksum)
+            romHash.update(block)
+
+            # journal every completed bank, the block size does not have to be aligned to banks
+            while len(block) > 0:
+                length = min(len(block), self.BANK_SIZE - position % self.BANK_SIZE)
+                bankHash.update(block[:length])
+                block = block[length:]
+                position += length
+
+                if position % self.BANK_SIZE == 0:
+                    file.flush()
+                    journal.addBank(position // self.BANK_SIZE - 1, bankHash.hexdigest(), checked=False)
+                    bankHash = hashlib.sha1()
+
+            progressFunction(position, size)
+
+        return checksum
+
+    def _shiftedBanks(self, file, banks):
+        """
+        Compare the streamed banks of a ROM file with the cartridge. Protocol 5 compares the CRC of every bank, older
+        firmware reads banks to find the first bank shifted by a lost byte.
+        :param file: Partial ROM file
+        :param banks: Streamed banks in ascending order
+        :return: List of the banks which differ
+        """
+        def matches(bank):
+            file.seek(bank * self.BANK_SIZE)
+            data = file.read(self.BANK_SIZE)
+            if self.protocolVersion >= 5:
+                return self._readBankCRC(bank) == binascii.crc_hqx(data, 0)
+            return self._readBank(bank) == data
+
+        if self.protocolVersion >= 5:
+            return [bank for bank in banks if not matches(bank)]
+
+        first, last = 0, len(banks)  # binary search, the banks before the lost byte are complete
+        while first < last:
+            middle = (first + last) // 2
+            if matches(banks[middle]):
+                first = middle + 1
+            else:
+                last = middle
+        return banks[first:]
+
+    def _readBankCRC(self, bank):
+        bank = self._mapBank(bank)
+        self._write([0x0D, bank >> 8, bank & 0xFF])
+        crc = self._read(2, 'bank_crc', self.BANK_CRC_TIMEOUT)
+        return (crc[0] << 8) + crc[1]
+
+    def _readBank(self, bank):
+        request = self._mapBank(bank)
+        if self._useCompressedTransfer():
+            return self._readCheckedBank(bank, request, self._receiveCompressedBank)
+        if self._useFramedTransfer():
+            return self._readCheckedBank(bank, request, self._receiveFrame)
+
+        self._write([0x0B, request >> 8, request & 0xFF])
+        return self._read(self.BANK_SIZE, 'bank')
+
+    def _receiveFrame(self, bank):
+        """
+        :return: Bank data of a valid frame (command 0x0C) or None
+        """
+        self._write([0x0C, bank >> 8, bank & 0xFF])
+        try:
+            frame = self._read(self.FRAME_SIZE, 'bank')
+        except GBTimeoutException:
+            return None  # lost bytes, retransmit
+        data = self._parseFrame(frame, bank)
+        if self.hooks:
+            self._emit("checksum", kind="frame", valid=data is not None)
         return data
 
+    def _receiveCompressedBank(self, bank):
+        """
+        Receive a run-length encoded bank (command 0x12) and decode it while it arrives.
+        :return: Bank data if the CRC matches or None
+        """
+        self._write([0x12, bank >> 8, bank & 0xFF])
+        start = lastReceived = time.perf_counter()
+        deadline = self._deadline(self.BANK_SIZE, start)
+
+        data = bytearray(self.BANK_SIZE)
+        received = bytearray()
+        position = 0
+        count = 0
+        try:
+            while position < len(data):
+                chunk = self.ser.read(max(1, self.ser.in_waiting))  # returns after POLL_INTERVAL at the latest
+                now = time.perf_counter()
+                if chunk:
+                    lastReceived = now
+                    received += chunk
+                    count += len(chunk)
+                    consumed, position = self._decodeRLE(received, data, position)
+                    del received[:consumed]
+                elif now > deadline or now - lastReceived > self.STALL_TIMEOUT:
+                    self._timedOut('bank', position, len(data))
+
+            missing = max(0, 2 - len(received))
+            crc = bytes(received) + self._read(missing, 'bank_crc')
+            count += missing
+        except (GBTimeoutException, UnknownGBDataException):
+            self.bytesReceived += count
+            self._drain(self.POLL_INTERVAL)  # the reader may still be sending the damaged bank
+            return None
+        self.bytesReceived += count
+        self._measureThroughput(count, time.perf_counter() - start)
+        self.compressedBytes += count
+        self.decompressedBytes += len(data)
+        valid = len(crc) == 2 and binascii.crc_hqx(data, 0) == (crc[0] << 8) + crc[1]
+        if self.hooks:
+            self._responded('bank', count, time.perf_counter() - start)
+            self._emit("checksum", kind="compressed", valid=valid)
+        return bytes(data) if valid else None
+
+    def _readCheckedBank(self, bank, request, receive):
+        """
+        Read a CRC checked bank, retransmitted up to maxRetries times.
+        :param request: Bank number sent to the reader (see _mapBank)
+        :param receive: Function requesting the bank number, returns the bank data or None for a damaged transfer
+        """
+        for attempt in range(0, self.maxRetries + 1):
+            if attempt > 0:
+                self.retries += 1
+                self.ser.reset_input_buffer()  # drop the rest of the bad transfer
+                if self.hooks:
+                    self._emit("retry", operation='bank', block=bank)
+
+            data = receive(request)
+            if data is not None:
+                return data
+
+            self.blockErrors[bank] = self.blockErrors.get(bank, 0) + 1
+            if attempt > 0 and self.ser.baudrate > self.DEFAULT_BAUDRATE:
+                self.ser.reset_input_buffer()
+                self._fallBack()  # repeated errors, the link is too fast
+
+        raise GBTransferException('bank_failed')
+
+    def _checkSaveRAM(self, cartridge):
+        """
+        :return: Size of the cartridge RAM
+        """
+        if self.protocolVersion < 10:
+            raise GBTransferException('save_ram_unsupported')
+        self.checkCartridge(cartridge)
+        if self._driver is None:
+            raise GBTransferException('save_ram_unsupported')  # RAM enable and banks depend on the controller
+
+        size = self.saveRAMSize(cartridge)
+        if size == 0:
+            raise GBTransferException('no_save_ram')
+        return size
+
+    def _ramBlocks(self, size):
+        """
+        :return: (RAM bank, address high byte, index of the first block, number of blocks) per mapped RAM bank
+        """
+        for offset in range(0, size, self.RAM_BANK_SIZE):
+            count = min(size - offset, self.RAM_BANK_SIZE) // self.RAM_BLOCK_SIZE
+            yield offset // self.RAM_BANK_SIZE, self.RAM_START >> 8, offset // self.RAM_BLOCK_SIZE, count
+
+    def _ramBlockCRC(self, data, index):
+        return binascii.crc_hqx(data[index * self.RAM_BLOCK_SIZE:(index + 1) * self.RAM_BLOCK_SIZE], 0)
+
+    def _maskRAM(self, data):
+        """
+        Clear the bits of the RAM bytes the controller does not store (MBC2), they read back undefined.
+        """
+        if self._driver.ramMask == 0xFF:
+            return bytes(data)
+        return bytes(data).translate(bytes(byte & self._driver.ramMask for byte in range(256)))
+
+    def _ramTimeout(self, accessed, sent=0):
+        """
+        Timeout for the answer to a RAM command which sends sent bytes and lets the reader access accessed bytes of
+        the cartridge RAM before it answers.
+        """
+        return self.MINIMUM_TIMEOUT + (accessed * (self.busDelay * 1e-6 + self.BUS_OVERHEAD) +
+                                       sent * self.FRAME_BITS / self.ser.baudrate) * self.TIMEOUT_FACTOR
+
+    def _readRAMBlockCRCs(self, addressH, count):
+        """
+        :return: CRC-16/XMODEM of count RAM blocks calculated by the reader (command 0x15)
+        """
+        self._write([0x15, addressH, count])
+        crcs = self._read(2 * count, 'ram_crc', self._ramTimeout(count * self.RAM_BLOCK_SIZE))
+        return [(crcs[index] << 8) + crcs[index + 1] for index in range(0, len(crcs), 2)]
+
+    def _receiveRAMBlock(self, addressH):
+        """
+        :return: RAM block (command 0x16) if its CRC matches or None
+        """
+        self._write([0x16, addressH])
+        try:
+            block = self._read(self.RAM_BLOCK_SIZE + 2, 'ram_block')
+        except GBTimeoutException:
+            return None
+        valid = binascii.crc_hqx(block[:-2], 0) == (block[-2] << 8) + block[-1]
+        if self.hooks:
+            self._emit("checksum", kind="ram_block", valid=valid)
+        return block[:-2] if valid else None
+
+    def _writeRAMBlock(self, addressH, block):
+        """
+        Write a RAM block (command 0x17) and verify it with the CRC of the block read back by the reader. Blocks
+        with unstored bits are read back and compared masked instead.
+        :return: True if the block was written or None
+        """
+        crc = binascii.crc_hqx(block, 0)
+        self._write(bytes([0x17, addressH]) + bytes(block) + bytes([crc >> 8, crc & 0xFF]))
+        try:
+            answer = self._read(2, 'ram_write', self._ramTimeout(2 * self.RAM_BLOCK_SIZE, self.RAM_BLOCK_SIZE + 4))
+        except GBTimeoutException:
+            return None
+
+        if self._driver.ramMask != 0xFF:
+            written = self._receiveRAMBlock(addressH)
+            valid = written is not None and self._maskRAM(written) == bytes(block)
+        else:
+            valid = (answer[0] << 8) + answer[1] == crc
+        if self.hooks:
+            self._emit("checksum", kind="ram_write", valid=valid)
+        return True if valid else None
+
+    def _retryRAMBlock(self, transfer):
+        """
+        :param transfer: Function transferring one RAM block, returns None for a damaged transfer
+        """
+        for attempt in range(0, self.maxRetries + 1):
+            if attempt > 0:
+                self.retries += 1
+                self.ser.reset_input_buffer()  # drop the rest of the bad transfer
+                if self.hooks:
+                    self._emit("retry", operation='ram_block', block=None)
+
+            result = transfer()
+            if result is not None:
+                return result
+
+        raise GBTransferException('ram_block_failed')
+
+    ######################################################################################
+    # Instrumentation, every hook call is guarded by "if self.hooks"
+    #####
+    def _write(self, data):
+        """
+        Send a command (first byte) and its arguments to the reader.
+        """
+        if self.hooks:
+            self._command = data[0]
+            self._commandStart = time.perf_counter()
+            self._emit("command", command=data[0], bytes=len(data))
+        self.ser.write(data)
+
+    def _emit(self, event, **fields):
+        fields.update(event=event, time=time.time(), port=self.port)
+        for hook in self.hooks:
+            hook(fields)
+
+    def _responded(self, operation, size, seconds):
+        """
+        A response arrived completely. The latency is reported for the first response to a command only.
+        """
+        latency = None
+        if self._commandStart is not None:
+            latency = time.perf_counter() - self._commandStart
+            self._commandStart = None
+        self._emit("response", command=self._command, operation=operation, bytes=size, seconds=seconds,
+                   latency=latency)
+
+    def _timedOut(self, operation, received, expected):
+        if self.hooks:
+            self._commandStart = None
+            self._emit("timeout", command=self._command, operation=operation, received=received, expected=expected)
+        raise GBTimeoutException(operation, received, expected)
+
+    def _dumpFinished(self, cartridge, start, received):
+        if self.hooks:
+            seconds = time.perf_counter() - start
+            size = cartridge.romBankCount * self.BANK_SIZE
+            self._emit("dump", bytes=size, received=self.bytesReceived - received, seconds=seconds,
+                       throughput=size / seconds if seconds > 0 else None, mode=self.transferMode(),
+                       retries=self.retries, cacheHit=self.cacheHit)
+
 
 class NoGBReaderException(Exception):
     pass
@@ -211,6 +1462,19 @@ class GBCartridgeChangedException(Exception):
     pass
 
 
+class GBTransferException(Exception):
+    pass
+
+
+class GBTimeoutException(GBTransferException):
+
+    def __init__(self, operation, received, expected):
+        super().__init__(operation + '_timeout', received, expected)
+        self.operation = operation  # e.g. 'header', 'dump', 'bank'
+        self.received = received  # bytes received before the deadline
+        self.expected = expected  # bytes expected in total
+
+
 class CGBFlag(Enum):
     CGB_SUPPORT = 0
     CGB_ONLY = 1
@@ -219,12 +1483,160 @@ class CGBFlag(Enum):
 
 class GBCartridge:
 
-    def __init__(self, cartridgeType, romSizeKB, romBankCount, cgbFlag, gameTitle, nintendoLogo, globalChecksum):
+    def __init__(self, cartridgeType, romSizeKB, romBankCount, cgbFlag, gameTitle, nintendoLogo, globalChecksum,
+                 headerChecksum=None, ramSize=None):
         self.cartridgeType = cartridgeType
         self.romSizeKB = romSizeKB
         self.romBankCount = romBankCount
         self.cgbFlag = cgbFlag
         self.gameTitle = gameTitle
         self.nintendoLogo = nintendoLogo
-        self.globalChecksum = globalChecksum#
-        self.gameData = None
\ No newline at end of file
+        self.globalChecksum = globalChecksum
+        self.headerChecksum = headerChecksum
+        self.ramSize = ramSize  # bytes of cartridge RAM declared by the header (0x0149), None below protocol 2
+        self.logoValid = bytes(nintendoLogo) == GBProtocol.NINTENDO_LOGO
+        self.headerChecksumValid = None  # header checksum (0x014D) matches, None below protocol 2
+        self.gameData = None
+        self.romFile = None  # ROM file written by streaming readGameData
+        self.romChecksum = None  # global checksum calculated by streaming readGameData
+        self.romHashes = None  # {"crc32", "md5", "sha1"} of the dumped ROM as hex strings
+        self.dumpStatus = None  # DumpStatus of the dump if checked against a DumpDatabase
+        self.knownDump = None  # matching DumpDatabase entry
+        self.realBankCount = None  # banks actually stored on the cartridge if probed, see GBReader.probeROMSize
+
+
+    def headerValid(self):
+        """
+        :return: False if the Nintendo logo or the header checksum differ, i.e. the cartridge has bad contact
+        """
+        return self.logoValid and self.headerChecksumValid is not False
+
+
+class ROMHash:
+
+    def __init__(self):
+        """
+        CRC32, MD5 and SHA-1 of a ROM, updated block by block while it is dumped.
+        """
+        self._crc32 = 0
+        self._md5 = hashlib.md5()
+        self._sha1 = hashlib.sha1()
+
+    def update(self, data):
+        self._crc32 = zlib.crc32(data, self._crc32)
+        self._md5.update(data)
+        self._sha1.update(data)
+
+    def hexdigests(self):
+        return {"crc32": "%08x" % self._crc32, "md5": self._md5.hexdigest(), "sha1": self._sha1.hexdigest()}
+
+
+class LinkSettings:
+    DEFAULT_FILE = os.path.join(os.path.expanduser("~"), ".gbreader", "links.json")
+
+    def __init__(self, filename=DEFAULT_FILE):
+        """
+        Negotiated baud rate and calibrated bus delays per cartridge type for every port, stored as JSON.
+        """
+        self.filename = filename
+        try:
+            with open(filename) as file:
+                self._settings = json.load(file)
+        except (OSError, ValueError):
+            self._settings = {}
+
+    def baudrate(self, port):
+        return self._settings.get(port, {}).get("baudrate")
+
+    def setBaudrate(self, port, baudrate):
+        if self.baudrate(port) == baudrate:
+            return
+        self._settings.setdefault(port, {})["baudrate"] = baudrate
+        self._save()
+
+    def busDelay(self, port, cartridgeType):
+        return self._settings.get(port, {}).get("busDelays", {}).get(cartridgeType)
+
+    def setBusDelay(self, port, cartridgeType, delay):
+        if self.busDelay(port, cartridgeType) == delay:
+            return
+        self._settings.setdefault(port, {}).setdefault("busDelays", {})[cartridgeType] = delay
+        self._save()
+
+    def _save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.filename)), exist_ok=True)
+        with open(self.filename + '.tmp', 'w') as file:
+            json.dump(self._settings, file)
+        os.replace(self.filename + '.tmp', self.filename)
+
+
+class DumpJournal:
+
+    def __init__(self, romFile):
+        """
+        Journal of the completed banks of a streaming dump, stored next to the ROM file.
+        The first line identifies the cartridge, every further line holds one bank and its SHA-1 hash.
+        :param romFile: Filename of the (partial) ROM file
+        """
+        self.filename = romFile + '.journal'
+
+    @classmethod
+    def create(cls, romFile, cartridge):
+        journal = cls(romFile)
+        with open(journal.filename, 'w') as file:
+            file.write(json.dumps(cls._identify(cartridge)) + '\n')
+        return journal
+
+    @staticmethod
+    def _identify(cartridge):
+        return {"title": cartridge.gameTitle, "type": cartridge.cartridgeType, "romBankCount": cartridge.romBankCount,
+                "headerChecksum": cartridge.headerChecksum, "globalChecksum": cartridge.globalChecksum}
+
+    def exists(self):
+        return os.path.exists(self.filename)
+
+    def matches(self, cartridge):
+        with open(self.filename) as file:
+            identity = json.loads(file.readline())
+
+        if identity["headerChecksum"] is None or cartridge.headerChecksum is None:
+            identity["headerChecksum"] = cartridge.headerChecksum  # header checksum unknown with protocol 1
+        return identity == self._identify(cartridge)
+
+    def load(self):
+        """
+        :return: Dictionary of bank number to SHA-1 hash of all completed banks
+        """
+        return {bank: entry["sha1"] for bank, entry in self._entries().items()}
+
+    def uncheckedBanks(self):
+        """
+        :return: Set of the banks whose last entry came from a transfer without checksum
+        """
+        return set(bank for bank, entry in self._entries().items() if not entry.get("checked", True))
+
+    def addBank(self, bank, sha1, checked=True):
+        """
+        :param checked: False for banks of an unchecked stream, which have to be compared before a resume
+        """
+        entry = {"bank": bank, "sha1": sha1}
+        if not checked:
+            entry["checked"] = False
+        with open(self.filename, 'a') as file:
+            file.write(json.dumps(entry) + '\n')
+
+    def _entries(self):
+        entries = {}
+        with open(self.filename) as file:
+            file.readline()
+            for line in file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    break  # incomplete last line
+                entries[entry["bank"]] = entry
+        return entries
+
+    def remove(self):
+        if self.exists():
+            os.remove(self.filename)
@@ -20,11 +20,13 @@
 
 from tkinter import *
 from tkinter import ttk
+import queue, time
 from PIL import Image
 from PIL import ImageTk as itk
 
 
 class GUI:
+    FRAME_INTERVAL = 40  # milliseconds between two updates of the window by queued events, 25 per second
 
     def __init__(self, loadHeader, loadGame, startGame, refreshCOMList, changeCOMDevice, saveFile):
         """
@@ -43,15 +45,22 @@ class GUI:
         self._onChangeCOMDevice = changeCOMDevice
         self._onSaveFile = saveFile
 
+        self._events = queue.Queue()  # (function, args) posted by worker threads, run on the Tk thread
+        self._pendingProgress = None  # (current, max, time) of the last progress update of a worker
+        self._shownProgress = None
+        self._transferStart = None  # start time of the running transfer
+
         self._initWindow()
 
         self._buildGUI()
 
         self._createMenu()
 
+        self._root.after(self.FRAME_INTERVAL, self._processEvents)
+
     def _initWindow(self):
         self._root = Tk()
-        self._root.geometry("547x504+30+30")
+        self._root.geometry("547x525+30+30")
         self._root.iconbitmap(default='icon.ico')
         self._root.title("GBC - Reader")
         self._root.resizable(width=False, height=False)
@@ -130,6 +139,9 @@ class GUI:
         self._progress = ttk.Progressbar(master=self._root, orient="horizontal", max=100)
         self._progress.grid(row=13, column=0, columnspan=5, sticky="ESW")
 
+        self._rateLabel = Label(master=self._root, text="", fg="gray")
+        self._rateLabel.grid(row=14, column=0, columnspan=4)
+
 
     def _createMenu(self):
         """
@@ -164,6 +176,61 @@ class GUI:
         """
         self._root.destroy()
 
+    def post(self, function, *args):
+        """
+        Run function(*args) on the Tk thread. May be called from any thread, Tk widgets must only be touched by the
+        Tk thread.
+        """
+        self._events.put((function, args))
+
+    def startTransfer(self):
+        """
+        Thread-safe reset of the progress bar and the transfer rate for a new transfer.
+        """
+        self._transferStart = time.perf_counter()
+        self._pendingProgress = (0, 1, self._transferStart)
+
+    def postProgress(self, current, max):
+        """
+        Thread-safe progress update for transfers. Only the latest update is shown, at most once per frame.
+        :param current: Transferred bytes
+        :param max: Total bytes of the transfer
+        """
+        self._pendingProgress = (current, max, time.perf_counter())
+
+    def _processEvents(self):
+        """
+        Run all posted events and show the latest progress, then reschedule itself.
+        """
+        while True:
+            try:
+                function, args = self._events.get_nowait()
+            except queue.Empty:
+                break
+            function(*args)
+
+        progress = self._pendingProgress
+        if progress is not None and progress is not self._shownProgress:
+            self._shownProgress = progress
+            self._showProgress(*progress)
+
+        self._root.after(self.FRAME_INTERVAL, self._processEvents)
+
+    def _showProgress(self, current, max, now):
+        self.setProgress(current, max)
+
+        if self._transferStart is None or now <= self._transferStart:
+            self._rateLabel['text'] = ""
+            return
+
+        seconds = now - self._transferStart
+        rate = current / seconds
+        if current >= max:
+            self._rateLabel['text'] = "%.1f KB/s, done in %.1f s" % (rate / 1024, seconds)
+        elif rate > 0:
+            seconds = int((max - current) / rate)
+            self._rateLabel['text'] = "%.1f KB/s, %d:%02d left" % (rate / 1024, seconds // 60, seconds % 60)
+
     def setTitle(self, title):
         """
         Set title label to given string.
@@ -243,7 +310,7 @@ class GUI:
         Set nintendo logo image to given image
         :param image: Image as Image
         """
-        image = image.resize((48 * 5, 8 * 5))
+        image = image.resize((48 * 5, 8 * 5), Image.NEAREST)  # keep the pixels sharp
         photo = itk.PhotoImage(image)
         self._nintendoLogo['image'] = photo
         self._nintendoLogo.image = photo
@@ -262,4 +329,4 @@ class GUI:
         """
         self._comMenu.delete(2, END)
         for com in comList:
-            self._comMenu.add_radiobutton(label=com.device+' - '+com.description, command=lambda: self._onChangeCOMDevice(com.device))
+            self._comMenu.add_radiobutton(label=com.device+' - '+com.description, command=lambda device=com.device: self._onChangeCOMDevice(device))
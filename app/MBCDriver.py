@@ -0,0 +1,180 @@
+# Copyright (c) 2017 Fabian Friedl
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+
+class MBCDriver:
+    """
+    Bank selection of a memory bank controller, driven from the host (protocol 9). Drivers are registered for the
+    cartridge type codes of GBProtocol.cartridgeTypes, see MBCDriver.register.
+    """
+    maxBanks = 2  # banks the controller can address
+    builtInRAM = 0  # bytes of RAM inside the controller, the header declares no RAM for it
+    ramMask = 0xFF  # bits of a RAM byte which are stored
+    drivers = {}  # cartridge type code -> MBCDriver subclass
+
+    def __init__(self, write):
+        """
+        :param write: Function writing (address, data) to the cartridge
+        """
+        self._write = write
+        self._registers = {}  # last value per register address, unchanged registers are not written again
+
+    @classmethod
+    def register(cls, cartridgeTypes):
+        """
+        Use this driver for the given cartridge type codes.
+        """
+        for cartridgeType in cartridgeTypes:
+            MBCDriver.drivers[cartridgeType] = cls
+
+    @staticmethod
+    def forType(cartridgeType):
+        """
+        :return: Driver class for the cartridge type code or None
+        """
+        return MBCDriver.drivers.get(cartridgeType)
+
+    def selectBank(self, bank):
+        """
+        Map bank for the next read.
+        :return: 0 if the bank is mapped to 0x0000-0x3FFF, otherwise the bank number (read from 0x4000-0x7FFF)
+        """
+        return bank
+
+    def reset(self):
+        """
+        Map bank 0 to 0x0000-0x3FFF again, e.g. before the header is read. Written even if the registers seem
+        unchanged, the cartridge may have been swapped.
+        """
+        pass
+
+    def enableRAM(self, enabled):
+        """
+        Enable (0x0A) or disable the cartridge RAM at 0xA000-0xBFFF. It is disabled again after every access, so
+        a power loss while the cartridge is inserted does not corrupt the saves.
+        """
+        self._setRegister(0x0000, 0x0A if enabled else 0x00)
+
+    def selectRAMBank(self, bank):
+        """
+        Map the 8 KiB RAM bank to 0xA000-0xBFFF.
+        """
+        self._setRegister(0x4000, bank)
+
+    def _setRegister(self, address, value):
+        if self._registers.get(address) != value:
+            self._write(address, value)
+            self._registers[address] = value
+
+
+class ROMOnlyDriver(MBCDriver):
+    """
+    32 KiB ROM without controller, bank 1 is always mapped to 0x4000-0x7FFF. Up to 8 KiB RAM are always enabled.
+    """
+    maxBanks = 2
+
+    def enableRAM(self, enabled):
+        pass
+
+    def selectRAMBank(self, bank):
+        pass
+
+
+class MBC1Driver(MBCDriver):
+    """
+    5 bit bank register (0x2000) and 2 upper bits (0x4000). Banks 0x20, 0x40 and 0x60 can not be mapped to
+    0x4000-0x7FFF, they are read from 0x0000-0x3FFF in mode 1 (0x6000). The upper bits select the RAM bank in
+    mode 1. Mode 1 also maps bank (upper bits << 5) to 0x0000-0x3FFF, so all other banks are read in mode 0.
+    """
+    maxBanks = 128
+
+    def reset(self):
+        self._registers.clear()
+        self._setRegister(0x6000, 0)
+        self._setRegister(0x4000, 0)
+
+    def selectRAMBank(self, bank):
+        self._setRegister(0x6000, 1 if bank else 0)
+        self._setRegister(0x4000, bank & 0x03)
+
+    def selectBank(self, bank):
+        if bank & 0x1F == 0:
+            self._setRegister(0x4000, bank >> 5)
+            self._setRegister(0x6000, 1 if bank else 0)
+            return 0
+
+        self._setRegister(0x6000, 0)
+        self._setRegister(0x4000, bank >> 5)
+        self._setRegister(0x2000, bank & 0x1F)
+        return bank
+
+
+class MBC2Driver(MBCDriver):
+    """
+    4 bit bank register, selected by address bit 8 (0x2100). 512 x 4 bit RAM inside the controller, enabled with
+    address bit 8 cleared.
+    """
+    maxBanks = 16
+    builtInRAM = 512
+    ramMask = 0x0F
+
+    def selectRAMBank(self, bank):
+        pass
+
+    def selectBank(self, bank):
+        if bank == 0:
+            return 0
+        self._setRegister(0x2100, bank & 0x0F)
+        return bank
+
+
+class MBC3Driver(MBCDriver):
+    """
+    7 bit bank register (0x2000), 8 bit on MBC30. RAM banks 0-3 (0x4000), 0x08-0x0C map the clock registers.
+    """
+    maxBanks = 256
+
+    def selectBank(self, bank):
+        if bank == 0:
+            return 0
+        self._setRegister(0x2000, bank & 0xFF)
+        return bank
+
+
+class MBC5Driver(MBCDriver):
+    """
+    Low 8 bits (0x2000) and 9th bit (0x3000) of the bank number, RAM banks 0-15 (0x4000).
+    """
+    maxBanks = 512
+
+    def selectBank(self, bank):
+        if bank == 0:
+            return 0
+        self._setRegister(0x2000, bank & 0xFF)
+        self._setRegister(0x3000, bank >> 8)
+        return bank
+
+
+ROMOnlyDriver.register((0x00, 0x08, 0x09))
+MBC1Driver.register((0x01, 0x02, 0x03))
+MBC2Driver.register((0x05, 0x06))
+MBC3Driver.register((0x0F, 0x10, 0x11, 0x12, 0x13))
+MBC5Driver.register((0x19, 0x1A, 0x1B, 0x1C, 0x1D, 0x1E))
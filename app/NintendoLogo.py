@@ -25,43 +25,44 @@
 #       NOTICE: This file needs Image library installed to work.
 #                   ("python -m pip install Image")
 
-from PIL import Image, ImageDraw
+from functools import lru_cache
+
+from PIL import Image
+
+from GBReader import GBProtocol
 
 
 class NintendoLogo:
+    HIGH_NIBBLES = bytes(byte >> 4 for byte in range(256))
+    LOW_NIBBLES = bytes(byte & 0x0F for byte in range(256))
+
     def __init__(self, data):
-        self._data = data
+        self._data = bytes(data)
         if len(data) != 48:
             raise NoNintendoLogoException('Invalid length. Does not match length of 48!')
 
-        self._drawImage()
+        self._img = self._render(self._data)
+
+    def isValid(self):  # the logo matches the one the boot ROM checks
+        return self._data == GBProtocol.NINTENDO_LOGO
 
     def saveImage(self, filename, format='PNG'):  # save image to specific file with specific format
         self._img.save(filename, format)
 
-    def getImage(self):  # return PIL image object of drawn logo
+    def getImage(self):  # return PIL image object of drawn logo, shared by all logos with the same data
         return self._img
 
-    def _drawImage(self):  # draws image
-        # bounds: 48x8
-        self._img = Image.new('RGB', (48, 8), "white")
-        self._draw = ImageDraw.Draw(self._img)
-
-        # first half
-        for i in range(0, 24, 2):
-            self._drawByte(i * 2, 0, self._data[i])
-            self._drawByte(i * 2, 2, self._data[i + 1])
-
-        # second half
-        for i in range(0, 24, 2):
-            self._drawByte(i * 2, 4, self._data[i + 24])
-            self._drawByte(i * 2, 6, self._data[i + 24 + 1])
+    @staticmethod
+    @lru_cache(maxsize=32)
+    def _render(data):  # draws image, logos are cached by content
+        # bounds: 48x8, every byte is a 4x2 tile: high nibble on the upper row, the most significant bit on the left
+        # tiles of even bytes cover rows 0-1 (first half) and 4-5 (second half), odd bytes the rows below
+        rows = b''.join(tiles.translate(nibbles) for tiles in (data[0:24:2], data[1:24:2], data[24::2], data[25::2])
+                        for nibbles in (NintendoLogo.HIGH_NIBBLES, NintendoLogo.LOW_NIBBLES))
 
-    def _drawByte(self, x, y, byte):  # draw one byte to certain position
-        for line in range(0, 2):  # go through each line of byte
-            for n in range(0, 4):  # go through each n of byte
-                if ord(byte) & 1 << n + (line * 4):  # check if bit is set (+line*4  -> offset for second line)
-                    self._draw.rectangle([(x + 3 - n, y + 1 - line), (x + 3 - n, y + 1 - line)], fill="black")
+        # two nibbles per byte: each byte is below 0x10, so shifting the whole row data does not carry
+        bitmap = (int.from_bytes(rows[0::2], 'big') << 4 | int.from_bytes(rows[1::2], 'big')).to_bytes(48, 'big')
+        return Image.frombytes('1', (48, 8), bitmap, 'raw', '1;I').convert('RGB')  # set bits are black
 
 
 class NoNintendoLogoException(Exception):
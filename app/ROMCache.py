@@ -0,0 +1,139 @@
+# Copyright (c) 2017 Fabian Friedl
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import hashlib, json, os, shutil, time
+from threading import Lock, get_ident
+
+
+class ROMCache:
+    BANK_SIZE = 0x4000
+    DEFAULT_DIRECTORY = os.path.join(os.path.expanduser("~"), ".gbreader", "cache")
+
+    def __init__(self, directory=DEFAULT_DIRECTORY, maxBytes=512 * 1024 * 1024):
+        """
+        Local cache of dumped ROMs keyed by the header fingerprint of the cartridge (title, type, ROM size,
+        header and global checksum). The least recently used ROMs are evicted when the cache grows beyond maxBytes.
+        The cache may be shared by several readers in the same process.
+        :param directory: Directory of the ROM files and the index
+        :param maxBytes: Size cap of all cached ROMs in bytes
+        """
+        self.directory = directory
+        self.maxBytes = maxBytes
+
+        self._lock = Lock()
+        self._index = self._loadIndex()  # key -> {"size", "checksum", "hashes", "banks": [sha1 per bank], "lastUsed"}
+
+    @staticmethod
+    def key(cartridge):
+        fingerprint = "|".join(str(value) for value in (cartridge.gameTitle, cartridge.cartridgeType,
+                                                         cartridge.romBankCount, cartridge.headerChecksum,
+                                                         cartridge.globalChecksum))
+        return hashlib.sha1(fingerprint.encode("utf-8")).hexdigest()
+
+    def lookup(self, cartridge):
+        """
+        :return: Cache entry of the cartridge (dict with "file", "checksum", "hashes" and "banks") or None
+        """
+        key = self.key(cartridge)
+        with self._lock:
+            entry = self._index.get(key)
+            if entry is None or not os.path.exists(self._file(key)):
+                return None
+
+            entry["lastUsed"] = time.time()
+            self._saveIndex()
+            return dict(entry, file=self._file(key))
+
+    def copy(self, entry, filename):
+        """
+        Copy a cached ROM to filename.
+        """
+        shutil.copyfile(entry["file"], filename)
+
+    def store(self, cartridge, romFile=None, data=None, checksum=None, hashes=None):
+        """
+        Add a complete dump of the cartridge to the cache, given as ROM file or as bytes.
+        :param checksum: Calculated global checksum of the ROM
+        :param hashes: CRC32, MD5 and SHA-1 of the ROM (GBCartridge.romHashes)
+        """
+        key = self.key(cartridge)
+        os.makedirs(self.directory, exist_ok=True)
+
+        temporary = "%s.%d.tmp" % (self._file(key), get_ident())
+        banks = []
+        with open(temporary, 'wb') as file:
+            if data is not None:
+                file.write(data)
+                for offset in range(0, len(data), self.BANK_SIZE):
+                    banks.append(hashlib.sha1(data[offset:offset + self.BANK_SIZE]).hexdigest())
+            else:
+                with open(romFile, 'rb') as source:
+                    for bank in iter(lambda: source.read(self.BANK_SIZE), b''):
+                        file.write(bank)
+                        banks.append(hashlib.sha1(bank).hexdigest())
+            size = file.tell()
+        os.replace(temporary, self._file(key))
+
+        with self._lock:
+            self._index[key] = {"size": size, "checksum": checksum, "hashes": hashes, "banks": banks,
+                                "lastUsed": time.time()}
+            self._evict()
+            self._saveIndex()
+
+    def remove(self, cartridge):
+        with self._lock:
+            self._remove(self.key(cartridge))
+            self._saveIndex()
+
+    def size(self):
+        with self._lock:
+            return sum(entry["size"] for entry in self._index.values())
+
+    def _evict(self):
+        size = sum(entry["size"] for entry in self._index.values())
+        for key in sorted(self._index, key=lambda key: self._index[key]["lastUsed"]):
+            if size <= self.maxBytes:
+                break
+            size -= self._index[key]["size"]
+            self._remove(key)
+
+    def _remove(self, key):
+        self._index.pop(key, None)
+        if os.path.exists(self._file(key)):
+            os.remove(self._file(key))
+
+    def _file(self, key):
+        return os.path.join(self.directory, key + '.gb')
+
+    def _indexFile(self):
+        return os.path.join(self.directory, 'index.json')
+
+    def _loadIndex(self):
+        try:
+            with open(self._indexFile()) as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}  # no or damaged index, the cache starts empty
+
+    def _saveIndex(self):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self._indexFile() + '.tmp', 'w') as file:
+            json.dump(self._index, file)
+        os.replace(self._indexFile() + '.tmp', self._indexFile())
@@ -0,0 +1,106 @@
+# Copyright (c) 2017 Fabian Friedl
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+from collections import OrderedDict
+
+from GBReader import *
+
+
+class ROMView:
+    DEFAULT_MAX_BYTES = 64 * GBProtocol.BANK_SIZE  # 1 MiB
+
+    def __init__(self, reader, cartridge, maxBytes=DEFAULT_MAX_BYTES):
+        """
+        Random access to the ROM of the inserted cartridge without dumping it. Indexing and slicing work like on
+        bytes, only the touched banks are read (command 0x0B, protocol 3) and kept in an LRU cache.
+        :param reader: Connected GBReader
+        :param cartridge: Header of the inserted cartridge
+        :param maxBytes: Memory budget of the bank cache, at least one bank is kept
+        """
+        if reader.protocolVersion < 3:
+            raise GBTransferException('read_bank_unsupported')
+        reader.checkCartridge(cartridge)  # the cartridge may have been swapped since its header was read
+
+        self.reader = reader
+        self.cartridge = cartridge
+        self.maxBanks = max(1, maxBytes // GBProtocol.BANK_SIZE)
+
+        self.hits = 0  # bank lookups served from the cache
+        self.misses = 0  # banks read from the cartridge
+
+        self._banks = OrderedDict()  # bank number -> bank data, least recently used first
+
+    def __len__(self):
+        return self.cartridge.romBankCount * GBProtocol.BANK_SIZE
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            indices = range(*key.indices(len(self)))
+            if len(indices) == 0:
+                return b''
+            if indices.step == 1:
+                return self.read(indices.start, len(indices))
+
+            first = min(indices[0], indices[-1])
+            data = self.read(first, max(indices[0], indices[-1]) - first + 1)
+            return bytes(data[index - first] for index in indices)
+
+        if key < 0:
+            key += len(self)
+        if not 0 <= key < len(self):
+            raise IndexError('ROM index out of range')
+        return self.bank(key // GBProtocol.BANK_SIZE)[key % GBProtocol.BANK_SIZE]
+
+    def read(self, offset, size):
+        """
+        :return: size bytes of the ROM from offset, shorter at the end of the ROM
+        """
+        end = min(offset + size, len(self))
+        chunks = []
+        while offset < end:
+            bank, start = divmod(offset, GBProtocol.BANK_SIZE)
+            length = min(GBProtocol.BANK_SIZE - start, end - offset)
+            chunks.append(self.bank(bank)[start:start + length])
+            offset += length
+        return b''.join(chunks)
+
+    def bank(self, bank):
+        """
+        :return: Data of the given bank as bytes, read from the cartridge on the first access
+        """
+        if not 0 <= bank < self.cartridge.romBankCount:
+            raise IndexError('bank out of range')
+
+        data = self._banks.get(bank)
+        if data is not None:
+            self._banks.move_to_end(bank)
+            self.hits += 1
+            return data
+
+        data = self.reader.readBank(bank)
+        self.misses += 1
+        self._banks[bank] = data
+        while len(self._banks) > self.maxBanks:
+            self._banks.popitem(last=False)
+        return data
+
+    def clear(self):
+        self._banks.clear()
@@ -0,0 +1,403 @@
+# Copyright (c) 2017 Fabian Friedl
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Headless command line interface for scripted dumping. Every command prints JSON (batch: one JSON line per
+# reader) and exits with 1 if anything failed.
+#
+#   python ReaderCLI.py probe
+#   python ReaderCLI.py header COM3 --logo logo.png
+#   python ReaderCLI.py calibrate COM3
+#   python ReaderCLI.py dump COM3 game.gbc
+#   python ReaderCLI.py read COM3 0x4000 256
+#   python ReaderCLI.py verify game.gbc --port COM3
+#   python ReaderCLI.py backup COM3
+#   python ReaderCLI.py restore COM3 game.sav
+#   python ReaderCLI.py batch COM3 COM4 --output roms
+#   python ReaderCLI.py --metrics-prom gbreader.prom --metrics-jsonl events.jsonl dump COM3 game.gbc
+#
+# Only GBReader is imported at startup. Serial port enumeration, the dump farm and PIL are imported by the
+# commands which need them, so the headless commands never pay for Tk or PIL.
+
+import argparse, json, sys, time
+
+from GBReader import *
+
+
+def cartridgeInfo(cartridge):
+    return {"title": cartridge.gameTitle.rstrip('\x00'), "type": cartridge.cartridgeType,
+            "romSizeKB": cartridge.romSizeKB, "romBankCount": cartridge.romBankCount,
+            "cgbFlag": cartridge.cgbFlag.name, "globalChecksum": "%04X" % cartridge.globalChecksum,
+            "nintendoLogo": bytes(cartridge.nintendoLogo).hex(), "logoValid": cartridge.logoValid,
+            "headerChecksumValid": cartridge.headerChecksumValid}
+
+
+def errorInfo(error):
+    info = {"error": type(error).__name__, "details": [str(arg) for arg in error.args]}
+    if isinstance(error, GBTimeoutException):
+        info["received"] = error.received
+        info["expected"] = error.expected
+    return info
+
+
+def output(result):
+    json.dump(result, sys.stdout)
+    sys.stdout.write('\n')
+    sys.stdout.flush()
+
+
+def probe(args):
+    from ReaderDiscovery import ReaderDiscovery
+
+    readers = ReaderDiscovery(args.timeout).discover(args.ports or None)
+    output([{"device": reader.device, "description": reader.description, "protocolVersion": reader.protocolVersion,
+             "connectLatency": reader.connectLatency} for reader in readers])
+    return 0
+
+
+def header(args):
+    reader = GBReader(args.port, hooks=args.hooks)
+    try:
+        cartridge = reader.readCartridgeHeader()
+    finally:
+        reader.close()
+
+    result = cartridgeInfo(cartridge)
+    if args.logo:
+        from NintendoLogo import NintendoLogo  # needs PIL
+
+        NintendoLogo(cartridge.nintendoLogo).saveImage(args.logo)
+        result["logoFile"] = args.logo
+
+    output(result)
+    return 0
+
+
+def calibrate(args):
+    """
+    Tune the bus delay of the reader to the inserted cartridge and remember it for the cartridge type.
+    """
+    reader = GBReader(args.port, linkSettings=LinkSettings(), hooks=args.hooks)
+    try:
+        cartridge = reader.readCartridgeHeader()
+        start = time.perf_counter()
+        busDelay = reader.calibrateBusDelay(cartridge)
+        seconds = time.perf_counter() - start
+    finally:
+        reader.close()
+
+    output({"cartridge": cartridgeInfo(cartridge), "protocolVersion": reader.protocolVersion, "busDelay": busDelay,
+            "seconds": seconds})
+    return 0
+
+
+def dump(args):
+    cache = None
+    if args.cache:
+        from ROMCache import ROMCache
+
+        cache = ROMCache(args.cache)
+
+    database = None
+    if args.database:
+        from DumpDatabase import DumpDatabase
+
+        database = DumpDatabase(args.database)
+
+    reader = GBReader(args.port, framed=args.framed, cache=cache, database=database,
+                      linkSettings=LinkSettings(), compressed=args.compressed, probeMirrors=args.probe_mirrors,
+                      hooks=args.hooks)
+    try:
+        start = time.perf_counter()
+        cartridge = reader.readCartridgeHeader()
+        if not args.force:
+            reader.checkHeader(cartridge)
+        if args.resume:
+            reader.resumeGameData(cartridge, progress(args), args.file)
+        else:
+            reader.readGameData(cartridge, progress(args), args.file)
+        seconds = time.perf_counter() - start
+        checksumValid = reader.checkGlobalChecksum(cartridge)
+    finally:
+        reader.close()
+
+    size = cartridge.romBankCount * GBReader.BANK_SIZE
+    result = {"cartridge": cartridgeInfo(cartridge), "file": args.file, "checksumValid": checksumValid,
+              "hashes": cartridge.romHashes, "seconds": seconds,
+              "bytesPerSecond": size / seconds if seconds > 0 else None, "retries": reader.retries,
+              "cacheHit": reader.cacheHit, "transferMode": reader.transferMode(),
+              "compressionRatio": reader.compressionRatio(), "realBankCount": cartridge.realBankCount}
+    if cartridge.dumpStatus is not None:
+        result["dumpStatus"] = cartridge.dumpStatus.name
+        result["knownDump"] = cartridge.knownDump["name"] if cartridge.knownDump is not None else None
+    output(result)
+    return 0 if checksumValid else 1
+
+
+def read(args):
+    """
+    Read a range of the ROM. Only the banks it touches are transferred.
+    """
+    from ROMView import ROMView
+
+    reader = GBReader(args.port, framed=args.framed, linkSettings=LinkSettings(), hooks=args.hooks)
+    try:
+        view = ROMView(reader, reader.readCartridgeHeader())
+        start = time.perf_counter()
+        data = view.read(args.offset, args.size)
+        seconds = time.perf_counter() - start
+    finally:
+        reader.close()
+
+    output({"offset": args.offset, "size": len(data), "data": data.hex(), "banksRead": view.misses,
+            "seconds": seconds})
+    return 0
+
+
+def backup(args):
+    """
+    Back up the cartridge RAM. Only the blocks changed since the latest backup in the store are transferred.
+    """
+    from SaveStore import SaveStore
+
+    store = SaveStore(args.store) if args.store else SaveStore()
+    reader = GBReader(args.port, linkSettings=LinkSettings(), hooks=args.hooks)
+    try:
+        cartridge = reader.readCartridgeHeader()
+        start = time.perf_counter()
+        filename = reader.backupSaveRAM(cartridge, store, progress(args))
+        seconds = time.perf_counter() - start
+    finally:
+        reader.close()
+
+    output({"cartridge": cartridgeInfo(cartridge), "file": filename, "ramSize": reader.saveRAMSize(cartridge),
+            "blocksTransferred": reader.ramBlocksTransferred, "versions": len(store.versions(cartridge)),
+            "seconds": seconds})
+    return 0
+
+
+def restore(args):
+    """
+    Write a save file, by default the latest backup, to the cartridge RAM. Only the differing blocks are written.
+    """
+    from SaveStore import SaveStore
+
+    reader = GBReader(args.port, linkSettings=LinkSettings(), hooks=args.hooks)
+    try:
+        cartridge = reader.readCartridgeHeader()
+        if args.file:
+            with open(args.file, 'rb') as file:
+                data = file.read()
+        else:
+            data = (SaveStore(args.store) if args.store else SaveStore()).latest(cartridge)
+            if data is None:
+                raise GBTransferException('no_backup')
+        start = time.perf_counter()
+        written = reader.restoreSaveRAM(cartridge, data, progress(args))
+        seconds = time.perf_counter() - start
+    finally:
+        reader.close()
+
+    output({"cartridge": cartridgeInfo(cartridge), "file": args.file, "writtenBlocks": written, "seconds": seconds})
+    return 0
+
+
+def importDAT(args):
+    from DumpDatabase import DumpDatabase
+
+    start = time.perf_counter()
+    database = DumpDatabase(args.database)
+    count = sum(database.importDAT(filename) for filename in args.files)
+    output({"imported": count, "entries": len(database), "seconds": time.perf_counter() - start})
+    return 0
+
+
+def verify(args):
+    """
+    Check the header and global checksum of a ROM file and, with --port, compare it with the inserted cartridge.
+    """
+    with open(args.file, 'rb') as file:
+        rom = file.read()
+
+    protocol = GBProtocol()
+    cartridge = protocol._parseCartridgeHeader(rom[GBProtocol.HEADER_START:GBProtocol.HEADER_START +
+                                                   GBProtocol.HEADER_SIZE])
+    result = {"file": args.file, "cartridge": cartridgeInfo(cartridge),
+              "sizeValid": len(rom) == cartridge.romBankCount * GBProtocol.BANK_SIZE,
+              "headerChecksumValid": cartridge.headerChecksumValid,
+              "globalChecksumValid": protocol._calculateGlobalChecksum(rom) == cartridge.globalChecksum}
+
+    if args.port:
+        reader = GBReader(args.port, linkSettings=LinkSettings(), hooks=args.hooks)
+        try:
+            start = time.perf_counter()
+            differing = reader.verify(args.file)
+            result["seconds"] = time.perf_counter() - start
+        finally:
+            reader.close()
+        result["differingBanks"] = differing
+        result["matchesCartridge"] = not differing
+
+    output(result)
+    return 0 if all(value for key, value in result.items() if key.endswith("Valid") or key.startswith("matches")) \
+        else 1
+
+
+def batch(args):
+    from DumpFarm import DumpFarm
+
+    failed = False
+    farm = DumpFarm(args.ports, args.output, framed=args.framed, compressed=args.compressed, hooks=args.hooks)
+    try:
+        farm.dumpAll()
+        while not farm.results.empty():
+            result = farm.results.get()
+            if result.error is not None:
+                failed = True
+                output(dict(errorInfo(result.error), port=result.port, retries=result.retries))
+            else:
+                failed = failed or not result.checksumValid
+                output({"port": result.port, "cartridge": cartridgeInfo(result.cartridge), "file": result.filename,
+                        "checksumValid": result.checksumValid, "seconds": result.seconds,
+                        "retries": result.retries})
+    finally:
+        farm.close()
+
+    return 1 if failed else 0
+
+
+def progress(args):
+    """
+    Progress function writing one JSON line per 10% to stderr with --progress.
+    """
+    if not args.progress:
+        return lambda current, max: None
+
+    reported = [-1]
+
+    def report(current, max):
+        percent = current * 100 // max
+        if percent // 10 > reported[0]:
+            reported[0] = percent // 10
+            sys.stderr.write(json.dumps({"current": current, "max": max}) + '\n')
+
+    return report
+
+
+def parser():
+    parser = argparse.ArgumentParser(prog="gbc-reader-cli", description="Game Boy cartridge reader without GUI")
+    parser.add_argument("--metrics-jsonl", help="append every reader event as JSON line to this file")
+    parser.add_argument("--metrics-prom", help="write the reader metrics in the Prometheus text format to this file")
+    commands = parser.add_subparsers(dest="command")
+    commands.required = True
+
+    command = commands.add_parser("probe", help="find the connected readers")
+    command.add_argument("ports", nargs="*", help="serial ports to probe, default: all")
+    command.add_argument("--timeout", type=float, default=1.0, help="handshake timeout per port")
+    command.set_defaults(function=probe)
+
+    command = commands.add_parser("header", help="read the cartridge header")
+    command.add_argument("port", help="serial port of the reader")
+    command.add_argument("--logo", help="save the Nintendo logo as PNG (needs PIL)")
+    command.set_defaults(function=header)
+
+    command = commands.add_parser("calibrate", help="tune the bus delay of the reader to the cartridge type")
+    command.add_argument("port", help="serial port of the reader")
+    command.set_defaults(function=calibrate)
+
+    command = commands.add_parser("dump", help="dump the cartridge ROM to a file")
+    command.add_argument("port", help="serial port of the reader")
+    command.add_argument("file", help="ROM file")
+    command.add_argument("--framed", action="store_true", help="use CRC checked framed transfers")
+    command.add_argument("--compressed", action="store_true", help="use run-length compressed transfers")
+    command.add_argument("--probe-mirrors", action="store_true", help="transfer mirrored banks of small ROMs once")
+    command.add_argument("--resume", action="store_true", help="complete an interrupted dump of the file")
+    command.add_argument("--force", action="store_true", help="dump even if the header reads back damaged")
+    command.add_argument("--progress", action="store_true", help="report the progress as JSON lines on stderr")
+    command.add_argument("--cache", help="ROM cache directory, known cartridges are not dumped again")
+    command.add_argument("--database", help="database of known dumps to classify the dump")
+    command.set_defaults(function=dump)
+
+    command = commands.add_parser("read", help="read a range of the ROM without dumping it")
+    command.add_argument("port", help="serial port of the reader")
+    command.add_argument("offset", type=lambda value: int(value, 0), help="ROM offset, e.g. 0x4000")
+    command.add_argument("size", type=lambda value: int(value, 0), help="number of bytes")
+    command.add_argument("--framed", action="store_true", help="use CRC checked framed transfers")
+    command.set_defaults(function=read)
+
+    command = commands.add_parser("verify", help="check the checksums of a ROM file")
+    command.add_argument("file", help="ROM file")
+    command.add_argument("--port", help="also compare the file with the inserted cartridge bank by bank")
+    command.set_defaults(function=verify)
+
+    command = commands.add_parser("backup", help="back up the cartridge RAM (saves)")
+    command.add_argument("port", help="serial port of the reader")
+    command.add_argument("--store", help="backup directory, default: ~/.gbreader/saves")
+    command.add_argument("--progress", action="store_true", help="report the progress as JSON lines on stderr")
+    command.set_defaults(function=backup)
+
+    command = commands.add_parser("restore", help="write a backup to the cartridge RAM")
+    command.add_argument("port", help="serial port of the reader")
+    command.add_argument("file", nargs="?", help="save file, default: the latest backup in the store")
+    command.add_argument("--store", help="backup directory, default: ~/.gbreader/saves")
+    command.add_argument("--progress", action="store_true", help="report the progress as JSON lines on stderr")
+    command.set_defaults(function=restore)
+
+    command = commands.add_parser("import-dat", help="import DAT files into a database of known dumps")
+    command.add_argument("database", help="database file")
+    command.add_argument("files", nargs="+", help="DAT files (Logiqx XML or ClrMamePro)")
+    command.set_defaults(function=importDAT)
+
+    command = commands.add_parser("batch", help="dump the cartridges of several readers at the same time")
+    command.add_argument("ports", nargs="+", help="serial ports of the readers")
+    command.add_argument("--output", default=".", help="directory for the ROM files")
+    command.add_argument("--framed", action="store_true", help="use CRC checked framed transfers")
+    command.add_argument("--compressed", action="store_true", help="use run-length compressed transfers")
+    command.set_defaults(function=batch)
+
+    return parser
+
+
+def main(argv=None):
+    args = parser().parse_args(argv)
+    args.hooks = []
+    if args.metrics_jsonl or args.metrics_prom:
+        from ReaderMetrics import JSONLinesHook, MetricsCollector
+
+        if args.metrics_jsonl:
+            args.hooks.append(JSONLinesHook(args.metrics_jsonl))
+        if args.metrics_prom:
+            args.hooks.append(MetricsCollector())
+
+    try:
+        return args.function(args)
+    except (NoGBReaderException, UnknownGBDataException, GBCartridgeChangedException, GBTransferException,
+            OSError) as e:
+        output(errorInfo(e))
+        return 1
+    finally:
+        for hook in args.hooks:
+            if isinstance(hook, JSONLinesHook):
+                hook.close()
+            else:
+                hook.writePrometheus(args.metrics_prom)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
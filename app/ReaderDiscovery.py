@@ -0,0 +1,121 @@
+# Copyright (c) 2017 Fabian Friedl
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import serial, time
+import serial.tools.list_ports as list_ports
+from concurrent.futures import ThreadPoolExecutor
+
+from GBReader import GBReader, NoGBReaderException, GBTransferException
+
+
+class DiscoveredReader:
+
+    def __init__(self, device, description, protocolVersion, connectLatency):
+        self.device = device
+        self.description = description
+        self.protocolVersion = protocolVersion
+        self.connectLatency = connectLatency
+
+
+class ReaderDiscovery:
+
+    def __init__(self, timeout=1.0, maxWorkers=16, retryInterval=10.0):
+        """
+        Finds GB readers by probing all serial ports in parallel.
+        Results are cached by USB VID:PID and serial number (by device name for other ports), so later
+        discoveries only probe ports which were not seen before.
+        :param timeout: Handshake timeout per port in seconds
+        :param maxWorkers: Maximum number of ports probed at the same time
+        :param retryInterval: Seconds after which ports without a reader are probed again, a reader may have been
+                              booting or busy
+        """
+        self.timeout = timeout
+        self.maxWorkers = maxWorkers
+        self.retryInterval = retryInterval
+        self._cache = {}  # port key -> DiscoveredReader
+        self._missed = {}  # port key -> time of the last probe no reader answered
+
+    def discover(self, ports=None, refresh=False, openReaders=()):
+        """
+        :param ports: Ports as list_ports.comports() entries or device names, default: all serial ports
+        :param refresh: Probe all ports again instead of using cached results
+        :param openReaders: GBReaders opened by the caller, their ports are listed without being probed
+        :return: List of DiscoveredReader sorted by device name
+        """
+        if ports is None:
+            ports = list_ports.comports()
+        openReaders = {reader.port: reader for reader in openReaders}
+
+        readers = []
+        probe = []
+        now = time.perf_counter()
+        for port in ports:
+            key = self._key(port)
+            if self._device(port) in openReaders:
+                reader = openReaders[self._device(port)]
+                self._cache[key] = DiscoveredReader(reader.port, getattr(port, 'description', reader.port),
+                                                    reader.protocolVersion, reader.connectLatency)
+                self._missed.pop(key, None)
+                readers.append(self._cache[key])
+            elif not refresh and key in self._cache:
+                self._cache[key].device = self._device(port)  # device name may change after replugging
+                readers.append(self._cache[key])
+            elif refresh or now - self._missed.get(key, now - self.retryInterval) >= self.retryInterval:
+                probe.append(port)
+
+        if probe:
+            with ThreadPoolExecutor(max_workers=min(self.maxWorkers, len(probe))) as executor:
+                for port, reader in zip(probe, executor.map(self._probe, probe)):
+                    key = self._key(port)
+                    if reader is not None:
+                        self._cache[key] = reader
+                        self._missed.pop(key, None)
+                        readers.append(reader)
+                    else:
+                        self._cache.pop(key, None)
+                        self._missed[key] = time.perf_counter()
+
+        return sorted(readers, key=lambda reader: reader.device)
+
+    def forget(self, port):
+        self._cache.pop(self._key(port), None)
+        self._missed.pop(self._key(port), None)
+
+    def _probe(self, port):
+        try:
+            reader = GBReader(self._device(port), connectTimeout=self.timeout, baudrates=())
+        except (NoGBReaderException, GBTransferException, serial.serialutil.SerialException, OSError):
+            return None  # no reader or one that broke off during the handshake
+
+        try:
+            return DiscoveredReader(reader.port, getattr(port, 'description', reader.port), reader.protocolVersion,
+                                    reader.connectLatency)
+        finally:
+            reader.close()
+
+    @staticmethod
+    def _device(port):
+        return getattr(port, 'device', port)
+
+    @staticmethod
+    def _key(port):
+        if getattr(port, 'vid', None) is not None and getattr(port, 'serial_number', None):
+            return "%04X:%04X:%s" % (port.vid, port.pid, port.serial_number)
+        return ReaderDiscovery._device(port)
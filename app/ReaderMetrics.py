@@ -0,0 +1,168 @@
+# Copyright (c) 2017 Fabian Friedl
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Hooks for the instrumentation of GBReader (GBReader(port, hooks=[...]) or GBReader.addHook). A hook is called
+# with one dict per event, see GBReader._emit:
+#
+#   command   command, bytes                          a command was sent
+#   response  command, operation, bytes, seconds,     a response was received completely, latency (seconds from
+#             latency                                 sending the command) only for its first response
+#   timeout   command, operation, received, expected  a response did not arrive in time, received > 0: short read
+#   retry     operation, block                        a damaged bank or RAM block is transferred again
+#   checksum  kind, valid                             a frame, bank, RAM block, header or ROM was checked
+#   dump      bytes, received, seconds, throughput,   a dump finished
+#             mode, retries, cacheHit
+#
+# Every event also has "event", "time" (Unix time) and "port".
+
+import json, os
+from threading import Lock
+
+
+class JSONLinesHook:
+
+    def __init__(self, file):
+        """
+        Write every event as one JSON line.
+        :param file: File name (appended to) or text file object
+        """
+        self._file = open(file, 'a') if isinstance(file, str) else file
+        self._close = isinstance(file, str)
+        self._lock = Lock()  # the readers of a DumpFarm share the hook
+
+    def __call__(self, event):
+        line = json.dumps(event) + '\n'
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+
+    def close(self):
+        if self._close:
+            self._file.close()
+
+
+class MetricsCollector:
+    PREFIX = "gbreader_"
+    METRICS = {  # name -> (Prometheus type, help)
+        "commands_total": ("counter", "Commands sent to the reader"),
+        "bytes_sent_total": ("counter", "Bytes sent to the reader"),
+        "bytes_received_total": ("counter", "Bytes received from the reader"),
+        "command_latency_seconds": ("summary", "Seconds from sending a command to the end of its first response"),
+        "command_latency_max_seconds": ("gauge", "Longest latency of a command"),
+        "timeouts_total": ("counter", "Responses which did not arrive in time"),
+        "short_reads_total": ("counter", "Timed out responses of which some bytes arrived"),
+        "retries_total": ("counter", "Retransmitted banks and RAM blocks"),
+        "checksums_total": ("counter", "Checked frames, banks, RAM blocks, headers and ROMs by result"),
+        "dumps_total": ("counter", "Finished dumps by transfer mode"),
+        "dump_bytes_total": ("counter", "ROM bytes of the finished dumps"),
+        "dump_seconds_total": ("counter", "Seconds of the finished dumps"),
+        "dump_throughput_bytes_per_second": ("gauge", "ROM bytes per second of the last dump"),
+    }
+    COMMANDS = {command: "0x%02X" % command for command in range(256)}  # label values of the command codes
+
+    def __init__(self):
+        """
+        Hook aggregating the events into counters, exported in the Prometheus text format.
+        """
+        self._lock = Lock()
+        self._values = {}  # (name, ((label, value), ...)) -> value
+
+    def __call__(self, event):
+        port = ("port", event.get("port"))  # labels are tuples of (name, value) pairs sorted by name
+        kind = event["event"]
+        values = self._values
+        with self._lock:
+            if kind == "command":
+                self._add("commands_total", 1, (("command", self.COMMANDS.get(event["command"], "none")), port))
+                self._add("bytes_sent_total", event["bytes"], (port,))
+            elif kind == "response":
+                key = (("command", self.COMMANDS.get(event["command"], "none")), port)
+                self._add("bytes_received_total", event["bytes"], key)
+                latency = event["latency"]
+                if latency is not None:
+                    self._add("command_latency_seconds_sum", latency, key)
+                    self._add("command_latency_seconds_count", 1, key)
+                    if latency > values.get(("command_latency_max_seconds", key), 0):
+                        values[("command_latency_max_seconds", key)] = latency
+            elif kind == "timeout":
+                key = (("operation", event["operation"]), port)
+                self._add("timeouts_total", 1, key)
+                if event["received"] > 0:
+                    self._add("short_reads_total", 1, key)
+                self._add("bytes_received_total", event["received"],
+                          (("command", self.COMMANDS.get(event["command"], "none")), port))
+            elif kind == "retry":
+                self._add("retries_total", 1, (("operation", event["operation"]), port))
+            elif kind == "checksum":
+                self._add("checksums_total", 1, (("kind", event["kind"]), port,
+                                                 ("result", "valid" if event["valid"] else "invalid")))
+            elif kind == "dump":
+                self._add("dumps_total", 1, (("mode", event["mode"]), port))
+                self._add("dump_bytes_total", event["bytes"], (port,))
+                self._add("dump_seconds_total", event["seconds"], (port,))
+                if event["throughput"] is not None:
+                    values[("dump_throughput_bytes_per_second", (port,))] = event["throughput"]
+
+    def value(self, name, **labels):
+        """
+        :return: Current value of a metric (without prefix) with exactly these labels or 0
+        """
+        with self._lock:
+            return self._values.get((name, self._labels(**labels)), 0)
+
+    def reset(self):
+        with self._lock:
+            self._values = {}
+
+    def prometheus(self):
+        """
+        :return: All metrics in the Prometheus text exposition format
+        """
+        with self._lock:
+            values = sorted(self._values.items())
+
+        lines = []
+        for metric, (metricType, description) in self.METRICS.items():
+            samples = [(name, labels, value) for (name, labels), value in values
+                       if name == metric or (metricType == "summary" and name in (metric + "_sum", metric + "_count"))]
+            if not samples:
+                continue
+            lines.append("# HELP %s%s %s" % (self.PREFIX, metric, description))
+            lines.append("# TYPE %s%s %s" % (self.PREFIX, metric, metricType))
+            for name, labels, value in samples:
+                label = ",".join('%s="%s"' % (key, str(text).replace('\\', '\\\\').replace('"', '\\"'))
+                                 for key, text in labels)
+                lines.append("%s%s%s %s" % (self.PREFIX, name, "{" + label + "}" if label else "", repr(float(value))))
+        return "\n".join(lines) + "\n"
+
+    def writePrometheus(self, filename):
+        """
+        Write the metrics atomically, e.g. for the textfile collector of the Prometheus node exporter.
+        """
+        with open(filename + '.tmp', 'w') as file:
+            file.write(self.prometheus())
+        os.replace(filename + '.tmp', filename)
+
+    @staticmethod
+    def _labels(**labels):
+        return tuple(sorted(labels.items()))
+
+    def _add(self, name, amount, labels):
+        self._values[(name, labels)] = self._values.get((name, labels), 0) + amount
@@ -18,76 +18,133 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
-from tkinter.filedialog import asksaveasfile
 from tkinter.messagebox import showerror, showinfo
+from tkinter.filedialog import asksaveasfilename
 
 import subprocess
 import sys
 import os
-import serial.tools.list_ports as list_ports
+import tempfile
+import traceback
 
 from GUI import GUI
 from GBReader import *
+from ReaderDiscovery import ReaderDiscovery
+from ROMCache import ROMCache
+from DumpDatabase import DumpDatabase
 from NintendoLogo import NintendoLogo
+from ReaderMetrics import MetricsCollector
 from threading import Thread
+from concurrent.futures import ThreadPoolExecutor
 
 
 class ReaderProgram:
+    METRICS_FILE = os.path.join(os.path.expanduser("~"), ".gbreader", "metrics.prom")
 
     def __init__(self):
         self.gui = GUI(self.readHeader, self.readGame, self.startGame, self.refreshCOMList, self.changeCOMDevice, self.saveFile)
 
         self._reader = None
         self._cartridge = None
+        self._temporaryFile = None  # ROM file of the last dump until it is saved
+        self._discovery = ReaderDiscovery()
+        self._cache = ROMCache()  # known cartridges are not dumped again
+        self._database = DumpDatabase()  # known good dumps
+        self._linkSettings = LinkSettings()  # negotiated baud rate per port
+        self._metrics = MetricsCollector()  # written to METRICS_FILE after every dump
+        self._io = ThreadPoolExecutor(max_workers=1)  # all serial I/O, one operation at a time off the Tk thread
 
     def run(self):
         self._reader = None
         #self.initReader("COM1")
         self.gui.mainloop()
+        self._io.shutdown(cancel_futures=True)
+        self._removeTemporaryFile()
+
+    def _submit(self, function, *args):
+        """
+        Run function on the serial I/O thread. GUI updates from there have to be posted to the Tk thread.
+        """
+        self._io.submit(function, *args).add_done_callback(self._reportError)
+
+    @staticmethod
+    def _reportError(future):
+        if not future.cancelled() and future.exception() is not None:
+            traceback.print_exception(type(future.exception()), future.exception(), future.exception().__traceback__)
+
+    def _removeTemporaryFile(self):
+        if self._temporaryFile is not None and os.path.exists(self._temporaryFile):
+            os.remove(self._temporaryFile)
+        self._temporaryFile = None
 
     def initReader(self, com):
-        self.gui.setError("")
-        self.gui.setInfoButtonEnabled(False)
-        self.gui.setReadButtonEnabled(False)
-        self.gui.setStartButtonEnabled(False)
+        self._submit(self._initReader, com)
+
+    def _initReader(self, com):
+        self.gui.post(self.gui.setError, "")
+        self.gui.post(self.gui.setInfoButtonEnabled, False)
+        self.gui.post(self.gui.setReadButtonEnabled, False)
+        self.gui.post(self.gui.setStartButtonEnabled, False)
         try:
             if self._reader is not None:
                 self._reader.close()
-            self._reader = GBReader(com)
+                self._reader = None
+            self._reader = GBReader(com, cache=self._cache, database=self._database,
+                                    linkSettings=self._linkSettings, compressed=True, hooks=[self._metrics])
+            print("Connected to " + com + " in " + str(round(self._reader.connectLatency * 1000)) + " ms")
 
-            self.gui.setInfoButtonEnabled(True)
+            self.gui.post(self.gui.setInfoButtonEnabled, True)
         except NoGBReaderException as e:
-            self.gui.setError("No GBC Reader connected at " + com + "!")
+            self.gui.post(self.gui.setError, "No GBC Reader connected at " + com + "!")
             sys.stdout.write("\033[31mNo GBC Reader connected at" + com + "!\n")
             sys.stdout.write("\033[31mFurther information:\n")
             print(e)
 
     def readHeader(self):
         self.gui.setError("")
-        self.gui.setInfoButtonEnabled(True)
+        self.gui.setInfoButtonEnabled(False)
         self.gui.setReadButtonEnabled(False)
         self.gui.setStartButtonEnabled(False)
 
+        self._submit(self._readHeader)
+
+    def _readHeader(self):
         try:
             self._cartridge = self._reader.readCartridgeHeader()
-            self.gui.setTitle(self._cartridge.gameTitle)
-            self.gui.setFlag(self._cartridge.cgbFlag)
-            self.gui.setSize(str(self._cartridge.romSizeKB) + " KB")
-            self.gui.setType(self._cartridge.cartridgeType)
-            self.gui.setBanks(self._cartridge.romBankCount)
-
             logo = NintendoLogo(self._cartridge.nintendoLogo)  # create nintendo logo from data
-            self.gui.setImage(logo.getImage())
+            self.gui.post(self.gui.setImage, logo.getImage())
+            if not self._cartridge.headerValid():
+                # checked before calibrating, a bad contact must not be remembered as bus delay
+                self.gui.post(self.gui.setError, "The header reads back damaged! Clean the contacts and reinsert "
+                                                 "the cartridge!")
+                sys.stdout.write("\033[31mBad cartridge contact! Nintendo logo or header checksum invalid!\n")
+                return
+
+            if self._linkSettings.busDelay(self._reader.port, self._cartridge.cartridgeType) is None:
+                # first cartridge of this type at this reader, the delay is remembered
+                print("Bus delay " + str(self._reader.calibrateBusDelay(self._cartridge)) + " us")
+            self.gui.post(self.gui.setTitle, self._cartridge.gameTitle)
+            self.gui.post(self.gui.setFlag, self._cartridge.cgbFlag)
+            self.gui.post(self.gui.setSize, str(self._cartridge.romSizeKB) + " KB")
+            self.gui.post(self.gui.setType, self._cartridge.cartridgeType)
+            self.gui.post(self.gui.setBanks, self._cartridge.romBankCount)
 
-            self.gui.setReadButtonEnabled(True)
+            self.gui.post(self.gui.setReadButtonEnabled, True)
         except serial.serialutil.SerialException:
-            self.gui.setError("No GBC Reader connected!")
+            self.gui.post(self.gui.setError, "No GBC Reader connected!")
             sys.stdout.write("\033[31mNo GBC Reader connected!\n")
         except UnknownGBDataException as e:
-            self.gui.setError("Undefined data read from the cartridge! Are you sure a cartridge is connected?")
+            self.gui.post(self.gui.setError,
+                          "Undefined data read from the cartridge! Are you sure a cartridge is connected?")
             sys.stdout.write("\033[31mError loading CartridgeHeader! Unknown Data!\n")
             sys.stdout.write("\033[31mFurther information:\n")
             print(e)
+        except GBTimeoutException as e:
+            self.gui.post(self.gui.setError, "The GBC Reader stopped responding!")
+            sys.stdout.write("\033[31mError loading CartridgeHeader! Timeout after " + str(e.received) + " of " +
+                             str(e.expected) + " bytes!\n")
+        finally:
+            self.gui.post(self.gui.setInfoButtonEnabled, True)
 
 
 
@@ -97,25 +154,63 @@ class ReaderProgram:
         self.gui.setReadButtonEnabled(False)
         self.gui.setStartButtonEnabled(False)
 
-        thread = Thread(target=self._readGame)
-        thread.start()
+        self._submit(self._readGame)
 
     def _readGame(self):
+        self._removeTemporaryFile()
+        file, self._temporaryFile = tempfile.mkstemp(suffix='.gb')
+        os.close(file)
+
+        readEnabled = startEnabled = False  # the header has to be read again after most errors
         try:
-            self._reader.readGameData(self._cartridge, self.gui.setProgress)
-            self.gui.setInfoButtonEnabled(True)
-            self.gui.setReadButtonEnabled(True)
-            self.gui.setStartButtonEnabled(True)
+            self.gui.startTransfer()
+            self._reader.readGameData(self._cartridge, self.gui.postProgress, self._temporaryFile)
+            readEnabled = startEnabled = True
 
+            if self._reader.cacheHit:
+                print('ROM loaded from the cache')
+            elif self._reader.compressionRatio() is not None:
+                print('Compression ratio ' + str(round(self._reader.compressionRatio(), 2)))
+            if self._cartridge.dumpStatus is not None:
+                print('Dump ' + self._cartridge.dumpStatus.name.lower() + (
+                    ' (' + self._cartridge.knownDump["name"] + ')' if self._cartridge.knownDump is not None else ''))
             if self._reader.checkGlobalChecksum(self._cartridge):
                 print('Checksum correct!')
             else:
-                self.gui.setError("Checksum incorrect! A real Game Boy would not care.")
+                self.gui.post(self.gui.setError, "Checksum incorrect! A real Game Boy would not care.")
                 print('Checksum incorrect!')
+            self._writeMetrics()
         except GBCartridgeChangedException as e:
-            self.gui.setError("Error loading Cartridge! Cartridge has changed since reading header information! Please try again!")
+            self.gui.post(self.gui.setError, "Error loading Cartridge! Cartridge has changed since reading header information! Please try again!")
             sys.stdout.write("\033[31mError loading Cartridge! Cartridge has changed since reading header information!\n")
             sys.stdout.write("\033[31mPlease try again!\n")
+        except GBTransferException as e:
+            self.gui.post(self.gui.setError, "Error loading Cartridge! The transfer failed, please try again!")
+            readEnabled = True
+            sys.stdout.write("\033[31mError loading Cartridge! Transfer failed!\n")
+            sys.stdout.write("\033[31mFurther information:\n")
+            print(e)
+            self._writeMetrics()
+        except serial.serialutil.SerialException:
+            self.gui.post(self.gui.setError, "No GBC Reader connected!")
+            sys.stdout.write("\033[31mNo GBC Reader connected!\n")
+        except UnknownGBDataException as e:
+            self.gui.post(self.gui.setError,
+                          "Undefined data read from the cartridge! Are you sure a cartridge is connected?")
+            sys.stdout.write("\033[31mError loading Cartridge! Unknown Data!\n")
+            sys.stdout.write("\033[31mFurther information:\n")
+            print(e)
+        finally:
+            self.gui.post(self.gui.setInfoButtonEnabled, True)
+            self.gui.post(self.gui.setReadButtonEnabled, readEnabled)
+            self.gui.post(self.gui.setStartButtonEnabled, startEnabled)
+
+    def _writeMetrics(self):
+        try:
+            os.makedirs(os.path.dirname(self.METRICS_FILE), exist_ok=True)
+            self._metrics.writePrometheus(self.METRICS_FILE)
+        except OSError as e:
+            print("Could not write the metrics: " + str(e))
 
     def startGame(self):
         self.gui.setError("")
@@ -128,32 +223,40 @@ class ReaderProgram:
 
 
     def _startGame(self):
-        filename = "temp.gb"
-        file = open(filename, 'wb')
-        self._reader.saveROMFile(self._cartridge, file)
-        file.close()
-
-        p = subprocess.Popen("./emulator/bgb.exe run " + filename)
+        p = subprocess.Popen(["./emulator/bgb.exe", "run", self._cartridge.romFile])  # the streamed ROM file is reused
         p.wait()
 
-        os.remove(filename)
-
-        self.gui.setInfoButtonEnabled(True)
-        self.gui.setReadButtonEnabled(True)
-        self.gui.setStartButtonEnabled(True)
+        self.gui.post(self.gui.setInfoButtonEnabled, True)
+        self.gui.post(self.gui.setReadButtonEnabled, True)
+        self.gui.post(self.gui.setStartButtonEnabled, True)
 
     def saveFile(self):
-        if self._cartridge is None or self._cartridge.gameData is None:
+        if self._cartridge is None or self._cartridge.romFile is None:
             showerror("GameBoy Reader - Error", "You have to read a cartridge first!")
             return
 
-        file = asksaveasfile(mode='wb', initialfile=self._cartridge.gameTitle + '.gbc', filetypes=[('gbc roms', '.gbc')])
-        self._reader.saveROMFile(self._cartridge, file)
+        filename = asksaveasfilename(initialfile=self._cartridge.gameTitle + '.gbc', filetypes=[('gbc roms', '.gbc')])
+        if not filename:
+            return
+
+        if self._cartridge.romFile == self._temporaryFile:
+            self._reader.moveROMFile(self._cartridge, filename)  # rename instead of a second copy
+            self._temporaryFile = None
+        else:
+            with open(filename, 'wb') as file:  # already saved once, keep that copy
+                self._reader.saveROMFile(self._cartridge, file)
         showinfo("GameBoy Reader - Done", "Game Boy ROM saved!")
 
     def refreshCOMList(self):
-        ports = list(list_ports.comports())
-        self.gui.setCOMList(ports)
+        self._submit(self._refreshCOMList)
+
+    def _refreshCOMList(self):
+        # only ports with a GB reader are listed, known ports are cached and the open reader is not probed
+        readers = self._discovery.discover(openReaders=[] if self._reader is None else [self._reader])
+        self.gui.post(self.gui.setCOMList, readers)
+
+        if len(readers) == 1 and self._reader is None:
+            self._initReader(readers[0].device)
 
     def changeCOMDevice(self, comDevice):
         self.initReader(comDevice)
\ No newline at end of file
@@ -0,0 +1,86 @@
+# Copyright (c) 2017 Fabian Friedl
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os, time
+from threading import Lock
+
+from ROMCache import ROMCache
+
+
+class SaveStore:
+    DEFAULT_DIRECTORY = os.path.join(os.path.expanduser("~"), ".gbreader", "saves")
+
+    def __init__(self, directory=DEFAULT_DIRECTORY, maxVersions=10):
+        """
+        Backups of the cartridge RAM (battery-backed saves) in one directory per cartridge, keyed by the header
+        fingerprint like ROMCache. A backup which differs from the latest one is kept as a new version, the oldest
+        versions beyond maxVersions are removed.
+        :param directory: Directory of the backups
+        :param maxVersions: Versions kept per cartridge
+        """
+        self.directory = directory
+        self.maxVersions = maxVersions
+
+        self._lock = Lock()
+
+    def versions(self, cartridge):
+        """
+        :return: Backup files of the cartridge, the oldest first
+        """
+        directory = self._directory(cartridge)
+        if not os.path.isdir(directory):
+            return []
+        return [os.path.join(directory, name) for name in sorted(os.listdir(directory)) if name.endswith('.sav')]
+
+    def latest(self, cartridge):
+        """
+        :return: Data of the latest backup of the cartridge or None
+        """
+        versions = self.versions(cartridge)
+        if not versions:
+            return None
+        with open(versions[-1], 'rb') as file:
+            return file.read()
+
+    def store(self, cartridge, data):
+        """
+        Add a backup of the cartridge RAM unless it equals the latest one.
+        :return: File of the backup
+        """
+        with self._lock:
+            versions = self.versions(cartridge)
+            if versions and self.latest(cartridge) == bytes(data):
+                return versions[-1]
+
+            directory = self._directory(cartridge)
+            os.makedirs(directory, exist_ok=True)
+            now = time.time()
+            filename = os.path.join(directory, time.strftime("%Y%m%d-%H%M%S", time.localtime(now)) +
+                                    ".%06d.sav" % (now % 1 * 1000000))
+            with open(filename + '.tmp', 'wb') as file:
+                file.write(data)
+            os.replace(filename + '.tmp', filename)
+
+            for old in self.versions(cartridge)[:-self.maxVersions]:
+                os.remove(old)
+            return filename
+
+    def _directory(self, cartridge):
+        return os.path.join(self.directory, ROMCache.key(cartridge))
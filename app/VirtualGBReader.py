@@ -0,0 +1,639 @@
+# Copyright (c) 2017 Fabian Friedl
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Software stand-in for the ATMEGA reader (atmega/UART-GBC-Data/main.c).
+# The device is served on a Linux pseudo-terminal, so GBReader(virtualReader.port)
+# talks to it exactly like to the real hardware.
+
+import os, re, select, time, tty, random, binascii
+from threading import Thread, Event
+
+
+NINTENDO_LOGO = bytes([0xCE, 0xED, 0x66, 0x66, 0xCC, 0x0D, 0x00, 0x0B, 0x03, 0x73, 0x00, 0x83,
+                       0x00, 0x0C, 0x00, 0x0D, 0x00, 0x08, 0x11, 0x1F, 0x88, 0x89, 0x00, 0x0E,
+                       0xDC, 0xCC, 0x6E, 0xE6, 0xDD, 0xDD, 0xD9, 0x99, 0xBB, 0xBB, 0x67, 0x63,
+                       0x6E, 0x0E, 0xEC, 0xCC, 0xDD, 0xDC, 0x99, 0x9F, 0xBB, 0xB9, 0x33, 0x3E])
+
+
+def buildROM(romSize, title="VIRTUAL", cartridgeType=0x19, cgbFlag=0x00, seed=0, ramSize=0x00):
+    """
+    Build a synthetic ROM image with a valid header, header checksum and global checksum.
+    :param romSize: ROM size code as stored at 0x0148 (0x00: 32 KiB ... 0x08: 8 MiB)
+    :param title: Game title (at most 11 characters if cgbFlag is set)
+    :param cartridgeType: Cartridge type code as stored at 0x0147
+    :param cgbFlag: CGB flag as stored at 0x0143
+    :param seed: Seed for the random bank contents
+    :param ramSize: RAM size code as stored at 0x0149 (0x00: no RAM, 0x02: 8 KiB, 0x03: 32 KiB ...)
+    :return: ROM image as bytes
+    """
+    rom = bytearray(random.Random(seed).getrandbits(8 * 0x8000 << romSize).to_bytes(0x8000 << romSize, 'little'))
+
+    rom[0x0104:0x0134] = NINTENDO_LOGO
+    rom[0x0134:0x0144] = title.encode("ascii")[:16].ljust(16, b'\x00')
+    if cgbFlag:
+        rom[0x0143] = cgbFlag
+    rom[0x0147] = cartridgeType
+    rom[0x0148] = romSize
+    rom[0x0149] = ramSize
+
+    headerChecksum = 0
+    for address in range(0x0134, 0x014C + 1):
+        headerChecksum = (headerChecksum - rom[address] - 1) & 0xFF
+    rom[0x014D] = headerChecksum
+
+    globalChecksum = (sum(rom) - rom[0x014E] - rom[0x014F]) & 0xFFFF
+    rom[0x014E] = globalChecksum >> 8
+    rom[0x014F] = globalChecksum & 0xFF
+
+    return bytes(rom)
+
+
+class VirtualCartridge:
+
+    RAM_SIZES = {0x01: 0x800, 0x02: 0x2000, 0x03: 0x8000, 0x04: 0x20000, 0x05: 0x10000}  # by code at 0x0149
+
+    def __init__(self, rom, accessTime=0, mapper=None, ram=None):
+        """
+        Cartridge with the memory bank controller of its cartridge type (0x0147): ROM ONLY, MBC1, MBC2, MBC3 or
+        MBC5. Other types are treated as MBC5, writes to 0x2000-0x2FFF select the low 8 bits and writes to
+        0x3000-0x3FFF the 9th bit of the bank mapped to 0x4000-0x7FFF.
+        :param rom: ROM image as bytes
+        :param accessTime: us the data bus needs to settle after an address was set
+        :param mapper: "ROM", "MBC1", "MBC2", "MBC3" or "MBC5", default: derived from the cartridge type
+        :param ram: Content of the cartridge RAM, default: zeros of the size declared at 0x0149 (MBC2: 512 x 4 bit)
+        """
+        self.rom = bytes(rom)
+        self.accessTime = accessTime
+        self.mapper = mapper if mapper is not None else self._mapper(self.rom[0x0147])
+
+        self.bank = 1  # bank mapped to 0x4000-0x7FFF
+        self.lowBank = 0  # bank mapped to 0x0000-0x3FFF (MBC1 mode 1)
+        self._mbc1 = [1, 0, 0]  # MBC1 bank register, upper bits, mode
+
+        size = 512 if self.mapper == "MBC2" else self.RAM_SIZES.get(self.rom[0x0149], 0)
+        self.ram = bytearray(ram) if ram is not None else bytearray(size)
+        self.ramEnabled = self.mapper == "ROM"  # RAM without controller is always enabled
+        self.ramBank = 0  # RAM bank mapped to 0xA000-0xBFFF
+        self.ramWrites = 0  # bytes written to the RAM
+
+    @staticmethod
+    def _mapper(cartridgeType):
+        if cartridgeType in (0x00, 0x08, 0x09):
+            return "ROM"
+        if cartridgeType in (0x01, 0x02, 0x03):
+            return "MBC1"
+        if cartridgeType in (0x05, 0x06):
+            return "MBC2"
+        if 0x0F <= cartridgeType <= 0x13:
+            return "MBC3"
+        return "MBC5"
+
+    def readByte(self, address):
+        if address < 0x4000:
+            return self.rom[(self.lowBank * 0x4000 + address) % len(self.rom)]
+        elif address < 0x8000:
+            return self.rom[(self.bank * 0x4000 + address - 0x4000) % len(self.rom)]
+
+        offset = self._ramOffset(address)
+        if offset is None:
+            return 0xFF  # nothing mapped (no or disabled cartridge RAM)
+        if self.mapper == "MBC2":
+            return 0xF0 | self.ram[offset]  # only the low 4 bits are stored
+        return self.ram[offset]
+
+    def writeByte(self, address, data):
+        if address >= 0x8000:
+            offset = self._ramOffset(address)
+            if offset is not None:
+                self.ram[offset] = data & 0x0F if self.mapper == "MBC2" else data
+                self.ramWrites += 1
+            return
+        if self.mapper == "ROM":
+            return
+
+        if self.mapper != "MBC2" and address < 0x2000:
+            self.ramEnabled = data & 0x0F == 0x0A
+            return
+        if self.mapper in ("MBC3", "MBC5") and 0x4000 <= address < 0x6000:
+            self.ramBank = data & 0x0F
+
+        if self.mapper == "MBC1":
+            if address < 0x4000:
+                self._mbc1[0] = data & 0x1F or 1  # bank 0 can not be mapped to 0x4000-0x7FFF
+            elif address < 0x6000:
+                self._mbc1[1] = data & 0x03
+            else:
+                self._mbc1[2] = data & 0x01
+            self.bank = (self._mbc1[1] << 5) | self._mbc1[0]
+            self.lowBank = self._mbc1[1] << 5 if self._mbc1[2] else 0
+            self.ramBank = self._mbc1[1] if self._mbc1[2] else 0
+        elif self.mapper == "MBC2":
+            if address < 0x4000 and address & 0x0100:
+                self.bank = data & 0x0F or 1
+            elif address < 0x4000:
+                self.ramEnabled = data & 0x0F == 0x0A
+        elif self.mapper == "MBC3":
+            if 0x2000 <= address <= 0x3FFF:
+                self.bank = data & 0x7F or 1
+        elif 0x2000 <= address <= 0x2FFF:
+            self.bank = (self.bank & 0x100) | data
+        elif 0x3000 <= address <= 0x3FFF:
+            self.bank = ((data & 0x01) << 8) | (self.bank & 0xFF)  # 9th bank bit (MBC5)
+
+    def _ramOffset(self, address):
+        """
+        :return: Offset in self.ram of a RAM address (0xA000-0xBFFF) or None if it is not mapped
+        """
+        if not 0xA000 <= address < 0xC000 or not self.ramEnabled or not self.ram:
+            return None
+        if self.mapper == "MBC2":
+            return address & 0x01FF  # 512 bytes, mirrored
+        return (self.ramBank * 0x2000 + address - 0xA000) % len(self.ram)
+
+    def readBank(self, bank):
+        """
+        Switch to the given bank and read 0x4000-0x7FFF like the firmware does (GBC_switchBank).
+        :param bank: Bank number as int
+        :return: Bank data as bytes
+        """
+        self.writeByte(0x2000, bank & 0xFF)
+        if bank > 0xFF:
+            self.writeByte(0x3000, bank >> 8)
+        return self.readMapped(0x4000)
+
+    def readMapped(self, address):
+        """
+        :param address: 0x0000 or 0x4000
+        :return: Bank currently mapped to address-address + 0x3FFF as bytes
+        """
+        start = ((self.lowBank if address < 0x4000 else self.bank) * 0x4000) % len(self.rom)
+        return self.rom[start:start + 0x4000]
+
+
+class VirtualGBReader:
+
+    FRAME_BITS = 11  # start bit, 8 data bits and 2 stop bits per byte (see UART_init)
+    PROTOCOL_VERSION = 10  # PROTOCOL_VERSION of the firmware
+    DEFAULT_BAUDRATE = 76800  # BAUD 38400 doubled by U2X0
+    READER_CLOCK = 16000000  # F_CPU
+    BAUD_CONFIRM_TIMEOUT = 0.5  # BAUD_CONFIRM_TIMEOUT of the firmware in seconds
+    DEFAULT_BUS_DELAY = 50  # DEFAULT_BUS_DELAY of the firmware in us
+    BUS_OVERHEAD = 3e-6  # seconds the firmware needs per cartridge byte besides the bus delay
+    RLE_ESCAPE = 0xD3  # RLE_ESCAPE of the firmware
+    RLE_MIN_RUN = 5  # RLE_MIN_RUN of the firmware
+    RAM_BLOCK_SIZE = 256  # RAM_BLOCK_SIZE of the firmware
+
+    def __init__(self, rom, protocolVersion=PROTOCOL_VERSION, latency=0.0, baudrate=None, faultCommand=0x07,
+                 dropRate=0.0, dropOffsets=(), corruptOffsets=(), stallOffset=None, stallTime=0.0, swapOffset=None,
+                 swapROM=None, seed=None, bootTime=0.0, maxBaudrate=None):
+        """
+        Virtual GB reader serving a ROM image on a pseudo-terminal.
+        Fault offsets are counted in bytes from the start of the response to faultCommand. Every offset based fault
+        is injected only once.
+        :param rom: ROM image as bytes or VirtualCartridge
+        :param protocolVersion: Emulated firmware protocol version (1: firmware without version command)
+        :param latency: Additional delay per sent byte in seconds
+        :param baudrate: Emulated baud rate or None for an unthrottled link. With a baud rate, every byte read from
+                         the cartridge also takes the bus delay (command 0x11).
+        :param faultCommand: Command the fault injection applies to (default: 0x07, read game data)
+        :param dropRate: Probability of dropping each response byte
+        :param dropOffsets: Offsets of response bytes which are dropped
+        :param corruptOffsets: Offsets of response bytes which are inverted
+        :param stallOffset: Offset at which the response stalls for stallTime seconds
+        :param stallTime: Stall duration in seconds
+        :param swapOffset: Offset at which the cartridge is replaced by swapROM
+        :param swapROM: ROM image inserted at swapOffset
+        :param seed: Seed for the random fault injection
+        :param bootTime: Seconds after start during which received bytes are lost (reset and bootloader)
+        :param maxBaudrate: Fastest baud rate the emulated link transfers without errors or None for any rate
+        """
+        self.cartridge = rom if isinstance(rom, VirtualCartridge) else VirtualCartridge(rom)
+        self.protocolVersion = protocolVersion
+        self.latency = latency
+        self.baudrate = baudrate
+
+        self.faultCommand = faultCommand
+        self.dropRate = dropRate
+        self.dropOffsets = set(dropOffsets)
+        self.corruptOffsets = set(corruptOffsets)
+        self.stallOffset = stallOffset
+        self.stallTime = stallTime
+        self.swapOffset = swapOffset
+        self.swapROM = swapROM
+        self._random = random.Random(seed)
+        self.bootTime = bootTime
+        self.maxBaudrate = maxBaudrate
+        self.linkBaudrate = self.DEFAULT_BAUDRATE  # rate negotiated with command 0x0E
+        self.busDelay = self.DEFAULT_BUS_DELAY  # us, set with command 0x11
+        self.hostBankSwitching = False  # set with command 0x14, the host maps the banks with command 0x13
+
+        self.bytesSent = 0
+        self.commands = []  # log of all received commands
+
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._slave)
+        os.set_blocking(self._master, False)
+        self.port = os.ttyname(self._slave)
+
+        self._received = bytearray()
+        self._stopEvent = Event()
+        self._thread = None
+
+    @classmethod
+    def fromFile(cls, filename, **kwargs):
+        """
+        Create a virtual reader serving the given .gb/.gbc file.
+        :param filename: Path of the ROM image
+        """
+        with open(filename, 'rb') as file:
+            return cls(file.read(), **kwargs)
+
+    def start(self):
+        self._stopEvent.clear()
+        self._thread = Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopEvent.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def close(self):
+        self.stop()
+        os.close(self._master)
+        os.close(self._slave)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+    #######################################################################################
+    # Firmware emulation
+    #####
+    def _run(self):
+        bootEnd = time.perf_counter() + self.bootTime
+        while not self._stopEvent.is_set():
+            command = self._receiveByte()
+            if command is None:
+                return
+
+            if time.perf_counter() < bootEnd:
+                continue  # still booting
+
+            self.commands.append(command)
+            self._handleCommand(command)
+
+    def _receiveByte(self, timeout=None):
+        """
+        Wait for the next received byte like UART_receiveByte.
+        :param timeout: Seconds to wait at most like UART_receiveByteTimeout, default: forever
+        :return: Byte as int or None if the reader was stopped or the timeout passed
+        """
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        while len(self._received) == 0:
+            if self._stopEvent.is_set() or (deadline is not None and time.perf_counter() > deadline):
+                return None
+
+            readable, _, _ = select.select([self._master], [], [], 0.05)
+            if not readable:
+                continue
+
+            try:
+                self._received += os.read(self._master, 64)
+            except (BlockingIOError, OSError):
+                continue
+
+        byte = self._received[0]
+        del self._received[0]
+        return byte
+
+    def _handleCommand(self, command):
+        if command == 0x01:  # connection test -> response: 0xA0
+            self._send(command, [b'\xA0'], bus=False)
+        elif command == 0x02:  # cartridge type (0x0147)
+            self._send(command, [self._readRange(0x0147, 0x0147)])
+        elif command == 0x03:  # ROM size (0x0148)
+            self._send(command, [self._readRange(0x0148, 0x0148)])
+        elif command == 0x04:  # CGB flag (0x0143)
+            self._send(command, [self._readRange(0x0143, 0x0143)])
+        elif command == 0x05:  # game title (0x0134-0x0143)
+            self._send(command, [self._readRange(0x0134, 0x0143)])
+        elif command == 0x06:  # nintendo logo (0x0104-0x0133)
+            self._send(command, [self._readRange(0x0104, 0x0133)])
+        elif command == 0x07:  # game data
+            self._send(command, self._readGameData())
+        elif command == 0x08:  # global checksum (0x014E-0x014F)
+            self._send(command, [self._readRange(0x014E, 0x014F)])
+        elif self.protocolVersion < 2:
+            return  # unknown command, ignored like by the original firmware
+        elif command == 0x09:  # protocol version
+            self._send(command, [bytes([self.protocolVersion])], bus=False)
+        elif command == 0x0A:  # header block (0x0100-0x014F) followed by 8 bit checksum
+            header = self._readRange(0x0100, 0x014F)
+            self._send(command, [header + bytes([-sum(header) & 0xFF])])
+        elif self.protocolVersion < 3:
+            return
+        elif command == 0x0B:  # read bank (bank number high byte, low byte)
+            high, low = self._receiveByte(), self._receiveByte()
+            if low is not None:
+                self._send(command, [self._readBank((high << 8) | low)])
+        elif self.protocolVersion < 4:
+            return
+        elif command == 0x0C:  # read bank framed: 0xA5, bank number, bank data, CRC-16/XMODEM of the bank data
+            high, low = self._receiveByte(), self._receiveByte()
+            if low is not None:
+                data = self._readBank((high << 8) | low)
+                crc = binascii.crc_hqx(data, 0)
+                self._send(command, [bytes([0xA5, high, low]) + data + bytes([crc >> 8, crc & 0xFF])])
+        elif self.protocolVersion < 5:
+            return
+        elif command == 0x0D:  # bank CRC: CRC-16/XMODEM of the bank data
+            high, low = self._receiveByte(), self._receiveByte()
+            if low is not None:
+                data = self._readBank((high << 8) | low)
+                if self.baudrate:
+                    self._wait(len(data) * self._busTime())  # the bank is read from the cartridge but not sent
+                crc = binascii.crc_hqx(data, 0)
+                self._send(command, [bytes([crc >> 8, crc & 0xFF])], bus=False)
+        elif self.protocolVersion < 6:
+            return
+        elif command == 0x0E:  # switch baud rate (UBRR high byte, low byte)
+            high, low = self._receiveByte(), self._receiveByte()
+            if low is not None:
+                self._switchBaudrate((high << 8) | low)
+        elif self.protocolVersion < 7:
+            return
+        elif command == 0x11:  # set bus delay (delay in us) -> response: the delay in use
+            delay = self._receiveByte()
+            if delay is not None:
+                self.busDelay = delay
+                self._send(command, [bytes([delay])], bus=False)
+        elif self.protocolVersion < 8:
+            return
+        elif command == 0x12:  # read bank compressed: run-length encoded bank data, CRC-16/XMODEM of the bank data
+            high, low = self._receiveByte(), self._receiveByte()
+            if low is not None:
+                data = self._readBank((high << 8) | low)
+                crc = binascii.crc_hqx(data, 0)
+                encoded = self._encodeRLE(data) + bytes([crc >> 8, crc & 0xFF])
+                if self.baudrate:  # every byte is read from the cartridge, only the encoded ones are sent
+                    self._wait(len(data) * self._busTime() - len(encoded) * self.FRAME_BITS / self.baudrate)
+                self._send(command, [encoded], bus=False)
+        elif self.protocolVersion < 9:
+            return
+        elif command == 0x13:  # write cartridge byte (address high byte, low byte, data)
+            high, low, data = self._receiveByte(), self._receiveByte(), self._receiveByte()
+            if data is not None:
+                self.cartridge.writeByte((high << 8) | low, data)
+        elif command == 0x14:  # host bank switching on (1) or off (0) -> response: the mode in use
+            mode = self._receiveByte()
+            if mode is not None:
+                self.hostBankSwitching = bool(mode)
+                self._send(command, [bytes([mode])], bus=False)
+        elif self.protocolVersion < 10:
+            return
+        elif command == 0x15:  # RAM block CRCs (address high byte, number of blocks): CRC-16/XMODEM of each block
+            high, count = self._receiveByte(), self._receiveByte()
+            if count is not None:
+                crcs = bytearray()
+                for block in range(count):
+                    crc = binascii.crc_hqx(self._readRAMBlock((high + block) & 0xFF), 0)
+                    crcs += bytes([crc >> 8, crc & 0xFF])
+                if self.baudrate:  # the blocks are read from the cartridge but not sent
+                    self._wait(count * self.RAM_BLOCK_SIZE * self._busTime())
+                self._send(command, [bytes(crcs)], bus=False)
+        elif command == 0x16:  # read RAM block (address high byte): block data, CRC-16/XMODEM of the block
+            high = self._receiveByte()
+            if high is not None:
+                block = self._readRAMBlock(high)
+                crc = binascii.crc_hqx(block, 0)
+                self._send(command, [block + bytes([crc >> 8, crc & 0xFF])])
+        elif command == 0x17:  # write RAM block (address high byte, block data, CRC-16/XMODEM) -> response: CRC of
+            # the block read back, a block received with a wrong CRC is not written
+            received = [self._receiveByte() for _ in range(1 + self.RAM_BLOCK_SIZE + 2)]
+            if None not in received:
+                high, block = received[0], bytes(received[1:-2])
+                if binascii.crc_hqx(block, 0) == (received[-2] << 8) + received[-1]:
+                    for index, data in enumerate(block):
+                        self.cartridge.writeByte((high << 8) | index, data)
+                    if self.baudrate:
+                        self._wait(len(block) * self._busTime())
+                crc = binascii.crc_hqx(self._readRAMBlock(high), 0)
+                if self.baudrate:
+                    self._wait(self.RAM_BLOCK_SIZE * self._busTime())
+                self._send(command, [bytes([crc >> 8, crc & 0xFF])], bus=False)
+
+    def _switchBaudrate(self, ubrr):
+        """
+        Baud rate switch like UART_switchBaudrate. Above maxBaudrate the host receives a garbled test pattern.
+        """
+        baudrate = self.READER_CLOCK / (8 * (ubrr + 1))
+        self._write(b'\xA1')
+        if self._receiveByte(self.BAUD_CONFIRM_TIMEOUT) != 0x0F:
+            return
+
+        pattern = bytes(range(0, 256))
+        if self.maxBaudrate is not None and baudrate > self.maxBaudrate:
+            pattern = bytes(byte ^ self._random.randrange(1, 256) for byte in pattern)
+
+        previous = self.baudrate
+        if self.baudrate:
+            self.baudrate = baudrate  # pacing follows the negotiated rate
+        self._write(pattern)
+
+        if self._receiveByte(self.BAUD_CONFIRM_TIMEOUT) != 0x10:
+            self.baudrate = previous
+            return
+        self.linkBaudrate = baudrate
+        self._write(b'\xA2')
+
+    def _readRange(self, start, end):
+        return self._busRead(bytes(self.cartridge.readByte(address) for address in range(start, end + 1)))
+
+    def _readGameData(self):
+        numberOfBanks = self._bankCount(self.cartridge.readByte(0x0148))
+        if numberOfBanks is None:
+            return
+
+        for bank in range(0, numberOfBanks):
+            yield self._readBank(bank, hostBankSwitching=False)  # the firmware always switches the banks here
+
+    def _readBank(self, bank, hostBankSwitching=None):
+        if hostBankSwitching is None:
+            hostBankSwitching = self.hostBankSwitching
+
+        if bank == 0:
+            return self._busRead(self.cartridge.readMapped(0x0000))
+        if hostBankSwitching:
+            return self._busRead(self.cartridge.readMapped(0x4000))
+        return self._busRead(self.cartridge.readBank(bank))
+
+    def _readRAMBlock(self, high):
+        return self._busRead(bytes(self.cartridge.readByte((high << 8) | low) for low in range(self.RAM_BLOCK_SIZE)))
+
+    def _encodeRLE(self, data):
+        """
+        Run-length encoding like GBC_sendBankCompressed.
+        """
+        encoded = bytearray()
+        for run in re.finditer(b'(.)\\1*', data, re.DOTALL):
+            value, count = data[run.start()], run.end() - run.start()
+            if count >= self.RLE_MIN_RUN or value == self.RLE_ESCAPE:
+                encoded += bytes([self.RLE_ESCAPE, count >> 8, count & 0xFF, value])
+            else:
+                encoded += run.group()
+        return bytes(encoded)
+
+    def _busRead(self, data):
+        """
+        Data as sampled by the reader. Below the access time of the cartridge a byte may be sampled before the bus
+        settled, the shorter the delay the more likely, and the reader gets the previous value of the bus instead.
+        """
+        if self.busDelay >= self.cartridge.accessTime:
+            return data
+
+        errorRate = 1 - self.busDelay / self.cartridge.accessTime
+        sampled = bytearray(data)
+        for index in range(1, len(sampled)):
+            if self._random.random() < errorRate:
+                sampled[index] = data[index - 1]
+        return bytes(sampled)
+
+    @staticmethod
+    def _bankCount(romSize):
+        if romSize <= 8:
+            return 2 ** (romSize + 1)
+        return {0x52: 72, 0x53: 80, 0x54: 96}.get(romSize)
+
+    #######################################################################################
+    # Link emulation
+    #####
+    def _send(self, command, chunks, bus=True):
+        """
+        Send the response chunks, applying link timing and (for faultCommand) fault injection.
+        Chunks are generated lazily, so a cartridge swap takes effect for all following bytes.
+        :param bus: The response is read from the cartridge, each byte takes at least the bus time
+        """
+        busTime = self._busTime() if bus else 0
+        faulty = command == self.faultCommand
+        offset = 0
+        for chunk in chunks:
+            if self._stopEvent.is_set():
+                return
+
+            if faulty:
+                chunk = self._injectFaults(chunk, offset)
+            offset += len(chunk)
+            self._write(chunk, busTime)
+
+    def _injectFaults(self, chunk, offset):
+        end = offset + len(chunk)
+
+        if self.swapOffset is not None and offset <= self.swapOffset < end:
+            position = self.swapOffset - offset
+            swapped = VirtualCartridge(self.swapROM)
+            self._write(chunk[:position])
+            chunk = swapped.rom[self.swapOffset:end] if self.swapOffset < 0x4000 else \
+                swapped.readBank(self.cartridge.bank)[position:]
+            self.cartridge = swapped
+            self.swapOffset = None
+            offset += position
+            end = offset + len(chunk)
+
+        if self.stallOffset is not None and offset <= self.stallOffset < end:
+            position = self.stallOffset - offset
+            self._write(chunk[:position])
+            self._wait(self.stallTime)
+            chunk = chunk[position:]
+            offset += position
+            self.stallOffset = None
+
+        corrupted = [index for index in self.corruptOffsets if offset <= index < end]
+        if corrupted:
+            chunk = bytearray(chunk)
+            for index in corrupted:
+                chunk[index - offset] ^= 0xFF
+            self.corruptOffsets.difference_update(corrupted)
+
+        if self.dropRate > 0 or self.dropOffsets:
+            dropped = set(index for index in self.dropOffsets if offset <= index < end)
+            self.dropOffsets -= dropped
+            chunk = bytes(byte for index, byte in enumerate(chunk, offset)
+                          if index not in dropped and not self._random.random() < self.dropRate)
+
+        return chunk
+
+    def _busTime(self):
+        return self.busDelay * 1e-6 + self.BUS_OVERHEAD
+
+    def _byteTime(self, busTime=0.0):
+        byteTime = self.latency
+        if self.baudrate:
+            byteTime += max(self.FRAME_BITS / self.baudrate, busTime)  # reading the next byte overlaps sending
+        return byteTime
+
+    def _write(self, data, busTime=0.0):
+        view = memoryview(data)
+        byteTime = self._byteTime(busTime)
+        # throttled links are written in small slices, so the timing stays close to the emulated one
+        sliceSize = len(view) if byteTime == 0 else max(1, int(0.005 / byteTime))
+        deadline = time.perf_counter()
+
+        while len(view) > 0 and not self._stopEvent.is_set():
+            _, writable, _ = select.select([], [self._master], [], 0.05)
+            if not writable:
+                continue
+
+            try:
+                count = os.write(self._master, view[:sliceSize])
+            except BlockingIOError:
+                continue
+            view = view[count:]
+            self.bytesSent += count
+
+            if byteTime:
+                deadline += count * byteTime
+                self._wait(deadline - time.perf_counter())
+
+    def _wait(self, seconds):
+        if seconds > 0:
+            self._stopEvent.wait(seconds)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Serve a ROM image as virtual GB reader on a pseudo-terminal")
+    parser.add_argument("rom", help=".gb/.gbc image")
+    parser.add_argument("--latency", type=float, default=0.0, help="delay per byte in seconds")
+    parser.add_argument("--baudrate", type=int, default=None, help="emulated baud rate")
+    args = parser.parse_args()
+
+    with VirtualGBReader.fromFile(args.rom, latency=args.latency, baudrate=args.baudrate) as reader:
+        print("Virtual GB reader listening on " + reader.port)
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
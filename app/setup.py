@@ -4,7 +4,7 @@ from cx_Freeze import setup, Executable
 # Dependencies are automatically detected, but it might need fine tuning.
 build_exe_options = {"includes": ["tkinter"],
                      "include_files": ["tcl86t.dll", "tk86t.dll", "icon.ico"],
-                     "excludes": ["email", "html", "http", "pydoc_data", "unittest", "xml", "urllib"]}
+                     "excludes": ["email", "html", "http", "pydoc_data", "unittest", "urllib"]}
 
 # Definition of shortcuts created during installation
 shortcut_table = [
@@ -49,6 +49,10 @@ setup(name = "GBC-Reader",
       version = "0.1",
       description = "Game Boy Cartridge Reader Software",
       author="Fabian Friedl", author_email="tiacs@tiacs.net",
+      install_requires = ["pyserial>=3.5"],
       options = {"build_exe": build_exe_options, "bdist_msi": bdist_msi_options},
       executables = [Executable("main.py", base=base, icon="icon.ico", targetName="gbc-reader.exe",
+                                copyright="(c) Fabian Friedl 2017"),
+                     # headless command line interface, always a console application
+                     Executable("ReaderCLI.py", icon="icon.ico", targetName="gbc-reader-cli.exe",
                                 copyright="(c) Fabian Friedl 2017")])
@@ -0,0 +1,72 @@
+# Copyright (c) 2017 Fabian Friedl
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Run with "python -m unittest" in this directory. The tests talk to the virtual reader, no hardware is needed.
+
+import os
+import tempfile
+import unittest
+
+from GBReader import *
+from VirtualGBReader import VirtualGBReader, buildROM
+
+
+class ResumeGameDataTest(unittest.TestCase):
+    """
+    Interrupted streaming dumps (command 0x07) of firmware with the read bank command, with and without bank CRCs.
+    """
+
+    def setUp(self):
+        self.rom = buildROM(0x03, title="RESUME", cartridgeType=0x01)
+        self.directory = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.directory.name, "resume.gb")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def resume(self, protocolVersion, **faults):
+        device = VirtualGBReader(self.rom, protocolVersion=protocolVersion, **faults).start()
+        reader = GBReader(device.port, baudrates=())
+        try:
+            cartridge = reader.readCartridgeHeader()
+            with self.assertRaises(GBTransferException):
+                reader.readGameData(cartridge, lambda current, max: None, self.filename)
+
+            reader.resumeGameData(cartridge, lambda current, max: None, self.filename)
+            self.assertTrue(reader.checkGlobalChecksum(cartridge))
+            with open(self.filename, 'rb') as file:
+                self.assertEqual(file.read(), self.rom)
+        finally:
+            reader.close()
+            device.close()
+
+    def testResumeAfterLostByte(self):
+        for protocolVersion in (3, 5):
+            with self.subTest(protocolVersion=protocolVersion):
+                self.resume(protocolVersion, dropOffsets=[5 * GBReader.BANK_SIZE + 7])
+
+    def testResumeAfterStall(self):
+        for protocolVersion in (3, 5):
+            with self.subTest(protocolVersion=protocolVersion):
+                self.resume(protocolVersion, stallOffset=5 * GBReader.BANK_SIZE + 7, stallTime=2.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+# Copyright (c) 2017 Fabian Friedl
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Run with "python -m unittest" in this directory. The tests talk to the virtual reader, no hardware is needed.
+
+import unittest
+
+from GBReader import *
+from ROMView import ROMView
+from VirtualGBReader import VirtualGBReader, buildROM
+
+
+class MBC1DriverTest(unittest.TestCase):
+
+    def setUp(self):
+        self.rom = buildROM(0x06, title="MBC1", cartridgeType=0x03, ramSize=0x03)  # 2 MiB, banks 0x20/0x40/0x60
+        self.device = VirtualGBReader(self.rom).start()
+        self.reader = GBReader(self.device.port, baudrates=())
+        self.cartridge = self.reader.readCartridgeHeader()
+
+    def tearDown(self):
+        self.reader.close()
+        self.device.close()
+
+    def assertHeaderReadable(self):
+        cartridge = self.reader.readCartridgeHeader()
+        self.assertEqual(cartridge.cartridgeType, "MBC1+RAM+BATTERY")
+        self.assertEqual(cartridge.globalChecksum, self.cartridge.globalChecksum)
+        self.assertTrue(cartridge.headerValid())
+        return cartridge
+
+    def testHeaderAfterDump(self):
+        self.assertEqual(self.reader.readGameData(self.cartridge, lambda current, max: None), self.rom)
+        cartridge = self.assertHeaderReadable()
+        self.assertEqual(self.reader.readGameData(cartridge, lambda current, max: None), self.rom)
+
+    def testHeaderAfterRandomAccess(self):
+        view = ROMView(self.reader, self.cartridge)
+        self.assertEqual(view[0x60 * 0x4000:0x60 * 0x4000 + 16], self.rom[0x60 * 0x4000:0x60 * 0x4000 + 16])
+        self.assertHeaderReadable()
+
+    def testHeaderAfterSaveRAM(self):
+        self.device.cartridge.ram[0x6000:0x6010] = bytes(range(16))  # RAM bank 3, selected in mode 1
+        self.assertEqual(self.reader.readSaveRAM(self.cartridge), bytes(self.device.cartridge.ram))
+        self.assertHeaderReadable()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -23,9 +23,22 @@
 #define F_CPU 16000000UL
 #define BAUD 38400
 
+#define PROTOCOL_VERSION 10 // 1: commands 0x01-0x08, 2: + 0x09 (protocol version), 0x0A (header block), 3: + 0x0B (read bank)
+                           // 4: + 0x0C (read bank framed), 5: + 0x0D (bank CRC), 6: + 0x0E-0x10 (baud rate switch)
+                           // 7: + 0x11 (bus delay), 8: + 0x12 (read bank compressed)
+                           // 9: + 0x13 (write cartridge byte), 0x14 (host bank switching)
+                           // 10: + 0x15 (RAM block CRCs), 0x16 (read RAM block), 0x17 (write RAM block)
+#define FRAME_START 0xA5
+#define BAUD_CONFIRM_TIMEOUT 500 // ms until an unconfirmed baud rate is reverted
+#define DEFAULT_BUS_DELAY 50 // us between setting an address and reading or writing the data bus
+#define RLE_ESCAPE 0xD3 // starts a run (escape, count high byte, count low byte, value), unused opcode of the GB CPU
+#define RLE_MIN_RUN 5 // shorter runs are sent as they are
+#define RAM_BLOCK_SIZE 256 // bytes per block of the cartridge RAM (commands 0x15-0x17), blocks start at xx00
+
 #include <avr/io.h>
 #include <util/setbaud.h>
 #include <util/delay.h>
+#include <util/crc16.h>
 #include <avr/interrupt.h>
 #include <math.h>
 
@@ -94,6 +107,75 @@ unsigned char UART_receiveByte()
 	return UDR0;
 }
 
+int UART_receiveByteTimeout(const unsigned int timeout) // -1 if nothing was received within timeout ms
+{
+	for(unsigned long i = 0; i < timeout * 100UL; i++) {
+		if(UCSR0A & (1<<RXC0)) {
+			return UDR0;
+		}
+		_delay_us(10);
+	}
+
+	return -1;
+}
+
+void UART_sendByteAndWait(unsigned char data) // Send data and wait until it left the shift register
+{
+	while(!( UCSR0A & (1<<UDRE0)));
+
+	UCSR0A |= (1<<TXC0); // clear transmit complete flag
+	UDR0 = data;
+
+	while(!(UCSR0A & (1<<TXC0)));
+}
+
+unsigned int UART_getUBRR()
+{
+	return (UBRR0H << 8) | UBRR0L;
+}
+
+void UART_setUBRR(const unsigned int ubrr) // Baud rate = F_CPU / (8 * (ubrr + 1)) with U2X0
+{
+	UBRR0H = ubrr >> 8;
+	UBRR0L = ubrr;
+}
+
+void UART_switchBaudrate(const unsigned int ubrr)
+{
+	/*
+		Acknowledge at the old rate, send the test pattern at the new rate and keep it only if the host confirms
+		the pattern in time. Otherwise the host could not receive it and both return to the old rate.
+	*/
+	unsigned int previous = UART_getUBRR();
+	UART_sendByteAndWait(0xA1);
+	UART_setUBRR(ubrr);
+
+	if(UART_receiveByteTimeout(BAUD_CONFIRM_TIMEOUT) != 0x0F) {
+		UART_setUBRR(previous);
+		return;
+	}
+	for(unsigned int i = 0; i <= 0xFF; i++) {
+		UART_sendByte(i);
+	}
+
+	if(UART_receiveByteTimeout(BAUD_CONFIRM_TIMEOUT) != 0x10) {
+		while(!( UCSR0A & (1<<UDRE0)));
+		UART_setUBRR(previous);
+		return;
+	}
+	UART_sendByte(0xA2);
+}
+
+unsigned char busDelay = DEFAULT_BUS_DELAY; // set by the host (command 0x11) to the access time of the cartridge
+unsigned char hostBankSwitching = 0; // set by the host (command 0x14), the host maps the banks with command 0x13
+
+void GBC_waitBus()
+{
+	for(unsigned char i = 0; i < busDelay; i++) { // _delay_us needs a compile time constant
+		_delay_us(1);
+	}
+}
+
 unsigned char GBC_readByte(const unsigned char addressH, const unsigned char addressL)
 {
 	DDRC = 0x00; // set PORTC to input
@@ -102,7 +184,7 @@ unsigned char GBC_readByte(const unsigned char addressH, const unsigned char add
 	PORTA = addressL;	// Write low address to PORTA
 	PORTB = addressH;	// Write high address to PORTB
 
-	_delay_us(50);
+	GBC_waitBus();
 
 	// Get data from MBC
 	return PINC;
@@ -116,7 +198,7 @@ void GBC_writeByte(const unsigned char addressH, const unsigned char addressL, c
 	PORTA = addressL;
 	PORTB = addressH;
 
-	_delay_us(50);
+	GBC_waitBus();
 
 	PORTC = data;
 }
@@ -133,7 +215,140 @@ void GBC_setWriteMode()
 	PORTD &= ~(1<<PORTD2);	// Set !WR to 0
 }
 
+void GBC_writeRegister(const unsigned char addressH, const unsigned char addressL, const unsigned char data)
+{
+	GBC_writeByte(addressH, addressL, data);
+	GBC_setWriteMode();
+
+	GBC_waitBus();
+
+	GBC_setReadMode();
+}
+
+void GBC_switchBank(const unsigned int bank)
+{
+	GBC_writeRegister(0x20, 0x00, bank);
 
+	if(bank > 0xFF) { // 9th bank bit (MBC5, 0x3000) only needed for ROMs bigger than 4 MiB
+		GBC_writeRegister(0x30, 0x00, bank >> 8);
+	}
+}
+
+unsigned int GBC_readBank(const unsigned int bank, const unsigned char send) // Read bank 0 from 0x0000-0x3FFF, all other banks from 0x4000-0x7FFF
+{
+	unsigned int start = 0x0000;
+	unsigned int crc = 0; // CRC-16/XMODEM of the bank data
+	unsigned char data;
+
+	if(bank != 0) {
+		if(!hostBankSwitching) {
+			GBC_switchBank(bank);
+		}
+		start = 0x4000;
+	}
+
+	for(unsigned int i = start; i <= start + 0x3FFF; i++) {
+		data = GBC_readByte((char) (i >> 8), (char) i);
+		if(send) {
+			UART_sendByte(data);
+		}
+		crc = _crc_xmodem_update(crc, data);
+	}
+
+	return crc;
+}
+
+unsigned int GBC_sendBank(const unsigned int bank)
+{
+	return GBC_readBank(bank, 1);
+}
+
+void RLE_sendRun(const unsigned char value, unsigned int count)
+{
+	if(count >= RLE_MIN_RUN || value == RLE_ESCAPE) { // the escape byte itself is always sent as run
+		UART_sendByte(RLE_ESCAPE);
+		UART_sendByte(count >> 8);
+		UART_sendByte(count);
+		UART_sendByte(value);
+		return;
+	}
+
+	while(count-- > 0) {
+		UART_sendByte(value);
+	}
+}
+
+unsigned int GBC_sendBankCompressed(const unsigned int bank) // Like GBC_sendBank, runs of equal bytes are encoded
+{
+	unsigned int start = 0x0000;
+	unsigned int crc = 0; // CRC-16/XMODEM of the bank data
+	unsigned int count = 0;
+	unsigned char data, value = 0;
+
+	if(bank != 0) {
+		if(!hostBankSwitching) {
+			GBC_switchBank(bank);
+		}
+		start = 0x4000;
+	}
+
+	for(unsigned int i = start; i <= start + 0x3FFF; i++) {
+		data = GBC_readByte((char) (i >> 8), (char) i);
+		crc = _crc_xmodem_update(crc, data);
+
+		if(count > 0 && data != value) {
+			RLE_sendRun(value, count);
+			count = 0;
+		}
+		value = data;
+		count++;
+	}
+	RLE_sendRun(value, count);
+
+	return crc;
+}
+
+void GBC_selectRAM(const unsigned char selected) // !CS enables the cartridge RAM (0xA000-0xBFFF)
+{
+	if(selected) {
+		PORTD &= ~(1<<PORTD5);
+	} else {
+		PORTD |= (1<<PORTD5);
+	}
+}
+
+unsigned int GBC_readRAMBlock(const unsigned char addressH, const unsigned char send) // Block at addressH:00
+{
+	unsigned int crc = 0; // CRC-16/XMODEM of the block
+	unsigned char data;
+
+	GBC_selectRAM(1);
+	for(unsigned int i = 0; i < RAM_BLOCK_SIZE; i++) {
+		data = GBC_readByte(addressH, (char) i);
+		if(send) {
+			UART_sendByte(data);
+		}
+		crc = _crc_xmodem_update(crc, data);
+	}
+	GBC_selectRAM(0);
+
+	return crc;
+}
+
+void GBC_writeRAMBlock(const unsigned char addressH, const unsigned char *block)
+{
+	GBC_selectRAM(1);
+	for(unsigned int i = 0; i < RAM_BLOCK_SIZE; i++) {
+		GBC_writeByte(addressH, (char) i, block[i]);
+		GBC_setWriteMode();
+		GBC_waitBus();
+		PORTD |= (1<<PORTD2); // end the write before the bus is released, !RD stays 1
+		DDRC = 0x00;
+		PORTC = 0x00; // no pull-ups on the data bus
+	}
+	GBC_selectRAM(0);
+	GBC_setReadMode();
+}
 
 /*
 	A0-A7:	PORTA
@@ -142,6 +357,7 @@ void GBC_setWriteMode()
 
 	PD2:	!WR
 	PD3:	!RD
+	PD5:	!CS (cartridge RAM)
 */
 int main(void)
 {
@@ -151,20 +367,23 @@ int main(void)
 	DDRA = 0xFF; // AdressLow
 	DDRB = 0xFF; // AdressHigh
 	DDRC = 0x00; // Input of data
-	DDRD |= 1<<PORTD2 | 1<<PORTD3 | 1<<PORTD4; // PD2: !WR and PD3: !RD and PD4: Status LED
+	DDRD |= 1<<PORTD2 | 1<<PORTD3 | 1<<PORTD4 | 1<<PORTD5; // PD2: !WR and PD3: !RD and PD4: Status LED, PD5: !CS
 
 	Timer1_init();
 	UART_init();
 	sei();
 	
 	GBC_setReadMode();
+	GBC_selectRAM(0);
 	
 	PORTD |= 1<<PORTD4; // Set status LED to high
 
 	/*
 		Start process loop
 	*/
-	unsigned char receivedByte, data, romSize, numberOfBanks;
+	unsigned char receivedByte, data, romSize, checksum, addressH, addressL, mode, count;
+	unsigned int numberOfBanks, bank, crc, ubrr, receivedCRC;
+	unsigned char ramBlock[RAM_BLOCK_SIZE];
     while (1) {
 
 		if ((UCSR0A & (1<<RXC0))) {  // Check for serial transmission
@@ -211,7 +430,7 @@ int main(void)
 				LED_startBlinking();
 
 				romSize = GBC_readByte(0x01, 0x48);
-				if(romSize <= 7) {
+				if(romSize <= 8) {
 					numberOfBanks = pow(2, romSize+1);
 				} else if(romSize == 0x52) {
 					numberOfBanks = 72;
@@ -224,31 +443,14 @@ int main(void)
 				}
 				
 				/*
-					First read Bank00 and Bank01 (0x0000-0x7FFF)
+					First read Bank00 (0x0000-0x3FFF), then BankXX (0x4000-0x7FFF) for the remaining n - 1 banks
 				*/
-				for(unsigned int i = 0x0000; i <= 0x3FFF; i++) // 0x7FFF
-				{
-					data = GBC_readByte((char) (i >> 8), (char) i);
-					UART_sendByte(data);
-				}
-
-				/*
-					Second read BanXX (0x4000-0x7FFF) n times
-				*/
-				for(unsigned char bank = 1; bank <= numberOfBanks; bank++) {
-					// perform bank switch
-					GBC_writeByte(0x20, 0x00, bank);
-					GBC_setWriteMode();	
-
-					_delay_us(50);
-
-					GBC_setReadMode();
-					// read bank
-					for(unsigned int i = 0x4000; i <= 0x7FFF; i++) {
-						data = GBC_readByte((char) (i >> 8), (char) i);
-						UART_sendByte(data);
-					}
+				mode = hostBankSwitching;
+				hostBankSwitching = 0; // the whole ROM is read in one go, the banks can only be switched here
+				for(unsigned int bank = 0; bank < numberOfBanks; bank++) {
+					GBC_sendBank(bank);
 				}
+				hostBankSwitching = mode;
 				
 				LED_stopBlinking();
 				break;
@@ -260,6 +462,138 @@ int main(void)
 					UART_sendByte(data);
 				}
 
+				LED_stopBlinking();
+				break;
+			case 0x09: // Read protocol version
+				UART_sendByte(PROTOCOL_VERSION);
+				break;
+			case 0x0A: // Read header block (address 0x0100-0x014F) followed by 8 bit checksum
+				LED_startBlinking();
+
+				checksum = 0;
+				for(unsigned int i = 0x0100; i <= 0x014F; i++) {
+					data = GBC_readByte((char) (i >> 8), (char) i);
+					UART_sendByte(data);
+					checksum -= data;
+				}
+				UART_sendByte(checksum); // sum of block and checksum is 0
+
+				LED_stopBlinking();
+				break;
+			case 0x0B: // Read bank (bank number high byte, low byte follow)
+				LED_startBlinking();
+
+				bank = UART_receiveByte() << 8;
+				bank |= UART_receiveByte();
+				GBC_sendBank(bank);
+
+				LED_stopBlinking();
+				break;
+			case 0x0C: // Read bank framed: FRAME_START, bank number (high, low), bank data, CRC-16/XMODEM (high, low)
+				LED_startBlinking();
+
+				bank = UART_receiveByte() << 8;
+				bank |= UART_receiveByte();
+
+				UART_sendByte(FRAME_START);
+				UART_sendByte(bank >> 8);
+				UART_sendByte(bank);
+				crc = GBC_sendBank(bank);
+				UART_sendByte(crc >> 8);
+				UART_sendByte(crc);
+
+				LED_stopBlinking();
+				break;
+			case 0x0D: // Bank CRC (bank number high byte, low byte follow): CRC-16/XMODEM of the bank data (high, low)
+				LED_startBlinking();
+
+				bank = UART_receiveByte() << 8;
+				bank |= UART_receiveByte();
+
+				crc = GBC_readBank(bank, 0);
+				UART_sendByte(crc >> 8);
+				UART_sendByte(crc);
+
+				LED_stopBlinking();
+				break;
+			case 0x0E: // Switch baud rate (UBRR high byte, low byte follow), see UART_switchBaudrate
+				ubrr = UART_receiveByte() << 8;
+				ubrr |= UART_receiveByte();
+				UART_switchBaudrate(ubrr);
+				break;
+			case 0x11: // Set bus delay (delay in us follows) -> response: the delay in use
+				busDelay = UART_receiveByte();
+				UART_sendByte(busDelay);
+				break;
+			case 0x12: // Read bank compressed (bank number high byte, low byte follow): run-length encoded bank data,
+			           // CRC-16/XMODEM of the bank data (high, low)
+				LED_startBlinking();
+
+				bank = UART_receiveByte() << 8;
+				bank |= UART_receiveByte();
+
+				crc = GBC_sendBankCompressed(bank);
+				UART_sendByte(crc >> 8);
+				UART_sendByte(crc);
+
+				LED_stopBlinking();
+				break;
+			case 0x13: // Write cartridge byte (address high byte, low byte, data follow), e.g. to an MBC register
+				addressH = UART_receiveByte();
+				addressL = UART_receiveByte();
+				data = UART_receiveByte();
+				GBC_writeRegister(addressH, addressL, data);
+				break;
+			case 0x14: // Host bank switching on (1) or off (0), follows -> response: the mode in use
+			           // When on, 0x0B-0x0D and 0x12 read bank 0 from 0x0000-0x3FFF and all other banks from
+			           // 0x4000-0x7FFF as mapped by the host
+				hostBankSwitching = UART_receiveByte();
+				UART_sendByte(hostBankSwitching);
+				break;
+			case 0x15: // RAM block CRCs (address high byte, number of blocks follow): CRC-16/XMODEM of each block
+			           // (high, low). The host enables and maps the RAM with command 0x13.
+				LED_startBlinking();
+
+				addressH = UART_receiveByte();
+				count = UART_receiveByte();
+				for(unsigned char i = 0; i < count; i++) {
+					crc = GBC_readRAMBlock(addressH + i, 0);
+					UART_sendByte(crc >> 8);
+					UART_sendByte(crc);
+				}
+
+				LED_stopBlinking();
+				break;
+			case 0x16: // Read RAM block (address high byte follows): block data, CRC-16/XMODEM of the block (high, low)
+				LED_startBlinking();
+
+				addressH = UART_receiveByte();
+				crc = GBC_readRAMBlock(addressH, 1);
+				UART_sendByte(crc >> 8);
+				UART_sendByte(crc);
+
+				LED_stopBlinking();
+				break;
+			case 0x17: // Write RAM block (address high byte, block data, CRC-16/XMODEM of the data (high, low) follow)
+			           // -> response: CRC of the block read back. A block received with a wrong CRC is not written.
+				LED_startBlinking();
+
+				addressH = UART_receiveByte();
+				crc = 0;
+				for(unsigned int i = 0; i < RAM_BLOCK_SIZE; i++) {
+					ramBlock[i] = UART_receiveByte();
+					crc = _crc_xmodem_update(crc, ramBlock[i]);
+				}
+				receivedCRC = UART_receiveByte() << 8;
+				receivedCRC |= UART_receiveByte();
+				if(receivedCRC == crc) {
+					GBC_writeRAMBlock(addressH, ramBlock);
+				}
+
+				crc = GBC_readRAMBlock(addressH, 0);
+				UART_sendByte(crc >> 8);
+				UART_sendByte(crc);
+
 				LED_stopBlinking();
 				break;
 			}